@@ -0,0 +1,8 @@
+"""Benchmarks for ccplib and ccpweb that run on synthetic datasets,
+so they don't need any of the real data files:
+
+    python -m benchmarks.bench --out results.json
+
+synthetic.py writes the datasets, bench.py times the library and
+the web endpoints and writes the results as json.
+"""
@@ -0,0 +1,418 @@
+#!/usr/bin/env python
+#
+# bench.py
+#
+# Hannah Aizenman, 2012-03
+#
+# http://www.opensource.org/licenses/bsd-license.php
+
+"""Times reading (fromNetCDF, get_all_data), the algorithms, graph
+rendering and the ccpweb endpoints on synthetic datasets (see
+synthetic.py) and writes the results as json, so that runs can be
+compared to catch regressions:
+
+    python -m benchmarks.bench --out new.json --compare old.json
+
+Run from the top of the repository (ccpweb/ is added to the path).
+"""
+
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/2.7/library/os.html
+import os
+# http://docs.python.org/2.7/library/sys.html
+import sys
+# http://docs.python.org/2.7/library/time.html
+import time
+# http://docs.python.org/2.7/library/json.html
+import json
+# http://docs.python.org/2.7/library/shutil.html
+import shutil
+# http://docs.python.org/2.7/library/tempfile.html
+import tempfile
+# http://docs.python.org/2.7/library/platform.html
+import platform
+# http://docs.python.org/2.7/library/argparse.html
+import argparse
+# http://docs.python.org/2.7/library/subprocess.html
+import subprocess
+# http://docs.python.org/2.7/library/stringio.html
+import cStringIO
+
+# http://docs.scipy.org/doc/numpy-1.6.0/reference/
+import numpy as np
+# http://matplotlib.sourceforge.net/contents.html
+import matplotlib
+matplotlib.use('Agg')
+
+from benchmarks import synthetic
+
+# ccpweb isn't installed as a package, it runs from its folder
+CCPWEB_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                           os.path.pardir, 'ccpweb'))
+# modules that don't load matplotlib or Basemap (see 
+# tests/test_imports.py), and the seconds they should import in,
+# Basemap alone takes longer than this
+LIGHT_MODULES = ['ccplib.datahandlers.unpack', 'ccplib.algorithms.algutils',
+                 'ccplib.visualization.ccpgraph']
+IMPORT_BUDGET = 0.3
+IMPORT_SCRIPT = """
+import time
+start = time.time()
+import {}
+print(time.time() - start)
+"""
+
+class Suite(object):
+    """Runs the benchmarks and collects the results.
+    :Param repeat:
+        Number of timed runs of each benchmark (after one warm up run)
+    :Param pattern:
+        Only run benchmarks whose name contains pattern
+    """
+    def __init__(self, repeat=5, pattern=None):
+        self.repeat = repeat
+        self.pattern = pattern
+        self.results = []
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__,
+                                       [r['name'] for r in self.results])
+
+    def add(self, name, func, **info):
+        """Times func and records the result under name.
+        info (dataset, etc) is stored with the result.
+        """
+        if self.pattern and self.pattern not in name:
+            return None
+        result = dict(name=name, **info)
+        try:
+            result.update(timeit(func, self.repeat))
+        except Exception, e:
+            result['error'] = repr(e)
+        self.results.append(result)
+        report(result)
+        return result
+
+def timeit(func, repeat=5):
+    """Calls func once to warm up and then repeat times.
+    :Return:
+        dictionary of min, median, mean and max in milliseconds
+    """
+    func()
+    times = []
+    for i in xrange(repeat):
+        start = time.time()
+        func()
+        times.append((time.time() - start) * 1000.0)
+    return dict(repeat=repeat,
+                min_ms=round(min(times), 3),
+                median_ms=round(float(np.median(times)), 3),
+                mean_ms=round(float(np.mean(times)), 3),
+                max_ms=round(max(times), 3))
+
+def report(result):
+    if 'error' in result:
+        print("{name:<50} ERROR {error}".format(**result))
+    else:
+        print("{name:<50} {median_ms:>10.2f} ms (min {min_ms:.2f})"
+              .format(**result))
+    sys.stdout.flush()
+
+def open_dataset(spec, file_path, **kwargs):
+    """Returns the CCPData object of a synthetic dataset,
+    kwargs are passed to fromNetCDF
+    """
+    from ccplib.datahandlers import unpack
+    return unpack.fromNetCDF(file_path, name=spec.name, scrnlog=False,
+                             txtlog=False, create_folder=False,
+                             gridded=spec.gridded, **kwargs)
+
+def selections(data_obj, spec):
+    """Selections (get_all_data kwargs) of increasing size:
+    a time series at a point, one map, a region for a year,
+    one year of everything and everything.
+    """
+    year = dict(start=[1880, 1], end=[1880, 12])
+    region = dict(top=40, bottom=-40, left=100, right=200)
+    found = [('region_year', dict(coords=region, time_range=year)),
+             ('year', dict(time_range=year)),
+             ('all', dict())]
+    if spec.gridded:
+        (lat, lon) = point(data_obj)
+        coords = dict(top=lat, bottom=lat, left=lon, right=lon)
+        found.insert(0, ('map', dict(time_range=dict(start=[1880, 1],
+                                                     end=[1880, 1]))))
+        found.insert(0, ('point', dict(coords=coords)))
+    return found
+
+def point(data_obj):
+    """A grid point in the northern hemisphere"""
+    return (float(data_obj.lat[len(data_obj.lat)//4]),
+            float(data_obj.lon[len(data_obj.lon)//2]))
+
+def library_benchmarks(suite, spec, file_path):
+    """fromNetCDF, get_all_data, algorithms and graphs on one dataset
+    """
+    from ccplib.algorithms import statistics, regression, quantile
+    from ccplib.algorithms import correlation, eof, spectral, extremes
+    from ccplib.algorithms import regional
+    from ccplib.visualization import spatial, temporal
+
+    info = dict(group='ccplib', dataset=spec.name, size=spec.size())
+    prefix = "ccplib.{}.".format(spec.name)
+    suite.add(prefix + "fromNetCDF",
+              lambda: open_dataset(spec, file_path), **info)
+    # reads go to the file every time
+    data_obj = open_dataset(spec, file_path, slice_cache=False)
+    found = selections(data_obj, spec)
+    for name, kwargs in found:
+        suite.add(prefix + "get_all_data." + name,
+                  lambda: data_obj.get_all_data(**kwargs), **info)
+    for dtype in ['float32', 'packed']:
+        suite.add(prefix + "get_all_data.all." + dtype,
+                  lambda: data_obj.get_all_data(dtype=dtype), **info)
+    cached = open_dataset(spec, file_path)
+    (name, kwargs) = found[0]
+    suite.add(prefix + "get_all_data.{}.cached".format(name),
+              lambda: cached.get_all_data(**kwargs), **info)
+
+    data = data_obj.get_all_data()
+    for name in ['mean', 'std']:
+        alg = getattr(statistics, name)
+        suite.add(prefix + "statistics." + name,
+                  lambda: alg(data_obj, data), **info)
+    # streamed from the file
+    suite.add(prefix + "regression.trend",
+              lambda: regression.trend(data_obj), **info)
+    suite.add(prefix + "quantile.exact",
+              lambda: quantile.quantile(data_obj, q=0.9), **info)
+    suite.add(prefix + "quantile.approximate",
+              lambda: quantile.quantile(data_obj, q=0.9, approximate=True),
+              **info)
+    (lat, lon) = (data_obj.lat[0], data_obj.lon[0])
+    suite.add(prefix + "correlation.point",
+              lambda: correlation.correlation(data_obj, lat=lat, lon=lon),
+              **info)
+    suite.add(prefix + "correlation.point.workers",
+              lambda: correlation.correlation(data_obj, lat=lat, lon=lon,
+                                              workers=4), **info)
+    suite.add(prefix + "eof.compute",
+              lambda: eof.EOFs.compute(data_obj, modes=3), **info)
+    suite.add(prefix + "spectral.peak",
+              lambda: spectral.spectral(data_obj), **info)
+    suite.add(prefix + "extremes.runs",
+              lambda: extremes.extremes(data_obj, out='runs', min_run=3),
+              **info)
+    region = dict(top=40, bottom=-40, left=100, right=200)
+    suite.add(prefix + "regional.regionmean",
+              lambda: regional.regionmean(data_obj, coords=region), **info)
+
+    if spec.gridded:
+        im = data_obj.get_all_data(time_range=dict(start=[1880, 1],
+                                                   end=[1880, 1]))
+        (lat, lon) = point(data_obj)
+        series = data_obj.get_all_data(coords=dict(top=lat, bottom=lat,
+                                                   left=lon, right=lon))
+    else:
+        im = None
+        series = statistics.mean(data_obj, data, axis=1)
+    if im is not None:
+        suite.add(prefix + "SpatialGraph",
+                  lambda: render(spatial.SpatialGraph, data_obj, im,
+                                 projection='moll'), **info)
+    suite.add(prefix + "TemporalGraph",
+              lambda: render(temporal.TemporalGraph, data_obj, series),
+              **info)
+
+def import_benchmarks(suite):
+    """Time to start python and import the modules workers and
+    scripts start with. The time of the import itself is kept as
+    import_ms, and the light modules taking longer than IMPORT_BUDGET
+    are reported.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [os.path.dirname(CCPWEB_PATH), CCPWEB_PATH]))
+    info = dict(group='import')
+    for module in LIGHT_MODULES + ['ccpweb.views',
+                                   'ccplib.visualization.spatial']:
+        command = [sys.executable, '-W', 'ignore', '-c',
+                   'import {}'.format(module)]
+        result = suite.add("import." + module,
+                           lambda: subprocess.check_call(command, env=env),
+                           **info)
+        if result is None or 'error' in result:
+            continue
+        seconds = min(import_seconds(module, env)
+                      for i in xrange(max(suite.repeat, 1)))
+        result['import_ms'] = round(seconds * 1000.0, 3)
+        if module in LIGHT_MODULES and seconds > IMPORT_BUDGET:
+            result['over_budget'] = True
+            print("{:<50} imports in {:.3f}s, over the {}s budget".format(
+                  module, seconds, IMPORT_BUDGET))
+
+def import_seconds(module, env):
+    """Seconds module takes to import in a new interpreter, 
+    without starting it
+    """
+    out = subprocess.check_output([sys.executable, '-W', 'ignore', '-c',
+                                   IMPORT_SCRIPT.format(module)], env=env)
+    return float(out.strip().splitlines()[-1])
+
+def render(graph_class, data_obj, im, **kwargs):
+    """Draws the graph into a string buffer"""
+    graph_obj = graph_class(data_obj, create_folder=False, **kwargs)
+    buf = cStringIO.StringIO()
+    graph_obj.ccpfig(im, buf)
+    return buf.getvalue()
+
+def wsgi_app(conf_path):
+    """Returns the ccpweb wsgi app serving the datasets configured
+    in conf_path.
+    """
+    if CCPWEB_PATH not in sys.path:
+        sys.path.insert(0, CCPWEB_PATH)
+    import ccpweb
+    from ccpweb import tasks
+    from ccpweb.registry import DATASETS
+    tasks.CONF_PATH = conf_path
+    DATASETS.clear()
+    return ccpweb.main({})
+
+def get(app, url):
+    """Requests url from the wsgi app, raising an error
+    if the response isn't a 200
+    """
+    from webob import Request
+    response = Request.blank(url).get_response(app)
+    if response.status_int != 200:
+        raise ValueError("{} returned {}".format(url, response.status))
+    return response.body
+
+def web_urls(spec, data_obj):
+    """Urls of the ccpweb endpoints for one dataset
+    """
+    (lat, lon) = point(data_obj)
+    pt = "{0:.2f}NT{0:.2f}NB{1:.2f}EL{1:.2f}ER".format(lat, lon)
+    region = "40NT40SB100EL200ER"
+    decade = "1880-01ST1889-12ED"
+    name = spec.name
+    urls = [('datalist', "/datalist"),
+            ('bootstrap', "/{}/bootstrap".format(name)),
+            ('menu', "/{}/menu".format(name)),
+            ('validrange', "/{}/validrange".format(name)),
+            ('grid', "/{}/grid".format(name)),
+            ('time', "/{}/time".format(name)),
+            ('graph.map', "/{}/graph/1880-01".format(name)),
+            ('graph.region', "/{}/graph/1880-01/{}".format(name, region)),
+            ('graph.region_series', "/{}/graph/{}/{}".format(name, decade, 
+                                                             region)),
+            ('graph.series', "/{}/graph/{}/{}".format(name, decade, pt)),
+            ('graph.mean', "/{}/graph/{}/ALGmean".format(name, decade)),
+            ('graph.trend', "/{}/graph/{}/ALGtrend".format(name, decade)),
+            ('graph.anomaly', "/{}/graph/1885-01/ALGanomaly".format(name)),
+            ('graph.djf', "/{}/graph/1880-12ST1881-02ED/"
+                          "ALGresample:freq=seasonal,season=DJF".format(name)),
+            ('graph.rolling', "/{}/graph/{}/ALGrolling:window=12".format(
+                                                              name, pt)),
+            ('graph.correlation', "/{}/graph/{}/ALGcorrelation:lat={:.2f}N,"
+                                  "lon={:.2f}E".format(name, decade, lat, lon)),
+            ('graph.eof', "/{}/graph/{}/ALGeof".format(name, decade)),
+            ('graph.spectrum', "/{}/graph/{}/ALGspectral:out=spectrum".format(
+                                                              name, pt)),
+            ('data.region', "/{}/data/{}/{}".format(name, decade, region)),
+            ('data.all', "/{}/data".format(name))]
+    return urls
+
+def web_benchmarks(suite, spec, file_path, app):
+    """The ccpweb endpoints of one (gridded) dataset through wsgi
+    """
+    data_obj = open_dataset(spec, file_path)
+    info = dict(group='ccpweb', dataset=spec.name, size=spec.size())
+    for name, url in web_urls(spec, data_obj):
+        suite.add("ccpweb.{}.{}".format(spec.name, name),
+                  lambda: get(app, url), url=url, **info)
+
+def environment():
+    """Versions of everything that affects the timings
+    """
+    env = dict(python=platform.python_version(),
+               platform=platform.platform(),
+               numpy=np.__version__,
+               matplotlib=matplotlib.__version__,
+               time=time.strftime('%Y-%m-%dT%H:%M:%S'))
+    try:
+        import netCDF4
+        env['netCDF4'] = netCDF4.__version__
+    except ImportError, e:
+        env['netCDF4'] = None
+    return env
+
+def compare(results, baseline, threshold=1.2):
+    """Prints the benchmarks that are slower than in the baseline
+    results by more than threshold (a ratio of the medians)
+    :Return:
+        list of (name, ratio) of the regressions
+    """
+    old = dict((r['name'], r) for r in baseline['results']
+               if 'median_ms' in r)
+    regressions = []
+    for result in results:
+        if result['name'] not in old or 'median_ms' not in result:
+            continue
+        ratio = result['median_ms'] / max(old[result['name']]['median_ms'],
+                                          1e-6)
+        if ratio > threshold:
+            regressions.append((result['name'], ratio))
+            print("REGRESSION {:<50} {:.2f}x".format(result['name'], ratio))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--out', help="write the results to this json file")
+    parser.add_argument('--compare',
+                        help="json results to check for regressions against")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--filter', dest='pattern',
+                        help="only run benchmarks whose name contains this")
+    parser.add_argument('--quick', action='store_true',
+                        help="only use the smallest dataset")
+    parser.add_argument('--no-web', dest='web', action='store_false')
+    parser.add_argument('--folder',
+                        help="write the datasets here and keep them")
+    args = parser.parse_args(argv)
+
+    specs = synthetic.SPECS[:1] if args.quick else synthetic.SPECS
+    folder = args.folder or tempfile.mkdtemp(prefix='ccpbench')
+    conf_path = os.path.join(folder, 'configs')
+    if not os.path.exists(conf_path):
+        os.mkdir(conf_path)
+    suite = Suite(args.repeat, args.pattern)
+    try:
+        import_benchmarks(suite)
+        paths = synthetic.make_all(folder, specs, conf_path)
+        for spec in specs:
+            library_benchmarks(suite, spec, paths[spec.name])
+        if args.web:
+            app = wsgi_app(conf_path)
+            for spec in specs:
+                if spec.gridded:
+                    web_benchmarks(suite, spec, paths[spec.name], app)
+    finally:
+        if not args.folder:
+            shutil.rmtree(folder)
+
+    output = dict(environment=environment(),
+                  datasets=[spec.__dict__ for spec in specs],
+                  results=suite.results)
+    if args.out:
+        with open(args.out, 'w') as out:
+            json.dump(output, out, indent=1, sort_keys=True)
+    regressions = []
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(suite.results, json.load(baseline))
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
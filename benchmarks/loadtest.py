@@ -0,0 +1,423 @@
+#!/usr/bin/env python
+#
+# loadtest.py
+#
+# Hannah Aizenman, 2012-03
+#
+# http://www.opensource.org/licenses/bsd-license.php
+
+"""Load test for ccpweb: a number of concurrent clients send a mix of
+requests (menu, validrange, time, graphs of random regions and time
+windows, data) or replay the urls of a log, and the throughput,
+latency percentiles, error rate and peak RSS of each endpoint are
+reported.
+
+In process, on synthetic datasets (see synthetic.py):
+
+    python -m benchmarks.loadtest --clients 4 --duration 30
+
+Against a running server (--pid to also track its memory):
+
+    python -m benchmarks.loadtest --url http://localhost:6543 --pid 1234
+
+Run from the top of the repository.
+"""
+
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/2.7/library/os.html
+import os
+# http://docs.python.org/2.7/library/re.html
+import re
+# http://docs.python.org/2.7/library/sys.html
+import sys
+# http://docs.python.org/2.7/library/time.html
+import time
+# http://docs.python.org/2.7/library/json.html
+import json
+# http://docs.python.org/2.7/library/random.html
+import random
+# http://docs.python.org/2.7/library/shutil.html
+import shutil
+# http://docs.python.org/2.7/library/tempfile.html
+import tempfile
+# http://docs.python.org/2.7/library/argparse.html
+import argparse
+# http://docs.python.org/2.7/library/threading.html
+import threading
+# http://docs.python.org/2.7/library/urllib2.html
+import urllib2
+# http://docs.python.org/2.7/library/resource.html
+import resource
+
+# http://docs.scipy.org/doc/numpy-1.6.0/reference/
+import numpy as np
+
+from benchmarks import synthetic, bench
+
+# relative weights of the endpoints in the default traffic mix
+MIX = dict(menu=2, validrange=2, time=2, graph=3, data=1)
+
+class InProcess(object):
+    """Sends requests straight to a wsgi app.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__, self.app)
+
+    def get(self, path):
+        """Returns (status, body)"""
+        from webob import Request
+        response = Request.blank(path).get_response(self.app)
+        return response.status_int, response.body
+
+class Http(object):
+    """Sends requests to a server over http.
+    :Param url:
+        Base url of the server, e.g. http://localhost:6543
+    """
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__, self.url)
+
+    def get(self, path):
+        try:
+            response = urllib2.urlopen(self.url + path)
+            return response.getcode(), response.read()
+        except urllib2.HTTPError, e:
+            return e.code, e.read()
+
+class Recorder(object):
+    """Latencies, errors and peak RSS of each endpoint,
+    shared by the client threads.
+    :Param pid:
+        Process whose memory is sampled after every request
+    """
+    def __init__(self, pid=None):
+        self._lock = threading.Lock()
+        self.pid = pid or os.getpid()
+        self.endpoints = dict()
+        self.start = time.time()
+        self.stop = None
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__, self.endpoints.keys())
+
+    def add(self, endpoint, seconds, ok):
+        rss = rss_bytes(self.pid)
+        with self._lock:
+            if endpoint not in self.endpoints:
+                self.endpoints[endpoint] = dict(latency=[], errors=0,
+                                                peak_rss=0)
+            stats = self.endpoints[endpoint]
+            stats['latency'].append(seconds * 1000.0)
+            if not ok:
+                stats['errors'] += 1
+            stats['peak_rss'] = max(stats['peak_rss'], rss)
+
+    def summary(self):
+        """Returns the per endpoint and overall numbers
+        """
+        elapsed = (self.stop or time.time()) - self.start
+        summary = dict(elapsed_s=round(elapsed, 3), endpoints=dict())
+        everything = dict(latency=[], errors=0, peak_rss=0)
+        for endpoint, stats in self.endpoints.items():
+            summary['endpoints'][endpoint] = summarize(stats, elapsed)
+            everything['latency'].extend(stats['latency'])
+            everything['errors'] += stats['errors']
+            everything['peak_rss'] = max(everything['peak_rss'],
+                                         stats['peak_rss'])
+        summary['total'] = summarize(everything, elapsed)
+        return summary
+
+def summarize(stats, elapsed):
+    latency = np.array(stats['latency'])
+    count = len(latency)
+    summary = dict(requests=count,
+                   throughput_rps=round(count / elapsed, 3) if elapsed else 0,
+                   error_rate=round(stats['errors'] / float(count), 4)
+                              if count else 0,
+                   peak_rss_mb=round(stats['peak_rss'] / 2.0**20, 1))
+    for p in [50, 95, 99]:
+        value = np.percentile(latency, p) if count else 0
+        summary['p{}_ms'.format(p)] = round(float(value), 3)
+    return summary
+
+def rss_bytes(pid):
+    """Current resident memory of a process (linux), falls back
+    to the peak of this process elsewhere.
+    """
+    try:
+        with open("/proc/{}/status".format(pid)) as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except IOError, e:
+        pass
+    # kilobytes on linux, bytes on os x
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak * 1024 if sys.platform.startswith('linux') else peak
+
+class Traffic(object):
+    """Generates random urls following a mix of endpoints, using the
+    grid and time range the server reports for each dataset.
+    :Param client:
+        InProcess or Http
+    :Param mix:
+        dictionary of relative weight by endpoint
+        (menu, validrange, time, grid, bootstrap, graph, data)
+    :Param seed:
+        Seed, so that a mix can be repeated
+    """
+    def __init__(self, client, mix=MIX, seed=0):
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.endpoints = sorted(mix)
+        weights = np.array([mix[e] for e in self.endpoints], dtype=float)
+        self.cumulative = np.cumsum(weights / weights.sum())
+        status, body = client.get("/datalist")
+        self.datasets = dict()
+        for name in json.loads(body)['names']:
+            status, valid = client.get("/{}/validrange".format(name))
+            # station datasets don't have a grid to draw maps on
+            if status != 200 or 'grid' not in json.loads(valid):
+                continue
+            status, grid = client.get("/{}/grid".format(name))
+            self.datasets[name] = dict(grid=json.loads(grid),
+                                       time=json.loads(valid)['time'])
+        if not self.datasets:
+            raise ValueError("no gridded datasets found")
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__, self.datasets.keys())
+
+    def next(self):
+        """Returns (endpoint, url)"""
+        with self._lock:
+            endpoint = self.endpoints[np.searchsorted(self.cumulative,
+                                                      self.random.random())]
+            name = self.random.choice(sorted(self.datasets))
+            dataset = self.datasets[name]
+            args = []
+            if endpoint == 'graph':
+                args = self.graph_args(dataset)
+            elif endpoint == 'data':
+                args = [self.window(dataset), self.region(dataset)]
+        return endpoint, "/".join([""] + [name, endpoint] + args)
+
+    def graph_args(self, dataset):
+        """A map of a region at one time, a time series at a point,
+        or the mean of a region over a window
+        """
+        kind = self.random.choice(['map', 'series', 'mean'])
+        if kind == 'map':
+            return [self.month(dataset), self.region(dataset)]
+        if kind == 'series':
+            return [self.window(dataset), self.region(dataset, point=True)]
+        return [self.window(dataset), self.region(dataset), 'ALGmean']
+
+    def years(self, dataset):
+        start = int(dataset['time']['start'][:4])
+        end = int(dataset['time']['end'][:4])
+        return start, end
+
+    def month(self, dataset):
+        start, end = self.years(dataset)
+        return "{}-{:02d}".format(self.random.randint(start, end - 1),
+                                  self.random.randint(1, 12))
+
+    def window(self, dataset):
+        start, end = self.years(dataset)
+        first = self.random.randint(start, end - 1)
+        last = self.random.randint(first, end - 1)
+        return "{}-01ST{}-12ED".format(first, last)
+
+    def region(self, dataset, point=False):
+        """Random region (at least 2x2 grid cells) or grid point
+        """
+        lat = axis_values(dataset['grid']['lat'])
+        lon = axis_values(dataset['grid']['lon'])
+        if point:
+            (top, bottom) = [self.random.choice(lat)] * 2
+            (left, right) = [self.random.choice(lon)] * 2
+        else:
+            (top, bottom) = self.span(lat)
+            (left, right) = self.span(lon)
+            (top, bottom) = (max(top, bottom), min(top, bottom))
+        return "{}T{}B{}L{}R".format(lat_str(top), lat_str(bottom),
+                                     lon_str(left), lon_str(right))
+
+    def span(self, values):
+        i = self.random.randint(0, len(values) - 3)
+        j = self.random.randint(i + 2, len(values) - 1)
+        return values[i], values[j]
+
+class Replay(object):
+    """Replays the urls of a log (one url per line, or http access
+    log lines) in order, looping over them.
+    """
+    def __init__(self, log_path):
+        self._lock = threading.Lock()
+        self.urls = read_urls(log_path)
+        if not self.urls:
+            raise ValueError("no urls in {}".format(log_path))
+        self.position = 0
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__, len(self.urls))
+
+    def next(self):
+        with self._lock:
+            url = self.urls[self.position % len(self.urls)]
+            self.position += 1
+        return endpoint_of(url), url
+
+def read_urls(log_path):
+    """Extracts the request paths of the GETs in a log file
+    """
+    urls = []
+    request = re.compile(r'"GET (\S+)')
+    with open(log_path) as log_file:
+        for line in log_file:
+            found = request.search(line)
+            if found:
+                urls.append(found.group(1))
+            elif line.strip().startswith('/'):
+                urls.append(line.strip())
+    return urls
+
+def endpoint_of(url):
+    """Name of the endpoint a url goes to:
+    /gistemp/graph/... is graph, /datalist is datalist
+    """
+    parts = [part for part in url.split('?')[0].split('/') if part]
+    if len(parts) >= 2:
+        return parts[1]
+    return parts[0] if parts else 'page'
+
+def axis_values(axis):
+    """Expands an axis encoded as {start, step, count} (see
+    tasks.encode_axis)
+    """
+    if isinstance(axis, dict):
+        return list(axis['start'] + axis['step'] * np.arange(axis['count']))
+    return list(axis)
+
+def lat_str(value):
+    return "{:.2f}{}".format(abs(value), 'N' if value >= 0 else 'S')
+
+def lon_str(value):
+    return "{:.2f}{}".format(abs(value), 'E' if value >= 0 else 'W')
+
+def run(client, source, recorder, clients=4, duration=None, requests=None):
+    """Runs the client threads until duration seconds have passed
+    or requests requests have been sent.
+    """
+    sent = [0]
+    lock = threading.Lock()
+    deadline = time.time() + duration if duration else None
+
+    def more():
+        with lock:
+            if requests is not None and sent[0] >= requests:
+                return False
+            sent[0] += 1
+        return deadline is None or time.time() < deadline
+
+    def worker():
+        while more():
+            endpoint, url = source.next()
+            start = time.time()
+            try:
+                status, body = client.get(url)
+                ok = (status < 400)
+            except Exception, e:
+                ok = False
+            recorder.add(endpoint, time.time() - start, ok)
+
+    recorder.start = time.time()
+    threads = [threading.Thread(target=worker) for i in range(clients)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    recorder.stop = time.time()
+    return recorder.summary()
+
+def report(summary):
+    columns = ['requests', 'throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms',
+               'error_rate', 'peak_rss_mb']
+    print("{:<12}".format('endpoint') +
+          "".join("{:>15}".format(c) for c in columns))
+    rows = sorted(summary['endpoints'].items()) + [('total',
+                                                    summary['total'])]
+    for endpoint, stats in rows:
+        print("{:<12}".format(endpoint) +
+              "".join("{:>15}".format(stats[c]) for c in columns))
+
+def parse_mix(mix_str):
+    """Parses menu=2,graph=1,... into a dictionary of weights
+    """
+    mix = dict()
+    for item in mix_str.split(','):
+        endpoint, weight = item.split('=')
+        mix[endpoint.strip()] = float(weight)
+    return mix
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', help="server to test, the default is "
+                        "the app in process on synthetic datasets")
+    parser.add_argument('--pid', type=int,
+                        help="pid of the server, to track its memory")
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10,
+                        help="seconds to run for")
+    parser.add_argument('--requests', type=int,
+                        help="number of requests to send instead")
+    parser.add_argument('--mix', type=parse_mix, default=MIX,
+                        help="weights, e.g. menu=2,graph=1,data=1")
+    parser.add_argument('--replay', help="log file of urls to replay")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--quick', action='store_true',
+                        help="only use the smallest synthetic dataset")
+    parser.add_argument('--out', help="write the results to this json file")
+    args = parser.parse_args(argv)
+    duration = None if args.requests else args.duration
+
+    folder = None
+    try:
+        if args.url:
+            client = Http(args.url)
+        else:
+            folder = tempfile.mkdtemp(prefix='ccpload')
+            specs = synthetic.SPECS[:1] if args.quick else synthetic.SPECS
+            synthetic.make_all(folder, specs, folder)
+            client = InProcess(bench.wsgi_app(folder))
+        if args.replay:
+            source = Replay(args.replay)
+        else:
+            source = Traffic(client, args.mix, args.seed)
+        recorder = Recorder(args.pid)
+        summary = run(client, source, recorder, args.clients, duration,
+                      args.requests)
+    finally:
+        if folder:
+            shutil.rmtree(folder)
+
+    summary.update(clients=args.clients, environment=bench.environment(),
+                   mix=None if args.replay else args.mix,
+                   replay=args.replay)
+    report(summary)
+    if args.out:
+        with open(args.out, 'w') as out:
+            json.dump(summary, out, indent=1, sort_keys=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
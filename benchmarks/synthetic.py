@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+#
+# synthetic.py
+#
+# Hannah Aizenman, 2012-03
+#
+# http://www.opensource.org/licenses/bsd-license.php
+
+"""Writes synthetic netcdf datasets shaped like the ones ccplib
+is used on (gistemp, ccsm, station records), so that the benchmarks
+and load tests are repeatable and run offline. The tests (of ccplib
+and ccpweb) use the small packed grids of packed_grid, through
+SyntheticCase.
+"""
+
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/2.7/library/os.html
+import os
+# http://docs.python.org/2.7/library/shutil.html
+import shutil
+# http://docs.python.org/2.7/library/datetime.html
+import datetime
+# http://docs.python.org/2.7/library/tempfile.html
+import tempfile
+# http://docs.python.org/2.7/library/unittest.html
+import unittest
+# http://docs.python.org/2.7/library/configparser.html
+import ConfigParser
+
+# http://docs.scipy.org/doc/numpy-1.6.0/reference/
+import numpy as np
+# http://docs.scipy.org/doc/scipy/reference/io.html
+import scipy.io.netcdf
+
+# packed values are stored as int16: value = packed*SCALE + OFFSET
+SCALE_FACTOR = 0.01
+ADD_OFFSET = 0.0
+PACKED_MISSING = -32767
+MISSING_VALUE = 9999.0
+# missing_value of the grids of trend_grid
+TREND_MISSING = -999
+
+class Spec(object):
+    """Description of a synthetic dataset.
+    :Param name:
+        Name of the dataset (also the file/folder name)
+    :Param nlat:
+        Number of latitudes (gridded)
+    :Param nlon:
+        Number of longitudes (gridded)
+    :Param ntime:
+        Number of monthly time steps
+    :Param packed:
+        Store the values as int16 with scale_factor and add_offset
+    :Param missing:
+        Fraction (0-1) of the values that are missing_value
+    :Param layout:
+        'file' for a single file, 'folder' for a folder with
+        one file per year
+    :Param gridded:
+        lat x lon grid if True, otherwise nlat*nlon stations
+        with their own lat and lon
+    :Param seed:
+        Seed for the random values
+    """
+    def __init__(self, name='synthetic', nlat=72, nlon=144, ntime=120,
+                 packed=False, missing=0.0, layout='file', gridded=True,
+                 seed=0):
+        if layout not in ('file', 'folder'):
+            raise ValueError("unknown layout: {}".format(layout))
+        self.name = name
+        self.nlat = nlat
+        self.nlon = nlon
+        self.ntime = ntime
+        self.packed = packed
+        self.missing = missing
+        self.layout = layout
+        self.gridded = gridded
+        self.seed = seed
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__,self.__dict__)
+
+    def size(self):
+        """Number of values in the data field"""
+        return self.ntime * self.nlat * self.nlon
+
+# the datasets the benchmarks run on by default
+SPECS = [Spec('small', nlat=36, nlon=72, ntime=120),
+         Spec('gistemp', nlat=72, nlon=144, ntime=1560, packed=True,
+              missing=0.2),
+         Spec('folder', nlat=72, nlon=144, ntime=240, layout='folder'),
+         Spec('stations', nlat=20, nlon=25, ntime=1200, gridded=False,
+              missing=0.1)]
+
+def make_dataset(folder, spec):
+    """Writes the dataset described by spec into folder.
+    :Return:
+        The file_path to pass to fromNetCDF (a file or a folder)
+    """
+    rng = np.random.RandomState(spec.seed)
+    lat = np.linspace(90 - 90.0/spec.nlat, -90 + 90.0/spec.nlat, spec.nlat)
+    lon = np.linspace(180.0/spec.nlon, 360 - 180.0/spec.nlon, spec.nlon)
+    if not spec.gridded:
+        # scatters the stations around the globe
+        lat = rng.uniform(-89, 89, spec.nlat*spec.nlon).round(2)
+        lon = rng.uniform(0, 359, spec.nlat*spec.nlon).round(2)
+    # middle of each month
+    time = np.round(np.arange(spec.ntime) * 365.25/12 + 15)
+    values = synthetic_values(rng, spec, lat)
+
+    if spec.layout == 'file':
+        file_path = os.path.join(folder, "{}.nc".format(spec.name))
+        write_file(file_path, spec, time, lat, lon, values)
+        return file_path
+
+    file_path = os.path.join(folder, spec.name)
+    if not os.path.exists(file_path):
+        os.mkdir(file_path)
+    for year, start in enumerate(xrange(0, spec.ntime, 12)):
+        stop = min(start + 12, spec.ntime)
+        path = os.path.join(file_path, "{}_{:04d}.nc".format(spec.name, year))
+        write_file(path, spec, time[start:stop], lat, lon,
+                   values[start:stop])
+    return file_path
+
+def synthetic_values(rng, spec, lat):
+    """Seasonal cycle that depends on latitude plus noise,
+    with spec.missing of the values set to MISSING_VALUE.
+    """
+    months = np.arange(spec.ntime) % 12
+    season = np.cos(2 * np.pi * months / 12.0)
+    if spec.gridded:
+        shape = (spec.ntime, spec.nlat, spec.nlon)
+        amplitude = (np.abs(lat) / 9.0)[None, :, None]
+        season = season[:, None, None]
+    else:
+        shape = (spec.ntime, len(lat))
+        amplitude = (np.abs(lat) / 9.0)[None, :]
+        season = season[:, None]
+    values = season * amplitude + rng.standard_normal(shape)
+    if spec.missing:
+        values[rng.uniform(size=shape) < spec.missing] = MISSING_VALUE
+    return values
+
+def write_file(file_path, spec, time, lat, lon, values):
+    """Writes one netcdf file. Time is the record (unlimited) dimension
+    so that folders can be read as a single dataset.
+    """
+    nc = scipy.io.netcdf.netcdf_file(file_path, 'w', version=2)
+    try:
+        nc.createDimension('time', None)
+        time_var = nc.createVariable('time', 'f8', ('time',))
+        time_var.units = 'days since 1880-01-01'
+        time_var.long_name = 'time'
+        if spec.gridded:
+            nc.createDimension('lat', len(lat))
+            nc.createDimension('lon', len(lon))
+            dims = ('time', 'lat', 'lon')
+            lat_var = nc.createVariable('lat', 'f4', ('lat',))
+            lon_var = nc.createVariable('lon', 'f4', ('lon',))
+        else:
+            nc.createDimension('station', len(lat))
+            dims = ('time', 'station')
+            lat_var = nc.createVariable('lat', 'f4', ('station',))
+            lon_var = nc.createVariable('lon', 'f4', ('station',))
+        lat_var.units = 'degrees_north'
+        lon_var.units = 'degrees_east'
+        lat_var[:] = lat
+        lon_var[:] = lon
+
+        if spec.packed:
+            temp = nc.createVariable('temp', 'i2', dims)
+            temp.scale_factor = SCALE_FACTOR
+            temp.add_offset = ADD_OFFSET
+            temp.missing_value = PACKED_MISSING
+            packed = np.round((values - ADD_OFFSET) / SCALE_FACTOR)
+            packed[values == MISSING_VALUE] = PACKED_MISSING
+            data = packed.astype('i2')
+        else:
+            temp = nc.createVariable('temp', 'f4', dims)
+            temp.missing_value = MISSING_VALUE
+            data = values.astype('f4')
+        temp.long_name = 'temperature anomaly'
+        temp.units = 'C'
+        # record variables are written a time step at a time
+        time_var[:len(time)] = time
+        temp[:len(time)] = data
+    finally:
+        nc.close()
+    return file_path
+
+def write_config(conf_path, spec, file_path):
+    """Writes the ccpweb config (see configs/README) for a dataset.
+    """
+    config = ConfigParser.SafeConfigParser()
+    config.add_section('data')
+    for key, value in [('name', spec.name), ('file_type', 'netcdf'),
+                       ('file_path', file_path), ('txtlog', 'False'),
+                       ('scrnlog', 'False'), ('create_folder', 'False'),
+                       ('gridded', str(spec.gridded))]:
+        config.set('data', key, value)
+    config.add_section('spatial_graph')
+    config.set('spatial_graph', 'projection', 'moll')
+    config.set('spatial_graph', 'alt_projection', 'mill')
+    config.set('spatial_graph', 'create_folder', 'False')
+    config.add_section('temporal_graph')
+    config.set('temporal_graph', 'create_folder', 'False')
+    cfg = os.path.join(conf_path, "{}.cfg".format(spec.name))
+    with open(cfg, 'w') as cfg_file:
+        config.write(cfg_file)
+    return cfg
+
+def make_all(folder, specs=SPECS, conf_path=None):
+    """Writes every dataset in specs (and its config if conf_path
+    is given) into folder.
+    :Return:
+        dictionary of file_path by dataset name
+    """
+    paths = dict()
+    for spec in specs:
+        paths[spec.name] = make_dataset(folder, spec)
+        if conf_path:
+            write_config(conf_path, spec, paths[spec.name])
+    return paths
+
+def packed_grid(folder, packed, lat, lon, scale_factor=SCALE_FACTOR,
+                add_offset=ADD_OFFSET, missing_value=None):
+    """Writes the int16 values packed (time, lat, lon), monthly from
+    January 1880, to synthetic.nc in folder.
+    :Return:
+        The file_path
+    """
+    file_path = os.path.join(folder, 'synthetic.nc')
+    ntime = len(packed)
+    nc = scipy.io.netcdf.netcdf_file(file_path, 'w')
+    try:
+        nc.createDimension('time', ntime)
+        nc.createDimension('lat', len(lat))
+        nc.createDimension('lon', len(lon))
+        time = nc.createVariable('time', 'f8', ('time',))
+        time.units = 'days since 1880-01-01'
+        # middle of every month
+        time[:] = [(datetime.date(1880 + m//12, m%12 + 1, 15) -
+                    datetime.date(1880, 1, 1)).days for m in range(ntime)]
+        lat_var = nc.createVariable('lat', 'f4', ('lat',))
+        lat_var[:] = lat
+        lon_var = nc.createVariable('lon', 'f4', ('lon',))
+        lon_var[:] = lon
+        temp = nc.createVariable('temp', 'i2', ('time', 'lat', 'lon'))
+        temp.scale_factor = scale_factor
+        temp.add_offset = add_offset
+        if missing_value is not None:
+            temp.missing_value = missing_value
+        temp[:] = packed
+    finally:
+        nc.close()
+    return file_path
+
+def trend_grid(folder, ntime=40):
+    """Writes a packed 6 x 8 grid of a trend plus noise, with some
+    TREND_MISSING values and a cell (the first) with too few values
+    :Return:
+        The file_path
+    """
+    rand = np.random.RandomState(0)
+    slopes = np.linspace(-3, 3, 48).reshape(6, 8)
+    packed = (slopes * np.arange(ntime)[:, None, None] +
+              rand.normal(0, 50, (ntime, 6, 8))).astype('i2')
+    packed[rand.rand(ntime, 6, 8) < 0.1] = TREND_MISSING
+    packed[2:, 0, 0] = TREND_MISSING
+    return packed_grid(folder, packed, np.linspace(75, -75, 6),
+                       np.arange(20, 360, 45), add_offset=10.0,
+                       missing_value=TREND_MISSING)
+
+class SyntheticCase(unittest.TestCase):
+    """Tests on a synthetic dataset written in a new folder for every
+    test (trend_grid of ntime steps, unless make_data is overridden).
+    setUp keeps:
+        folder, obj (the CCPData object), packed (every value as it
+        is in the file), valid (where packed isn't missing) and data
+        (the unpacked float64 values, masked where missing)
+    """
+    ntime = 40
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.obj = self.make_data()
+        self.packed = self.obj.get_all_data(dtype='packed')
+        missing_value = getattr(self.obj, 'missing_value', None)
+        self.valid = np.ones(self.packed.shape, bool)
+        if missing_value is not None:
+            self.valid = self.packed != missing_value
+        self.data = np.ma.masked_array(self.obj.unpack(self.packed,
+                                                       np.float64),
+                                       mask=~self.valid)
+
+    def tearDown(self):
+        del self.obj
+        shutil.rmtree(self.folder)
+
+    def make_data(self):
+        return open_grid(trend_grid(self.folder, self.ntime))
+
+def open_grid(file_path):
+    """Returns the CCPData object of a grid written by packed_grid
+    """
+    from ccplib.datahandlers import unpack
+    return unpack.fromNetCDF(file_path, scrnlog=False, txtlog=False,
+                             create_folder=False)
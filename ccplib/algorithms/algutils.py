@@ -8,11 +8,31 @@
 
 __docformat__ = "restructuredtext"
 
-from ccplib.algorithms import statistics
+from ccplib.algorithms import statistics, regression, anomaly, resample
+from ccplib.algorithms import rolling, quantile, correlation, eof, spectral
+from ccplib.algorithms import extremes, regional
 
 def dispatch():
     """Maps algorithm name to a function in ccplib.algorithms
     """
     algmap = dict(mean = statistics.mean,
-                  std = statistics.std)
-    return algmap
\ No newline at end of file
+                  std = statistics.std,
+                  trend = regression.trend,
+                  anomaly = anomaly.anomaly,
+                  climatology = anomaly.climatology,
+                  resample = resample.resample,
+                  rolling = rolling.rolling,
+                  quantile = quantile.quantile,
+                  correlation = correlation.correlation,
+                  eof = eof.eof,
+                  spectral = spectral.spectral,
+                  extremes = extremes.extremes,
+                  regionmean = regional.regionmean)
+    return algmap
+
+def streaming(alg):
+    """Whether alg reads the selection itself a chunk at a time 
+    (called as alg(DataObj, coords=..., time_range=..., **params))
+    rather than being handed all of it (alg(DataObj, data, **params))
+    """
+    return getattr(alg, 'streaming', False)
\ No newline at end of file
@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+#
+# anomaly.py
+#
+# Hannah Aizenman, 2012-03
+#
+# http://www.opensource.org/licenses/bsd-license.php
+
+"""Anomalies from a monthly or daily climatology of a base period.
+
+The climatology (the mean of every month, or day of the year, of
+every cell over the base period) is computed in one pass over the
+base period a chunk at a time, for the whole grid. It's small, so
+it's kept in memory and saved as a .npz file that every process
+(and later runs) can load, and an anomaly then costs a subtraction
+on top of reading the selection.
+"""
+
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/2.7/library/os.html
+import os
+# http://docs.python.org/2.7/library/hashlib.html
+import hashlib
+# http://docs.python.org/2.7/library/logging.html
+import logging
+# http://docs.python.org/2.7/library/tempfile.html
+import tempfile
+# http://docs.python.org/2.7/library/threading.html
+import threading
+
+# http://docs.scipy.org/doc/numpy-1.6.0/reference/
+import numpy as np
+
+import ccplib.misc.utils
+from ccplib.datahandlers import indices, slicecache
+from ccplib.algorithms.regression import missing
+
+log = logging.getLogger(ccplib.misc.utils.LOGNAME)
+
+# slots of a climatology, days are those of a leap year
+# so that the 29th of February has its own
+PERIODS = dict(monthly=12, daily=366)
+# first day of each month in a leap year
+LEAP_MONTH_STARTS = np.cumsum([0, 31, 29, 31, 30, 31, 30,
+                               31, 31, 30, 31, 30])
+
+def calendar_slots(DataObj, tslice, period='monthly'):
+    """Returns the slot (month 0-11 or day of the year 0-365)
+    of each time step in tslice
+    """
+    dates = indices.time_to_datetime64(DataObj.time[tslice],
+                                       DataObj.time_units)
+    months = dates.astype('M8[M]')
+    month = months.astype(np.int64) % 12
+    if period == 'monthly':
+        return month
+    day = (dates.astype('M8[D]') - months.astype('M8[D]')).astype(np.int64)
+    return LEAP_MONTH_STARTS[month] + day
+
+def parse_base(base):
+    """Converts a base period, 1951-1980, 1951 or (1951, 1980),
+    to a (first year, last year) tuple, None is every year
+    """
+    if base is None:
+        return None
+    if isinstance(base, basestring):
+        base = [int(year) for year in base.split('-')]
+    elif isinstance(base, (int, long)):
+        base = [base]
+    base = list(base)
+    return (base[0], base[-1])
+
+class Climatology(object):
+    """Mean of every slot (month or day of the year) of every cell.
+    :Param means:
+        Array (slots, ...) of the means, NaN where a cell has
+        no values in a slot
+    :Param counts:
+        Number of values behind each mean
+    """
+    def __init__(self, means, counts, period='monthly', base=None):
+        self.means = means
+        self.counts = counts
+        self.period = period
+        self.base = base
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__,
+                                       (self.period, self.base))
+
+    @classmethod
+    def compute(cls, DataObj, period='monthly', base=None, chunk_size=None):
+        """Computes the climatology of the whole grid over the base
+        period in one pass, a chunk of time steps at a time
+        """
+        nslots = PERIODS[period]
+        time_range = dict()
+        if base is not None:
+            time_range = dict(start=[base[0]], end=[base[1]])
+        shape = DataObj.selection_shape(time_range=time_range)
+        sums = np.zeros((nslots,) + shape[1:])
+        counts = np.zeros((nslots,) + shape[1:], np.int32)
+        # packed, so the missing values compare exactly
+        for tslice, data in DataObj.iter_chunks(chunk_size,
+                                                time_range=time_range,
+                                                dtype='packed'):
+            slots = calendar_slots(DataObj, tslice, period)
+            valid = ~missing(DataObj, data)
+            values = np.where(valid, DataObj.unpack(data, np.float64), 0.0)
+            for slot in np.unique(slots):
+                rows = slots == slot
+                sums[slot] += values[rows].sum(axis=0)
+                counts[slot] += valid[rows].sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = (sums / counts).astype(np.float32)
+        log.debug("climatology %s %s of %s computed", period, base,
+                  DataObj.data_key)
+        return cls(means, counts, period, base)
+
+    def save(self, file_path):
+        # written to a temporary file and renamed, so other
+        # processes never load half of it
+        folder = os.path.dirname(file_path)
+        (fd, tmp) = tempfile.mkstemp(suffix='.tmp', dir=folder)
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                np.savez(tmp_file, means=self.means, counts=self.counts)
+            os.rename(tmp, file_path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    @classmethod
+    def load(cls, file_path, period='monthly', base=None):
+        saved = np.load(file_path)
+        try:
+            return cls(saved['means'], saved['counts'], period, base)
+        finally:
+            saved.close()
+
+    def expected(self, DataObj, inds):
+        """Returns the climatological value of every element of the
+        selection inds (see CCPData.get_inds), not squeezed
+        """
+        slots = calendar_slots(DataObj, inds[0], self.period)
+        region = self.means[(slice(None),) + tuple(inds[1:])]
+        return region[slots]
+
+class ClimatologyCache(object):
+    """Climatologies in memory and saved in a folder, by dataset
+    version, period and base
+    :Param path:
+        Folder the climatologies are saved in, shared by every
+        process using it (default see default_path)
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._climatologies = dict()
+        # a lock per key, held while its climatology is loaded or
+        # computed, so other keys aren't held up
+        self._key_locks = dict()
+        self.counters = dict(hits=0, loads=0, computes=0)
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__, self.path)
+
+    def get(self, DataObj, period='monthly', base=None):
+        """Returns the climatology, loading or computing it once.
+        Callers for the same key wait for the first one, callers for
+        other keys don't.
+        """
+        key = (slicecache.dataset_token(DataObj), period, base)
+        with self._lock:
+            clim = self._climatologies.get(key)
+            if clim is not None:
+                self.counters['hits'] += 1
+                return clim
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                clim = self._climatologies.get(key)
+                if clim is not None:
+                    self.counters['hits'] += 1
+                    return clim
+            file_path = self.file_path(key)
+            if os.path.exists(file_path):
+                clim = Climatology.load(file_path, period, base)
+                counter = 'loads'
+            else:
+                clim = Climatology.compute(DataObj, period, base)
+                counter = 'computes'
+                try:
+                    clim.save(file_path)
+                except (IOError, OSError), e:
+                    log.warning("climatology not saved: %r", e)
+            with self._lock:
+                self.counters[counter] += 1
+                self._climatologies[key] = clim
+                self._key_locks.pop(key, None)
+            return clim
+
+    def file_path(self, key):
+        path = self.path or default_path()
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError, e:
+                if not os.path.isdir(path):
+                    raise
+        name = hashlib.sha1(repr(key)).hexdigest()
+        return os.path.join(path, name + '.npz')
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats.update(climatologies=len(self._climatologies),
+                         nbytes=sum(clim.means.nbytes for clim in
+                                    self._climatologies.itervalues()))
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._climatologies.clear()
+
+def default_path():
+    """Folder in the temp folder for the user running the process
+    """
+    return os.path.join(tempfile.gettempdir(),
+                        'ccplib-climatology-{}'.format(os.getuid()))
+
+def expected(DataObj, coords=None, time_range=None, period='monthly',
+             base=None):
+    """Returns the climatological values of the selection, masked 
+    where there are none, squeezed like get_all_data
+    """
+    if period not in PERIODS:
+        raise ValueError("period should be one of {}, not {!r}".format(
+                         sorted(PERIODS), period))
+    clim = CLIMATOLOGIES.get(DataObj, period, parse_base(base))
+    inds = DataObj.get_inds(time_range or dict(), coords or dict())
+    values = np.atleast_1d(np.squeeze(clim.expected(DataObj, inds)))
+    return np.ma.masked_invalid(values)
+
+def anomaly(DataObj, coords=None, time_range=None, period='monthly',
+            base=None):
+    """Departure of the selection from the climatology of the base period
+    :Param period:
+        monthly or daily climatology
+    :Param base:
+        First and last year of the base period, e.g. 1951-1980,
+        the default is every year in the dataset
+    """
+    clim = expected(DataObj, coords, time_range, period, base)
+    # read (or taken from the slice cache) as it is in the file
+    packed = DataObj.get_all_data(coords=coords or dict(), 
+                                  time_range=time_range or dict(),
+                                  dtype='packed')
+    data = np.ma.masked_array(DataObj.unpack(packed, np.float32),
+                              mask=missing(DataObj, packed))
+    return data - clim
+anomaly.streaming = True
+
+def climatology(DataObj, coords=None, time_range=None, period='monthly',
+                base=None):
+    """Climatological value of the base period at each time step
+    of the selection (see anomaly)
+    """
+    return expected(DataObj, coords, time_range, period, base)
+climatology.streaming = True
+
+# climatologies of this process
+CLIMATOLOGIES = ClimatologyCache()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+#
+# correlation.py
+#
+# Hannah Aizenman, 2012-03
+#
+# http://www.opensource.org/licenses/bsd-license.php
+
+"""Correlation maps (teleconnections): the correlation of the time
+series of one location, or the mean of a region, with the series of
+every cell.
+
+The reference series is read first (it's small), then the field is
+read a chunk of time steps at a time into the sums n, Sx, Sy, Sxx,
+Syy and Sxy of every cell, which are all r needs. A time step only
+counts in a cell if both the reference and the cell have a value.
+The field can be split into bands of latitudes (or sites) that are
+summed in parallel.
+"""
+
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/2.7/library/multiprocessing.html
+from multiprocessing.pool import ThreadPool
+
+# http://docs.scipy.org/doc/numpy-1.6.0/reference/
+import numpy as np
+
+from ccplib.datahandlers import indices
+from ccplib.algorithms.regression import missing
+
+OUTPUTS = ['r', 'pvalue', 'count']
+
+class CorrelationSums(object):
+    """Running sums of the correlation of a reference series x with
+    the series y of every cell.
+    :Param shape:
+        Shape of a time step of y
+    """
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self.n = np.zeros(shape, np.int64)
+        self.x = np.zeros(shape)
+        self.y = np.zeros(shape)
+        self.xx = np.zeros(shape)
+        self.yy = np.zeros(shape)
+        self.xy = np.zeros(shape)
+        # subtracted from y, so the sums of squares keep
+        # their precision (it doesn't change r)
+        self.shift = None
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__, self.shape)
+
+    def add(self, x, xvalid, y, yvalid):
+        """Adds a chunk of time steps.
+        :Param x:
+            Reference values of the chunk (1d)
+        :Param y:
+            Values of the cells, time first
+        """
+        y = np.asarray(y, np.float64)
+        valid = yvalid & xvalid.reshape((-1,) + (1,) * (y.ndim - 1))
+        if self.shift is None:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                shift = (np.where(valid, y, 0).sum(axis=0) /
+                         valid.sum(axis=0))
+            self.shift = np.where(np.isfinite(shift), shift, 0.0)
+        weight = valid.astype(np.float64)
+        x = np.where(xvalid, x, 0.0)
+        y = np.where(valid, y - self.shift, 0.0)
+        self.n += valid.sum(axis=0)
+        self.x += np.tensordot(x, weight, axes=1)
+        self.xx += np.tensordot(x * x, weight, axes=1)
+        self.y += y.sum(axis=0)
+        self.yy += np.einsum('i...,i...->...', y, y)
+        self.xy += np.tensordot(x, y, axes=1)
+
+    def correlate(self):
+        """Returns a dictionary of r, pvalue (two sided, of r being 0)
+        and count, r and pvalue masked where there are fewer than 3
+        values or either series is constant
+        """
+        from scipy import special
+        n = self.n.astype(np.float64)
+        safe_n = np.maximum(n, 1)
+        sxx = self.xx - self.x * self.x / safe_n
+        syy = self.yy - self.y * self.y / safe_n
+        sxy = self.xy - self.x * self.y / safe_n
+        bad = (self.n < 3) | (sxx <= 0) | (syy <= 0)
+        r = sxy / np.sqrt(np.where(bad, 1.0, sxx * syy))
+        r = np.clip(r, -1.0, 1.0)
+        dof = np.maximum(n - 2, 1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            tstat = np.abs(r) * np.sqrt(dof / (1.0 - r * r))
+        pvalue = 2.0 * special.stdtr(dof, -np.where(np.isnan(tstat),
+                                                    np.inf, tstat))
+        return dict(r=np.ma.masked_array(r, mask=bad),
+                    pvalue=np.ma.masked_array(pvalue, mask=bad),
+                    count=self.n)
+
+def nearest(DataObj, lat, lon):
+    """Returns the coords (top, bottom, left, right) of the grid point
+    (or site) closest to lat, lon, which can be numbers or strings
+    like 41.25N, 101.25W
+    """
+    point = dict(top=lat, left=lon)
+    (lat, x, x, lon) = indices.convert_coords(DataObj.lat, DataObj.lon,
+                                              point)
+    # longitudes compare modulo 360 (-90 is 270)
+    lon_dist = np.abs((np.asarray(DataObj.lon) - lon + 180) % 360 - 180)
+    lat_dist = np.abs(np.asarray(DataObj.lat) - lat)
+    if DataObj.gridded:
+        (i, j) = (lat_dist.argmin(), lon_dist.argmin())
+    else:
+        i = j = (lat_dist**2 + lon_dist**2).argmin()
+    return dict(top=DataObj.lat[i], bottom=DataObj.lat[i],
+                left=DataObj.lon[j], right=DataObj.lon[j])
+
+def reference_series(DataObj, reference, time_range=None):
+    """Reads the reference series: the values of a point, or the mean
+    of the cells of a region at each time step.
+    :Param reference:
+        Coords of the point or region (see coord_to_inds)
+    :Return:
+        (values, valid) 1d arrays
+    """
+    packed = DataObj.get_all_data(coords=dict(reference),
+                                  time_range=time_range or dict(),
+                                  dtype='packed')
+    packed = packed.reshape(len(packed), -1)
+    valid = ~missing(DataObj, packed)
+    values = np.where(valid, DataObj.unpack(packed, np.float64), 0.0)
+    counts = valid.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        series = values.sum(axis=1) / counts
+    return np.where(counts > 0, series, 0.0), counts > 0
+
+def band_sums(DataObj, coords, time_range, x, xvalid, band=None,
+              chunk_size=None):
+    """CorrelationSums of the field (or a band of it, see iter_chunks)
+    """
+    sums = None
+    first = None
+    # packed, so the missing values compare exactly
+    for tslice, data in DataObj.iter_chunks(chunk_size, coords=coords,
+                                            time_range=time_range,
+                                            band=band, dtype='packed'):
+        if sums is None:
+            sums = CorrelationSums(data.shape[1:])
+            first = tslice.start
+        rows = slice(tslice.start - first, tslice.stop - first)
+        sums.add(x[rows], xvalid[rows], DataObj.unpack(data, np.float64),
+                 ~missing(DataObj, data))
+    return sums
+
+def correlation(DataObj, coords=None, time_range=None, lat=None, lon=None,
+                top=None, bottom=None, left=None, right=None, out='r',
+                workers=1, chunk_size=None):
+    """Correlation of every cell of the selection with a reference
+    series over the selected time.
+    :Param lat, lon:
+        The point the reference series is taken at (the closest
+        grid point or site)
+    :Param top, bottom, left, right:
+        Or the region whose mean is the reference series
+    :Param out:
+        r, pvalue or count
+    :Param workers:
+        Number of bands of the field summed in parallel
+    :Return:
+        Masked array of out, the shape of a time step squeezed
+    """
+    if out not in OUTPUTS:
+        raise ValueError("out should be one of {}, not {!r}".format(
+                         OUTPUTS, out))
+    coords = coords or dict()
+    time_range = time_range or dict()
+    if lat is not None and lon is not None:
+        reference = nearest(DataObj, lat, lon)
+    else:
+        reference = dict((key, value) for key, value in
+                         [('top', top), ('bottom', bottom),
+                          ('left', left), ('right', right)]
+                         if value is not None)
+        if not reference:
+            raise ValueError("correlation needs a point (lat, lon) or "
+                             "a region (top, bottom, left, right)")
+    (x, xvalid) = reference_series(DataObj, reference, time_range)
+    # about its mean, it doesn't change r
+    if xvalid.any():
+        x = np.where(xvalid, x - x[xvalid].mean(), 0.0)
+    inds = DataObj.get_inds(time_range, coords)
+    nrows = DataObj.selection_shape(inds=inds)[1]
+    workers = max(min(int(workers), nrows), 1)
+    if workers == 1:
+        results = [band_sums(DataObj, coords, time_range, x, xvalid,
+                             chunk_size=chunk_size).correlate()]
+    else:
+        step = -(-nrows // workers)
+        bands = [slice(start, min(start + step, nrows))
+                 for start in xrange(0, nrows, step)]
+        pool = ThreadPool(workers)
+        try:
+            results = pool.map(lambda band: band_sums(
+                                   DataObj, coords, time_range, x, xvalid,
+                                   band, chunk_size).correlate(), bands)
+        finally:
+            pool.close()
+    result = np.ma.concatenate([result[out] for result in results], axis=0)
+    return np.ma.atleast_1d(result.squeeze())
+correlation.streaming = True
@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+#
+# eof.py
+#
+# Hannah Aizenman, 2012-03
+#
+# http://www.opensource.org/licenses/bsd-license.php
+
+"""Empirical orthogonal functions (EOFs, the principal components of
+the selection) without holding the time x space matrix in memory.
+
+The anomalies (from each cell's mean over the selection, or from the
+mean of each month) are weighted by sqrt(cos(latitude)), so every
+cell counts by its area. The leading modes are found with a
+randomized SVD: every product with the anomaly matrix is one pass
+over the selection a chunk of time steps at a time, so only a few
+(time or space) x (modes + oversample) matrices are ever in memory.
+The modes of a selection are kept (see EOFCache), so its patterns
+and PCs can be drawn one after another without computing them again.
+"""
+
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/2.7/library/collections.html
+import collections
+# http://docs.python.org/2.7/library/threading.html
+import threading
+
+# http://docs.scipy.org/doc/numpy-1.6.0/reference/
+import numpy as np
+
+from ccplib.datahandlers import slicecache
+from ccplib.algorithms.anomaly import calendar_slots, PERIODS
+from ccplib.algorithms.regression import missing
+from ccplib.algorithms.regional import area_weights
+
+OUTPUTS = ['eof', 'pc', 'variance']
+# extra random vectors, and passes refining them, of the randomized SVD
+OVERSAMPLE = 10
+ITERATIONS = 2
+# the modes are random, but the same every time for the same data
+SEED = 0
+# most memory the matrices of the SVD may take up
+MAX_BYTES = 256 * 2**20
+# memory for the modes kept by EOFCache
+CACHE_BYTES = 64 * 2**20
+
+class AnomalyMatrix(object):
+    """The weighted anomalies of the selection as a (time, cells)
+    matrix that's read a chunk of time steps at a time. The means are
+    computed when it's made, missing values are anomalies of 0.
+    :Param period:
+        None for anomalies from each cell's mean, monthly or daily
+        from each cell's mean of every month or day of the year
+    """
+    def __init__(self, DataObj, coords=None, time_range=None, period=None,
+                 chunk_size=None):
+        if period is not None and period not in PERIODS:
+            raise ValueError("period should be None or one of {}, "
+                             "not {!r}".format(sorted(PERIODS), period))
+        self.DataObj = DataObj
+        self.coords = coords or dict()
+        self.time_range = time_range or dict()
+        self.period = period
+        self.chunk_size = chunk_size
+        self.inds = DataObj.get_inds(self.time_range, self.coords)
+        self.shape = DataObj.selection_shape(inds=self.inds)
+        self.ncells = int(np.prod(self.shape[1:]))
+        # the squares of the anomalies are weighted by area
+        self.weights = np.sqrt(area_weights(DataObj, self.inds,
+                                            self.shape[1:])).ravel()
+        self.slots = np.zeros(self.shape[0], np.int64)
+        if period is not None:
+            self.slots = calendar_slots(DataObj, self.inds[0], period)
+        self.means = None
+        self.counts = None
+        self._mean()
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__, (self.shape,
+                                                        self.period))
+
+    def _read(self):
+        """Yields (rows, values, valid) of every chunk, values and
+        valid as (time steps, cells)
+        """
+        first = self.inds[0].start
+        # packed, so the missing values compare exactly
+        for tslice, data in self.DataObj.iter_chunks(
+                                self.chunk_size, coords=self.coords,
+                                time_range=self.time_range, dtype='packed'):
+            rows = slice(tslice.start - first, tslice.stop - first)
+            data = data.reshape(len(data), -1)
+            yield (rows, self.DataObj.unpack(data, np.float64),
+                   ~missing(self.DataObj, data))
+
+    def _mean(self):
+        nslots = self.slots.max() + 1 if len(self.slots) else 1
+        sums = np.zeros((nslots, self.ncells))
+        counts = np.zeros((nslots, self.ncells), np.int64)
+        for rows, values, valid in self._read():
+            slots = self.slots[rows]
+            for slot in np.unique(slots):
+                found = slots == slot
+                sums[slot] += np.where(valid[found], values[found],
+                                       0.0).sum(axis=0)
+                counts[slot] += valid[found].sum(axis=0)
+        self.means = sums / np.maximum(counts, 1)
+        self.counts = counts.sum(axis=0)
+
+    def chunks(self):
+        """Yields (rows, weighted anomalies) of every chunk
+        """
+        for rows, values, valid in self._read():
+            anomalies = values - self.means[self.slots[rows]]
+            yield rows, np.where(valid, anomalies, 0.0) * self.weights
+
+    def gram_dot(self, Z):
+        """Returns A.T A Z, in one pass"""
+        product = np.zeros(Z.shape)
+        for rows, chunk in self.chunks():
+            product += np.dot(chunk.T, np.dot(chunk, Z))
+        return product
+
+    def dot(self, Z):
+        """Returns A Z"""
+        product = np.zeros((self.shape[0], Z.shape[1]))
+        for rows, chunk in self.chunks():
+            product[rows] = np.dot(chunk, Z)
+        return product
+
+    def project(self, Q):
+        """Returns (Q.T A, the sum of the squares of A)
+        """
+        product = np.zeros((Q.shape[1], self.ncells))
+        total = 0.0
+        for rows, chunk in self.chunks():
+            product += np.dot(Q[rows].T, chunk)
+            total += np.einsum('ij,ij->', chunk, chunk)
+        return product, total
+
+def randomized_svd(matrix, modes, oversample=OVERSAMPLE,
+                   iterations=ITERATIONS, seed=SEED):
+    """The leading modes of the SVD of an AnomalyMatrix A = U S Vt
+    from its products with a few random vectors (Halko, Martinsson
+    and Tropp 2011), each product a pass over the data.
+    :Return:
+        (U, s, Vt, total) with modes columns of U and rows of Vt,
+        total is the sum of the squares of A
+    """
+    size = min(modes + oversample, matrix.shape[0], matrix.ncells)
+    random = np.random.RandomState(seed)
+    Z = random.standard_normal((matrix.ncells, size))
+    for i in xrange(iterations):
+        # orthonormal again, so the small modes aren't rounded away
+        (Z, r) = np.linalg.qr(matrix.gram_dot(Z))
+    (Q, r) = np.linalg.qr(matrix.dot(Z))
+    (B, total) = matrix.project(Q)
+    (U, s, Vt) = np.linalg.svd(B, full_matrices=False)
+    U = np.dot(Q, U)
+    return U[:, :modes], s[:modes], Vt[:modes], total
+
+class EOFs(object):
+    """The leading modes of a selection.
+    :Param patterns:
+        Array (modes, ...) of the patterns, in the data's units: the
+        anomaly of a PC of one standard deviation, NaN where a cell
+        has no values
+    :Param pcs:
+        Array (time, modes) of the principal components, with a
+        standard deviation of 1
+    :Param variance:
+        Fraction of the (weighted) variance of each mode
+    """
+    def __init__(self, patterns, pcs, variance):
+        self.patterns = patterns
+        self.pcs = pcs
+        self.variance = variance
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__, self.variance)
+
+    @property
+    def nbytes(self):
+        return self.patterns.nbytes + self.pcs.nbytes + self.variance.nbytes
+
+    @classmethod
+    def compute(cls, DataObj, coords=None, time_range=None, modes=3,
+                period=None, oversample=OVERSAMPLE, iterations=ITERATIONS,
+                max_bytes=MAX_BYTES, chunk_size=None):
+        """Computes the modes in iterations + 3 passes over the
+        selection, see randomized_svd
+        :Param max_bytes:
+            Most memory the matrices of the SVD may take up, bigger
+            selections raise a ValueError
+        """
+        matrix = AnomalyMatrix(DataObj, coords, time_range, period,
+                               chunk_size)
+        (ntime, ncells) = (matrix.shape[0], matrix.ncells)
+        size = min(modes + oversample, ntime, ncells)
+        needed = 8 * (3 * ncells * size + 2 * ntime * size +
+                      matrix.means.size)
+        if needed > max_bytes:
+            raise ValueError("{} modes of a {} selection need {} bytes, "
+                             "more than {}".format(modes, matrix.shape,
+                                                   needed, max_bytes))
+        (U, s, Vt, total) = randomized_svd(matrix, modes, oversample,
+                                           iterations)
+        # the sign of a mode is arbitrary, its largest value is positive
+        signs = np.sign(Vt[np.arange(len(Vt)), np.abs(Vt).argmax(axis=1)])
+        signs[signs == 0] = 1
+        (U, Vt) = (U * signs, Vt * signs[:, None])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            patterns = Vt * (s / np.sqrt(ntime))[:, None] / matrix.weights
+        patterns[:, (matrix.counts == 0) | (matrix.weights == 0)] = np.nan
+        patterns = patterns.reshape((len(s),) + matrix.shape[1:])
+        variance = s**2 / total if total > 0 else np.zeros(len(s))
+        return cls(patterns, U * np.sqrt(ntime), variance)
+
+class EOFCache(object):
+    """Least recently used modes by dataset version, selection and
+    parameters, bounded by their total size.
+    """
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self._lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._eofs = collections.OrderedDict()
+        self.counters = dict(hits=0, computes=0, evictions=0)
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__, self.stats())
+
+    def get(self, DataObj, coords=None, time_range=None, **kwargs):
+        """Returns the EOFs of the selection, computing them (see
+        EOFs.compute for kwargs) if they aren't kept
+        """
+        inds = DataObj.get_inds(time_range or dict(), coords or dict())
+        key = (slicecache.dataset_token(DataObj), slicecache.inds_key(inds),
+               tuple(sorted(kwargs.items())))
+        with self._lock:
+            eofs = self._eofs.pop(key, None)
+            if eofs is not None:
+                self._eofs[key] = eofs
+                self.counters['hits'] += 1
+                return eofs
+        eofs = EOFs.compute(DataObj, coords, time_range, **kwargs)
+        with self._lock:
+            self.counters['computes'] += 1
+            if key not in self._eofs and eofs.nbytes <= self.max_bytes:
+                self._eofs[key] = eofs
+                self.nbytes += eofs.nbytes
+            while self.nbytes > self.max_bytes:
+                (dropped, old) = self._eofs.popitem(last=False)
+                self.nbytes -= old.nbytes
+                self.counters['evictions'] += 1
+        return eofs
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats.update(eofs=len(self._eofs), nbytes=self.nbytes,
+                         max_bytes=self.max_bytes)
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._eofs.clear()
+            self.nbytes = 0
+
+def eof(DataObj, coords=None, time_range=None, out='eof', mode=1, modes=3,
+        period=None, oversample=OVERSAMPLE, iterations=ITERATIONS,
+        max_bytes=MAX_BYTES):
+    """EOF analysis of the selection.
+    :Param out:
+        eof, the pattern of a mode (a map), pc, its principal
+        component (a time series), or variance, the fraction of
+        the variance of each of the modes
+    :Param mode:
+        Which mode, 1 is the leading one
+    :Param modes:
+        Number of modes computed (and kept, see EOFCache)
+    :Param period:
+        None for anomalies from each cell's mean, monthly or daily
+        for anomalies from the mean of each month or day of the year
+    :Param max_bytes:
+        Most memory the SVD may use
+    :Return:
+        Masked array, squeezed
+    """
+    if out not in OUTPUTS:
+        raise ValueError("out should be one of {}, not {!r}".format(
+                         OUTPUTS, out))
+    modes = int(modes)
+    mode = int(mode)
+    if not 1 <= mode <= modes:
+        raise ValueError("mode should be between 1 and {}, not {}".format(
+                         modes, mode))
+    eofs = EOFS.get(DataObj, coords, time_range, modes=modes, period=period,
+                    oversample=int(oversample), iterations=int(iterations),
+                    max_bytes=max_bytes)
+    if mode > len(eofs.variance):
+        raise ValueError("the selection only has {} modes".format(
+                         len(eofs.variance)))
+    if out == 'variance':
+        result = eofs.variance
+    elif out == 'pc':
+        result = eofs.pcs[:, mode - 1]
+    else:
+        result = eofs.patterns[mode - 1]
+    return np.ma.atleast_1d(np.ma.masked_invalid(result).squeeze())
+eof.streaming = True
+
+def xaxis(DataObj, coords=None, time_range=None, out='eof', modes=3,
+          **kwargs):
+    """The x axis (see TemporalGraph.ccpshow) of a graph of the
+    variance, one value per mode, None for the patterns and PCs
+    """
+    if out != 'variance':
+        return None
+    inds = DataObj.get_inds(time_range or dict(), coords or dict())
+    shape = DataObj.selection_shape(inds=inds)
+    nmodes = min(int(modes), shape[0], int(np.prod(shape[1:])))
+    return dict(xdata=np.arange(1, nmodes + 1), xlabel='mode')
+eof.xaxis = xaxis
+
+# modes computed in this process
+EOFS = EOFCache()
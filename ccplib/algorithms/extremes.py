@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+#
+# extremes.py
+#
+# Hannah Aizenman, 2012-03
+#
+# http://www.opensource.org/licenses/bsd-license.php
+
+"""Threshold exceedances: how often every cell is above (or below) a
+threshold, and for how many consecutive time steps.
+
+The selection is read once a chunk at a time (see CCPData.iter_chunks)
+into counters the size of a time step. The run of exceedances every
+cell is in at the end of a chunk carries over into the next one, so
+runs that straddle chunks count whole. Within a chunk the runs are
+found for every cell at once from the last step that didn't exceed.
+"""
+
+__docformat__ = "restructuredtext"
+
+# http://docs.scipy.org/doc/numpy-1.6.0/reference/
+import numpy as np
+
+from ccplib.algorithms.regression import missing
+
+OUTPUTS = ['count', 'fraction', 'longest', 'runs']
+
+class Exceedances(object):
+    """Counters of the exceedances of every cell.
+    :Param shape:
+        Shape of a time step
+    :Param min_run:
+        Length (in time steps) a run needs to count as one
+    """
+    def __init__(self, shape, min_run=1):
+        self.shape = tuple(shape)
+        self.min_run = max(int(min_run), 1)
+        # exceedances and values of every cell
+        self.count = np.zeros(shape, np.int32)
+        self.valid = np.zeros(shape, np.int32)
+        # the run each cell is in, the longest so far and the
+        # number of runs at least min_run long
+        self.run = np.zeros(shape, np.int32)
+        self.longest = np.zeros(shape, np.int32)
+        self.runs = np.zeros(shape, np.int32)
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__,
+                                       (self.shape, self.min_run))
+
+    def add(self, exceeds, valid):
+        """Adds a chunk of time steps (time first), a missing value
+        ends a run
+        """
+        exceeds = exceeds & valid
+        self.count += exceeds.sum(axis=0)
+        self.valid += valid.sum(axis=0)
+        # the run at each step is the steps since the last one that
+        # didn't exceed, plus the carried run if there wasn't one yet
+        steps = np.arange(len(exceeds)).reshape((-1,) + (1,) *
+                                                (exceeds.ndim - 1))
+        last_break = np.maximum.accumulate(np.where(exceeds, -1, steps),
+                                           axis=0)
+        run = np.where(last_break < 0, steps + 1 + self.run,
+                       steps - last_break)
+        run = np.where(exceeds, run, 0)
+        np.maximum(self.longest, run.max(axis=0), out=self.longest)
+        # a run counts the step it reaches min_run
+        self.runs += (run == self.min_run).sum(axis=0)
+        self.run = run[-1].astype(np.int32)
+
+    def result(self, out='count'):
+        """count, fraction (of the values), longest or runs, masked
+        where a cell has no values
+        """
+        if out == 'fraction':
+            values = self.count / np.maximum(self.valid, 1).astype(
+                                                                np.float64)
+        else:
+            values = getattr(self, out)
+        return np.ma.masked_array(values, mask=self.valid == 0)
+
+def extremes(DataObj, coords=None, time_range=None, threshold=0.0,
+             below=False, out='count', min_run=1, chunk_size=None):
+    """Exceedances of a threshold by every cell of the selection,
+    in one pass.
+    :Param threshold:
+        In the units of the data
+    :Param below:
+        Count the values below the threshold instead of above it
+    :Param out:
+        count, the number of time steps beyond the threshold,
+        fraction, that over the number of values, longest, the
+        longest run of consecutive ones, or runs, the number of
+        runs of at least min_run
+    :Param min_run:
+        Shortest run counted by runs, in time steps
+    :Return:
+        Masked array, masked where a cell has no values, squeezed
+    """
+    if out not in OUTPUTS:
+        raise ValueError("out should be one of {}, not {!r}".format(
+                         OUTPUTS, out))
+    threshold = float(threshold)
+    coords = coords or dict()
+    time_range = time_range or dict()
+    counters = None
+    # packed, so the missing values compare exactly
+    for tslice, data in DataObj.iter_chunks(chunk_size, coords=coords,
+                                            time_range=time_range,
+                                            dtype='packed'):
+        if counters is None:
+            counters = Exceedances(data.shape[1:], min_run)
+        values = DataObj.unpack(data, np.float64)
+        exceeds = values < threshold if below else values > threshold
+        counters.add(exceeds, ~missing(DataObj, data))
+    if counters is None:
+        raise ValueError("no time steps in the selection")
+    return np.ma.atleast_1d(counters.result(out).squeeze())
+extremes.streaming = True
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+#
+# quantile.py
+#
+# Hannah Aizenman, 2012-03
+#
+# http://www.opensource.org/licenses/bsd-license.php
+
+"""Quantile (e.g. median or 90th percentile) maps with bounded memory.
+
+The exact quantiles need each cell's whole series, so the selection
+is read in spatial tiles (see CCPData.iter_tiles) that fit the
+budget, and each tile's order statistics are found with np.partition
+rather than a full sort. The approximate quantiles read the selection
+once a chunk of time at a time and keep a fixed size random sample
+(a reservoir) of each cell's values.
+"""
+
+__docformat__ = "restructuredtext"
+
+# http://docs.scipy.org/doc/numpy-1.6.0/reference/
+import numpy as np
+
+from ccplib.datahandlers import ccpdata
+from ccplib.algorithms.regression import missing
+
+# values kept per cell by the approximate quantiles
+SKETCH_SIZE = 100
+# the samples are random, but the same every time for the same data
+SEED = 0
+
+def as_fraction(q):
+    """q as a fraction, 0.9 or 90 (a percentile) are both 0.9
+    """
+    q = float(q)
+    if q > 1:
+        q /= 100.0
+    if not 0 <= q <= 1:
+        raise ValueError("q should be between 0 and 1 (or 100), "
+                         "not {}".format(q))
+    return q
+
+def column_quantiles(values, counts, q):
+    """Quantiles of the columns of values (time, cells), where the
+    missing values are +inf so they're partitioned last. Linear
+    between the closest ranks, like np.percentile.
+    :Param counts:
+        Number of values in each column
+    :Return:
+        Array of the cells, NaN where there are no values
+    """
+    result = np.zeros(values.shape[1]) + np.nan
+    # columns with the same count need the same ranks
+    for count in np.unique(counts):
+        if count == 0:
+            continue
+        cols = np.flatnonzero(counts == count)
+        position = q * (count - 1)
+        low = int(np.floor(position))
+        high = min(low + 1, count - 1)
+        part = np.partition(values[:, cols], sorted(set([low, high])),
+                            axis=0)
+        result[cols] = part[low] + (position - low) * (part[high] - 
+                                                       part[low])
+    return result
+
+def exact_quantiles(DataObj, coords, time_range, q, tile_bytes):
+    shape = DataObj.selection_shape(coords=coords, time_range=time_range)
+    result = np.zeros(shape[1:]) + np.nan
+    # packed, so the missing values compare exactly, but sized for
+    # the float64 values that are partitioned
+    for rows, data in DataObj.iter_tiles(tile_bytes, coords=coords,
+                                         time_range=time_range,
+                                         dtype='packed',
+                                         work_dtype=np.float64):
+        valid = ~missing(DataObj, data)
+        values = np.where(valid, DataObj.unpack(data, np.float64), np.inf)
+        values = values.reshape(len(values), -1)
+        counts = valid.reshape(len(valid), -1).sum(axis=0)
+        result[rows] = column_quantiles(values, counts, q).reshape(
+                                                          data.shape[1:])
+    return result
+
+class Reservoir(object):
+    """A fixed size random sample of the values of every cell
+    (reservoir sampling), filled a time step at a time.
+    :Param shape:
+        Shape of a time step
+    :Param size:
+        Number of values kept per cell
+    """
+    def __init__(self, shape, size=SKETCH_SIZE, seed=SEED):
+        self.shape = tuple(shape)
+        self.size = size
+        ncells = int(np.prod(shape))
+        self.samples = np.zeros((size, ncells), np.float32) + np.inf
+        self.seen = np.zeros(ncells, np.int64)
+        self._random = np.random.RandomState(seed)
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__,
+                                       (self.shape, self.size))
+
+    def add(self, values, valid):
+        """Adds a chunk of time steps (time first)
+        """
+        values = values.reshape(len(values), -1)
+        valid = valid.reshape(len(valid), -1)
+        for row, ok in zip(values, valid):
+            cells = np.flatnonzero(ok)
+            self.seen[cells] += 1
+            seen = self.seen[cells]
+            # the first size values fill the sample, then the nth 
+            # value replaces a random one with chance size/n
+            slots = (self._random.random_sample(len(cells)) * 
+                     seen).astype(np.int64)
+            slots = np.where(seen <= self.size, seen - 1, slots)
+            kept = slots < self.size
+            self.samples[slots[kept], cells[kept]] = row[cells[kept]]
+
+    def quantiles(self, q):
+        counts = np.minimum(self.seen, self.size)
+        return column_quantiles(self.samples, counts, q).reshape(self.shape)
+
+def approximate_quantiles(DataObj, coords, time_range, q, size,
+                          chunk_size=None):
+    shape = DataObj.selection_shape(coords=coords, time_range=time_range)
+    sketch = Reservoir(shape[1:], size)
+    for tslice, data in DataObj.iter_chunks(chunk_size, coords=coords,
+                                            time_range=time_range,
+                                            dtype='packed'):
+        valid = ~missing(DataObj, data)
+        sketch.add(DataObj.unpack(data, np.float32), valid)
+    return sketch.quantiles(q)
+
+def quantile(DataObj, coords=None, time_range=None, q=0.5,
+             approximate=False, sketch=SKETCH_SIZE,
+             tile_bytes=ccpdata.CHUNK_BYTES):
+    """Quantile of every cell of the selection over time.
+    :Param q:
+        The quantile, 0.5 is the median, 0.9 (or 90) the
+        90th percentile
+    :Param approximate:
+        From a random sample of sketch values per cell, read in one
+        pass, instead of every value
+    :Param sketch:
+        Number of values per cell the approximate quantile keeps
+    :Param tile_bytes:
+        Most bytes of data read at once for the exact quantile
+    :Return:
+        Masked array, masked where a cell has no values, squeezed
+    """
+    q = as_fraction(q)
+    coords = coords or dict()
+    time_range = time_range or dict()
+    if approximate:
+        result = approximate_quantiles(DataObj, coords, time_range, q, 
+                                       int(sketch))
+    else:
+        result = exact_quantiles(DataObj, coords, time_range, q, 
+                                 tile_bytes)
+    return np.ma.atleast_1d(np.ma.masked_invalid(result).squeeze())
+quantile.streaming = True
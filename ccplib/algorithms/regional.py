@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+#
+# regional.py
+#
+# Hannah Aizenman, 2012-03
+#
+# http://www.opensource.org/licenses/bsd-license.php
+
+"""Area weighted means of a region (or of every selected site) at
+every time step, i.e. the time series of a region.
+
+The selection is read a chunk of time steps at a time and every
+chunk is reduced to its weighted sums with one matrix product, so
+only the series, and never the (time, lat, lon) cube of the region,
+is kept in memory. Missing values are left out of the sums and their
+weights out of the total weight of their time step.
+"""
+
+__docformat__ = "restructuredtext"
+
+# http://docs.scipy.org/doc/numpy-1.6.0/reference/
+import numpy as np
+
+from ccplib.algorithms.regression import missing
+
+def area_weights(DataObj, inds, shape):
+    """cos(latitude), proportional to the area of a grid cell, of
+    every cell of a time step of the selection inds (see
+    CCPData.get_inds)
+    :Param shape:
+        Shape of a time step of the selection
+    """
+    lat = np.asarray(DataObj.lat, np.float64)[inds[-2 if DataObj.gridded
+                                                   else -1]]
+    lat = lat.reshape((-1, 1) if DataObj.gridded else (-1,))
+    weights = np.maximum(np.cos(np.radians(lat)), 0.0)
+    return np.ones(shape) * weights
+
+def regionmean(DataObj, coords=None, time_range=None, weighted=True,
+               chunk_size=None):
+    """Mean of the cells of the selection at every time step.
+    :Param weighted:
+        Weight the cells by their area (cos(latitude)), false
+        for the plain mean
+    :Return:
+        Masked array, one value per time step, masked where every
+        cell is missing
+    """
+    coords = coords or dict()
+    time_range = time_range or dict()
+    inds = DataObj.get_inds(time_range, coords)
+    shape = DataObj.selection_shape(inds=inds)
+    weights = np.ones(shape[1:])
+    if weighted:
+        weights = area_weights(DataObj, inds, shape[1:])
+    weights = weights.ravel()
+    sums = np.zeros(shape[0])
+    totals = np.zeros(shape[0])
+    first = inds[0].start
+    # packed, so the missing values compare exactly
+    for tslice, data in DataObj.iter_chunks(chunk_size, coords=coords,
+                                            time_range=time_range,
+                                            dtype='packed'):
+        rows = slice(tslice.start - first, tslice.stop - first)
+        data = data.reshape(len(data), -1)
+        valid = ~missing(DataObj, data)
+        values = np.where(valid, DataObj.unpack(data, np.float64), 0.0)
+        sums[rows] = np.dot(values, weights)
+        totals[rows] = np.dot(valid, weights)
+    mask = totals <= 0
+    result = np.ma.masked_array(sums / np.where(mask, 1.0, totals),
+                                mask=mask)
+    return np.ma.atleast_1d(result.squeeze())
+regionmean.streaming = True
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+#
+# regression.py
+#
+# Hannah Aizenman, 2012-03
+#
+# http://www.opensource.org/licenses/bsd-license.php
+
+"""Least squares linear trends of every grid cell at once.
+
+The fit of y = a + b*t only needs the sums n, St, Sy, Stt, Sty and
+Syy over time, so they're accumulated a chunk of time steps at a time
+(see CCPData.iter_chunks) and the whole selection is never in memory.
+Missing values are left out of the sums of their cell, so each cell
+has its own count.
+"""
+
+__docformat__ = "restructuredtext"
+
+# http://docs.scipy.org/doc/numpy-1.6.0/reference/
+import numpy as np
+
+# fewest values a cell needs for a slope and its significance
+MIN_COUNT = 3
+# what trend returns, see TrendSums.fit
+OUTPUTS = ['slope', 'intercept', 'pvalue', 'count']
+
+class TrendSums(object):
+    """Running sums of the fit of y = a + b*t in every cell.
+    :Param shape:
+        Shape of a time step (e.g. (lat, lon))
+    :Param origin:
+        Subtracted from the times before they're summed, so the
+        sums don't lose precision when the times are large (e.g.
+        days since 1800). The results are for the times as given.
+    """
+    def __init__(self, shape, origin=0.0):
+        self.shape = tuple(shape)
+        self.origin = float(origin)
+        self.n = np.zeros(shape, np.int64)
+        self.t = np.zeros(shape)
+        self.y = np.zeros(shape)
+        self.tt = np.zeros(shape)
+        self.ty = np.zeros(shape)
+        self.yy = np.zeros(shape)
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__, self.shape)
+
+    def add(self, t, y, valid=None):
+        """Adds a chunk of time steps to the sums.
+        :Param t:
+            Times of the chunk (1d)
+        :Param y:
+            Values of the chunk, time first
+        :Param valid:
+            Boolean array like y, False where y is missing
+            (default all valid)
+        """
+        t = np.asarray(t, np.float64) - self.origin
+        y = np.asarray(y, np.float64)
+        if valid is None:
+            valid = np.ones(y.shape, bool)
+        else:
+            y = np.where(valid, y, 0.0)
+        weight = valid.astype(np.float64)
+        self.n += valid.sum(axis=0)
+        self.t += np.tensordot(t, weight, axes=1)
+        self.tt += np.tensordot(t * t, weight, axes=1)
+        self.y += y.sum(axis=0)
+        self.ty += np.tensordot(t, y, axes=1)
+        self.yy += np.einsum('i...,i...->...', y, y)
+
+    def fit(self, min_count=MIN_COUNT):
+        """Returns a dictionary of masked arrays:
+        slope (per unit of t), intercept (at t = 0),
+        pvalue (two sided, of the slope being 0) and count.
+        Cells with fewer than min_count values or a single time
+        are masked.
+        """
+        # scipy is only needed once there's something to test
+        from scipy import special
+        n = self.n.astype(np.float64)
+        safe_n = np.maximum(n, 1)
+        # sums about the means of each cell
+        stt = self.tt - self.t * self.t / safe_n
+        sty = self.ty - self.t * self.y / safe_n
+        syy = self.yy - self.y * self.y / safe_n
+        bad = (self.n < min_count) | (stt <= 0)
+        stt = np.where(bad, 1.0, stt)
+        slope = sty / stt
+        intercept = (self.y - slope * self.t) / safe_n - slope * self.origin
+        dof = np.maximum(n - 2, 1)
+        sse = np.maximum(syy - slope * sty, 0.0)
+        stderr = np.sqrt(sse / dof / stt)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tstat = np.where(stderr > 0, np.abs(slope) / stderr, np.inf)
+        pvalue = 2.0 * special.stdtr(dof, -tstat)
+        results = dict(slope=slope, intercept=intercept, pvalue=pvalue)
+        for key in results:
+            results[key] = np.ma.masked_array(results[key], mask=bad)
+        results['count'] = self.n
+        return results
+
+def missing(DataObj, data):
+    """Returns a boolean array, True where data (as it is in the
+    file) is the missing_value or not a number
+    """
+    mask = np.zeros(np.shape(data), bool)
+    if hasattr(DataObj, 'missing_value'):
+        mask |= (data == DataObj.missing_value)
+    if data.dtype.kind == 'f':
+        mask |= ~np.isfinite(data)
+    return mask
+
+def trend_sums(DataObj, coords=None, time_range=None, chunk_size=None):
+    """Accumulates the TrendSums of the selection from the file
+    a chunk at a time
+    :Param coords:
+        Dictionary containing the region to restrict the data to
+    :Param time_range:
+        Dictionary containing the time to restrict the data to
+    :Param chunk_size:
+        Number of time steps per chunk (default see iter_chunks)
+    """
+    coords = coords or dict()
+    time_range = time_range or dict()
+    shape = DataObj.selection_shape(coords=coords,
+                                    time_range=time_range)
+    sums = None
+    # packed, so the missing values compare exactly
+    for tslice, data in DataObj.iter_chunks(chunk_size, coords=coords,
+                                            time_range=time_range,
+                                            dtype='packed'):
+        times = DataObj.time[tslice]
+        if sums is None:
+            sums = TrendSums(shape[1:], origin=times[0])
+        valid = ~missing(DataObj, data)
+        sums.add(times, DataObj.unpack(data, np.float64), valid)
+    if sums is None:
+        sums = TrendSums(shape[1:])
+    return sums
+
+def trend(DataObj, coords=None, time_range=None, out='slope', per=1,
+          min_count=MIN_COUNT, chunk_size=None):
+    """Linear trend of every cell of the selection over time, read
+    a chunk at a time instead of all at once.
+    :Param out:
+        slope, intercept, pvalue or count (see TrendSums.fit)
+    :Param per:
+        Number of time units the slope is given per, e.g. 3650 for
+        a slope per decade with times in days
+    :Param min_count:
+        Fewest values a cell needs, cells with less are masked
+    :Return:
+        Masked array of out, the shape of a time step squeezed
+    """
+    if out not in OUTPUTS:
+        raise ValueError("out should be one of {}, not {!r}".format(
+                         OUTPUTS, out))
+    sums = trend_sums(DataObj, coords, time_range, chunk_size)
+    result = sums.fit(min_count)[out]
+    if out == 'slope':
+        result = result * per
+    return result.squeeze()
+trend.streaming = True
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+#
+# resample.py
+#
+# Hannah Aizenman, 2012-03
+#
+# http://www.opensource.org/licenses/bsd-license.php
+
+"""Annual, seasonal, decadal and custom period aggregates (means,
+sums, maxima, minima) of every cell.
+
+The time index is turned into a period number for every time step,
+and since the periods are runs of consecutive steps each chunk read
+(see CCPData.iter_chunks) is reduced with one np.<op>.reduceat call
+per chunk and added into the periods it covers, so a period can
+straddle two chunks.
+"""
+
+__docformat__ = "restructuredtext"
+
+# http://docs.scipy.org/doc/numpy-1.6.0/reference/
+import numpy as np
+
+from ccplib.datahandlers import indices
+from ccplib.algorithms.regression import missing
+
+FREQS = ['annual', 'seasonal', 'decadal', 'months']
+# seasons by their first month (0 is January)
+SEASONS = dict(DJF=11, MAM=2, JJA=5, SON=8)
+# in the order of their labels (see periods)
+SEASON_NAMES = ['DJF', 'MAM', 'JJA', 'SON']
+# how: (ufunc the values are reduced with, value missing ones get)
+HOWS = dict(mean=(np.add, 0.0), sum=(np.add, 0.0),
+            max=(np.maximum, -np.inf), min=(np.minimum, np.inf))
+
+def calendar(DataObj, tslice):
+    """Returns the (year, month 0-11) of each time step in tslice
+    """
+    dates = indices.time_to_datetime64(DataObj.time[tslice],
+                                       DataObj.time_units)
+    months = dates.astype('M8[M]').astype(np.int64)
+    return months // 12 + 1970, months % 12
+
+def month_range(months):
+    """Converts a custom period, e.g. 11-3 (November to March,
+    1-based like the url), to a list of 0-based months
+    """
+    if isinstance(months, (int, long)):
+        months = [months]
+    elif isinstance(months, basestring):
+        months = [int(month) for month in months.split('-')]
+    first, last = months[0] - 1, months[-1] - 1
+    return [(first + i) % 12 for i in range((last - first) % 12 + 1)]
+
+def periods(year, month, freq='annual', season=None, months=None):
+    """Labels every time step with the period it belongs to.
+    :Param freq:
+        annual, seasonal (DJF, MAM, JJA, SON), decadal, or
+        months (a custom period of consecutive months)
+    :Param season:
+        Only this season (e.g. JJA) when freq is seasonal
+    :Param months:
+        The months of a custom period, e.g. 11-3, see month_range
+    :Return:
+        (labels, keep, nmonths): labels of the steps, increasing
+        with time, whether each step is in a period, and the number
+        of months of a complete period
+    """
+    keep = np.ones(len(year), bool)
+    if freq == 'annual':
+        return year, keep, 12
+    if freq == 'decadal':
+        return year // 10, keep, 120
+    if freq == 'seasonal':
+        # December is in the next year's winter
+        shifted = (month + 1) % 12
+        labels = (year + (month == 11)) * 4 + shifted // 3
+        if season is not None:
+            keep = (shifted // 3) == (SEASONS[season.upper()] + 1) % 12 // 3
+        return labels, keep, 3
+    if freq == 'months':
+        selected = month_range(months)
+        # named after the year the period ends in
+        wraps = np.array([m > selected[-1] for m in range(12)])
+        keep = np.in1d(month, selected)
+        return year + wraps[month], keep, len(selected)
+    raise ValueError("freq should be one of {}, not {!r}".format(
+                     FREQS, freq))
+
+def group_ids(labels, keep):
+    """Numbers the runs of equal labels 0, 1, ..., steps that
+    aren't kept get -1
+    """
+    ids = np.zeros(len(labels), np.int64) - 1
+    kept = labels[keep]
+    if len(kept):
+        ids[keep] = np.cumsum(np.r_[0, np.diff(kept) != 0])
+    return ids
+
+def layout(DataObj, inds, freq='annual', season=None, months=None,
+           partial=False):
+    """The periods of the selection inds (see CCPData.get_inds).
+    :Return:
+        (ids, kept, names): the period of each time step (-1 if it's
+        in none, see group_ids), which periods are returned (the
+        complete ones unless partial) and the names of those
+    """
+    if freq == 'months' and months is None:
+        raise ValueError("freq months needs the months, e.g. months=6-8")
+    (year, month) = calendar(DataObj, inds[0])
+    (labels, keep, nmonths) = periods(year, month, freq, season, months)
+    ids = group_ids(labels, keep)
+    ngroups = ids.max() + 1
+    if ngroups < 1:
+        raise ValueError("no time steps in the {} periods".format(freq))
+    (group, month_ind) = (ids[keep], (year * 12 + month)[keep])
+    first = np.r_[True, np.diff(group) != 0]
+    names = [period_name(label, freq) for label in labels[keep][first]]
+    kept = np.ones(ngroups, bool)
+    if not partial:
+        # a period is complete if it has a step in each of its months
+        new = first | np.r_[True, np.diff(month_ind) != 0]
+        kept = np.bincount(group[new], minlength=ngroups) >= nmonths
+        if not kept.any():
+            raise ValueError("no complete {} periods in the "
+                             "selection".format(freq))
+    return ids, kept, [name for name, ok in zip(names, kept) if ok]
+
+def period_name(label, freq):
+    """Name of a period from its label (see periods), e.g. 1881,
+    1880s or 1881 DJF
+    """
+    if freq == 'decadal':
+        return "{}0s".format(label)
+    if freq == 'seasonal':
+        return "{} {}".format(label // 4, SEASON_NAMES[label % 4])
+    return str(label)
+
+def resample(DataObj, coords=None, time_range=None, freq='annual',
+             season=None, months=None, how='mean', partial=False,
+             min_count=1, chunk_size=None):
+    """Aggregates the selection over periods of time, reading it
+    a chunk at a time.
+    :Param freq:
+        annual, seasonal, decadal or months (see periods)
+    :Param season:
+        DJF, MAM, JJA or SON: only that season when freq is seasonal
+    :Param months:
+        Months of a custom period, e.g. 11-3 or 6-8, with freq months
+    :Param how:
+        mean, sum, max or min
+    :Param partial:
+        Keep the periods at the ends of the selection that don't
+        have every month (default they're dropped)
+    :Param min_count:
+        Fewest values a cell needs in a period, it's masked if it
+        has less
+    :Return:
+        Masked array, one row per period, squeezed
+    """
+    if how not in HOWS:
+        raise ValueError("how should be one of {}, not {!r}".format(
+                         sorted(HOWS), how))
+    coords = coords or dict()
+    time_range = time_range or dict()
+    (ufunc, fill) = HOWS[how]
+    inds = DataObj.get_inds(time_range, coords)
+    (ids, kept, names) = layout(DataObj, inds, freq, season, months, partial)
+    ngroups = len(kept)
+    shape = DataObj.selection_shape(inds=inds)
+    values = np.zeros((ngroups,) + shape[1:]) + fill
+    counts = np.zeros((ngroups,) + shape[1:], np.int64)
+    first = inds[0].start
+    # packed, so the missing values compare exactly
+    for tslice, data in DataObj.iter_chunks(chunk_size, coords=coords,
+                                            time_range=time_range,
+                                            dtype='packed'):
+        chunk_ids = ids[tslice.start - first:tslice.stop - first]
+        rows = chunk_ids >= 0
+        if not rows.any():
+            continue
+        (chunk_ids, data) = (chunk_ids[rows], data[rows])
+        valid = ~missing(DataObj, data)
+        chunk = np.where(valid, DataObj.unpack(data, np.float64), fill)
+        starts = np.r_[0, np.flatnonzero(np.diff(chunk_ids)) + 1]
+        found = chunk_ids[starts]
+        values[found] = ufunc(values[found],
+                              ufunc.reduceat(chunk, starts, axis=0))
+        counts[found] += np.add.reduceat(valid.astype(np.int64), starts, 
+                                         axis=0)
+    if how == 'mean':
+        values /= np.maximum(counts, 1)
+    mask = counts < max(min_count, 1)
+    result = np.ma.masked_array(values[kept], mask=mask[kept])
+    return np.ma.atleast_1d(result.squeeze())
+resample.streaming = True
+
+def xaxis(DataObj, coords=None, time_range=None, freq='annual',
+          season=None, months=None, partial=False, **kwargs):
+    """The x axis (see TemporalGraph.ccpshow) of a graph of the
+    series of a cell, one value per period, labeled with the
+    periods' names
+    """
+    inds = DataObj.get_inds(time_range or dict(), coords or dict())
+    (ids, kept, names) = layout(DataObj, inds, freq, season, months, partial)
+    return dict(xdata=np.arange(len(names)), xticklabels=names,
+                xlabel=freq)
+resample.xaxis = xaxis
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+#
+# rolling.py
+#
+# Hannah Aizenman, 2012-03
+#
+# http://www.opensource.org/licenses/bsd-license.php
+
+"""Moving window (rolling) means, sums and standard deviations
+along time.
+
+Every window is the difference of two cumulative sums, so the cost
+doesn't depend on the window length. Windows are centered on their
+time step, missing values are left out of them and the windows with
+fewer than min_count values (at the ends, or where data is missing)
+are masked. moving works on an array in memory (e.g. the series of
+a TemporalGraph), rolling reads the selection a chunk at a time and
+carries the last window-1 steps over to the next chunk (see
+RollingWindows), so every step is read once whatever the window.
+"""
+
+__docformat__ = "restructuredtext"
+
+# http://docs.scipy.org/doc/numpy-1.6.0/reference/
+import numpy as np
+
+from ccplib.algorithms.regression import missing
+
+HOWS = ['mean', 'sum', 'std']
+
+def edges(window):
+    """Returns the number of steps (before, after) the step a window
+    of that many steps is centered on
+    """
+    return (window - 1) // 2, window // 2
+
+def window_sums(values, window):
+    """Sums of every run of window consecutive rows (along axis 0),
+    from the difference of cumulative sums
+    """
+    total = np.zeros((len(values) + 1,) + values.shape[1:])
+    np.cumsum(values, axis=0, out=total[1:])
+    return total[window:] - total[:-window]
+
+def window_stats(values, valid, window, how='mean', min_count=None,
+                 ddof=0, pad=None):
+    """Statistic of the windows of values, missing where not valid.
+    :Param pad:
+        Number of rows (before, after) missing from the ends of
+        values, default edges(window) so there's a window centered
+        on every row
+    :Return:
+        Masked array with len(values) + sum(pad) - window + 1 rows
+    """
+    (before, after) = edges(window) if pad is None else pad
+    values = np.asarray(values, np.float64)
+    shape = (before + len(values) + after,) + values.shape[1:]
+    rows = slice(before, before + len(values))
+    weight = np.zeros(shape)
+    weight[rows] = valid
+    center = mean_of(values, valid)
+    deviations = np.zeros(shape)
+    deviations[rows] = np.where(valid, values - center, 0.0)
+    return deviation_stats(deviations, weight, center, window, how,
+                           min_count, ddof)
+
+def mean_of(values, valid):
+    """Mean of the valid values of every cell, 0 where there are none.
+    The windows are summed about it, so the sums of squares don't
+    lose precision to large values.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        center = np.where(valid, values, 0.0).sum(axis=0) / valid.sum(axis=0)
+    return np.where(np.isfinite(center), center, 0.0)
+
+def deviation_stats(deviations, weight, center, window, how='mean',
+                    min_count=None, ddof=0):
+    """Statistic of the windows of deviations from center, which are
+    0 where weight (1 for the valid values) is 0.
+    :Return:
+        Masked array with len(deviations) - window + 1 rows
+    """
+    if how not in HOWS:
+        raise ValueError("how should be one of {}, not {!r}".format(
+                         HOWS, how))
+    if min_count is None:
+        min_count = window // 2 + 1
+    count = window_sums(weight, window)
+    sums = window_sums(deviations, window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = sums / count
+        if how == 'mean':
+            result = mean + center
+        elif how == 'sum':
+            result = sums + count * center
+        else:
+            squares = window_sums(deviations**2, window)
+            variance = (squares - count * mean**2) / (count - ddof)
+            result = np.sqrt(np.maximum(variance, 0.0))
+    mask = (count < max(min_count, 1)) | (count <= ddof)
+    return np.ma.masked_array(np.where(mask, 0.0, result), mask=mask)
+
+def moving(values, window, how='mean', min_count=None, ddof=0,
+           fill_value=None):
+    """Moving window statistic of an array in memory (e.g. a time
+    series), along its first axis.
+    :Param window:
+        Length of the windows, in time steps
+    :Param how:
+        mean, sum or std
+    :Param min_count:
+        Fewest values a window needs, default more than half
+    :Param ddof:
+        Delta degrees of freedom of the std (like numpy's std)
+    :Param fill_value:
+        Value of the missing elements (masked ones and NaNs are
+        missing too)
+    """
+    values = np.ma.masked_invalid(values)
+    valid = ~np.ma.getmaskarray(values)
+    if fill_value is not None:
+        valid &= (values.data != fill_value)
+    return window_stats(values.data, valid, window, how, min_count, ddof)
+
+class RollingWindows(object):
+    """Centered windows of a series that's added a chunk of time
+    steps at a time. The deviations of the last window-1 steps (and
+    of the missing steps before the first one) are kept, so the
+    windows that straddle chunks are summed without reading their
+    steps again.
+    :Param center:
+        Value of every cell the deviations are taken from, e.g.
+        the mean of the first chunk (see mean_of)
+    """
+    def __init__(self, window, center, how='mean', min_count=None, ddof=0):
+        self.window = window
+        self.center = center
+        self.how = how
+        self.min_count = min_count
+        self.ddof = ddof
+        (before, self.after) = edges(window)
+        shape = (before,) + np.shape(center)
+        self.deviations = np.zeros(shape)
+        self.weight = np.zeros(shape)
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__, (self.window,
+                                                        self.how))
+
+    def add(self, values, valid):
+        """Adds the next chunk (time first) and returns the statistic
+        of the windows it completes, which can be none
+        """
+        deviations = np.where(valid, values - self.center, 0.0)
+        return self._windows(deviations, valid)
+
+    def finish(self):
+        """Returns the statistic of the last windows, which run
+        past the end of the series
+        """
+        shape = (self.after,) + np.shape(self.center)
+        return self._windows(np.zeros(shape), np.zeros(shape))
+
+    def _windows(self, deviations, weight):
+        deviations = np.concatenate([self.deviations, deviations])
+        weight = np.concatenate([self.weight, weight])
+        result = deviation_stats(deviations, weight, self.center,
+                                 self.window, self.how, self.min_count,
+                                 self.ddof)
+        keep = max(len(deviations) - self.window + 1, 0)
+        (self.deviations, self.weight) = (deviations[keep:], weight[keep:])
+        return result
+
+def rolling(DataObj, coords=None, time_range=None, window=12, how='mean',
+            min_count=None, ddof=0, chunk_size=None):
+    """Moving window statistic of every cell of the selection, read
+    once a chunk at a time (see RollingWindows).
+    :Param window:
+        Length of the windows, in time steps (e.g. 132 for an 11
+        year window of monthly data)
+    :Param how:
+        mean, sum or std
+    :Param min_count:
+        Fewest values a window needs, default more than half
+    :Return:
+        Masked array the shape of the selection, squeezed
+    """
+    window = int(window)
+    if window < 1:
+        raise ValueError("window should be at least 1, not {}".format(window))
+    coords = coords or dict()
+    time_range = time_range or dict()
+    inds = DataObj.get_inds(time_range, coords)
+    shape = DataObj.selection_shape(inds=inds)
+    result = np.ma.masked_all(shape)
+    windows = None
+    done = 0
+    # packed, so the missing values compare exactly
+    for tslice, data in DataObj.iter_chunks(chunk_size, coords=coords,
+                                            time_range=time_range,
+                                            dtype='packed'):
+        valid = ~missing(DataObj, data)
+        values = DataObj.unpack(data, np.float64)
+        if windows is None:
+            windows = RollingWindows(window, mean_of(values, valid), how,
+                                     min_count, ddof)
+        stats = windows.add(values, valid)
+        result[done:done + len(stats)] = stats
+        done += len(stats)
+    if windows is not None:
+        result[done:] = windows.finish()
+    return np.ma.atleast_1d(result.squeeze())
+rolling.streaming = True
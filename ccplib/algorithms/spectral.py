@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+#
+# spectral.py
+#
+# Hannah Aizenman, 2012-03
+#
+# http://www.opensource.org/licenses/bsd-license.php
+
+"""Power spectra (periodograms) of every cell, or of the mean of a
+region, and maps of the dominant period or of the power in a band
+of periods.
+
+A spectrum needs a cell's whole series, so the selection is read in
+spatial tiles (see CCPData.iter_tiles) and every cell of a tile is
+detrended, tapered and transformed at once: the trends are fit from
+column sums and np.fft.rfft runs along the time axis of the
+(time, cells) matrix, with no loop over the cells.
+"""
+
+__docformat__ = "restructuredtext"
+
+# http://docs.scipy.org/doc/numpy-1.6.0/reference/
+import numpy as np
+
+from ccplib.datahandlers import ccpdata
+from ccplib.algorithms.regression import missing
+from ccplib.algorithms.correlation import reference_series
+
+OUTPUTS = ['peak', 'band', 'fraction', 'spectrum']
+DETRENDS = ['linear', 'mean', 'none']
+# tapers of the series, by name
+WINDOWS = dict(hann=np.hanning, hamming=np.hamming, bartlett=np.bartlett,
+               blackman=np.blackman, boxcar=np.ones)
+
+def detrend(values, valid, how='linear'):
+    """Removes the mean, or the least squares line, of every column
+    of values (time, cells) from the valid values. The missing ones
+    are 0, i.e. on the line.
+    """
+    if how not in DETRENDS:
+        raise ValueError("detrend should be one of {}, not {!r}".format(
+                         DETRENDS, how))
+    values = np.where(valid, values, 0.0)
+    if how == 'none':
+        return values
+    weight = valid.astype(np.float64)
+    count = np.maximum(weight.sum(axis=0), 1)
+    mean = values.sum(axis=0) / count
+    residuals = values - mean
+    if how == 'linear':
+        t = np.arange(len(values), dtype=np.float64)[:, None]
+        t_mean = (weight * t).sum(axis=0) / count
+        dt = (t - t_mean) * weight
+        sxx = (dt * dt).sum(axis=0)
+        slope = (dt * residuals).sum(axis=0) / np.where(sxx > 0, sxx, 1)
+        residuals -= slope * (t - t_mean)
+    return np.where(valid, residuals, 0.0)
+
+def frequencies(ntime):
+    """Frequencies, in cycles per time step, of the periodogram
+    of a series of ntime steps
+    """
+    return np.arange(ntime // 2 + 1) / float(ntime)
+
+def periodogram(values, valid, detrend_how='linear', window='hann'):
+    """One sided power spectral density of every column of values
+    (time, cells), like scipy.signal.periodogram with fs=1.
+    :Param detrend_how:
+        linear, mean or none
+    :Param window:
+        Taper: hann, hamming, bartlett, blackman or boxcar (none)
+    :Return:
+        Array (frequencies, cells) of the power
+    """
+    if window not in WINDOWS:
+        raise ValueError("window should be one of {}, not {!r}".format(
+                         sorted(WINDOWS), window))
+    ntime = len(values)
+    # periodic, rather than symmetric, like scipy.signal.get_window
+    taper = WINDOWS[window](ntime + 1)[:-1]
+    residuals = detrend(values, valid, detrend_how)
+    spectrum = np.fft.rfft(residuals * taper[:, None], axis=0)
+    power = (spectrum.real**2 + spectrum.imag**2) / (taper**2).sum()
+    # the negative frequencies, folded onto the positive ones
+    power[1:ntime - ntime // 2] *= 2
+    return power
+
+def band(ntime, low=None, high=None):
+    """Which frequencies of a periodogram of ntime steps have periods
+    between low and high time steps (0, the mean, never does)
+    """
+    freqs = frequencies(ntime)
+    with np.errstate(divide='ignore'):
+        periods = 1.0 / freqs
+    inside = freqs > 0
+    if low is not None:
+        inside &= periods >= float(low)
+    if high is not None:
+        inside &= periods <= float(high)
+    return inside
+
+def summarize(power, ntime, out='peak', low=None, high=None):
+    """Maps of a periodogram (frequencies, cells): the peak period
+    (in time steps), the power in the band of periods low-high, or
+    the fraction of the variance in it
+    """
+    inside = band(ntime, low, high)
+    if not inside.any():
+        raise ValueError("no periods between {} and {} time steps".format(
+                         low, high))
+    if out == 'peak':
+        freqs = frequencies(ntime)[inside]
+        return 1.0 / freqs[power[inside].argmax(axis=0)]
+    # integrated over frequency, the total is the variance
+    band_power = power[inside].sum(axis=0) / ntime
+    if out == 'band':
+        return band_power
+    total = power[1:].sum(axis=0) / ntime
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(total > 0, band_power / total, np.nan)
+
+def spectral(DataObj, coords=None, time_range=None, out='peak', low=None,
+             high=None, detrend='linear', window='hann', min_count=None,
+             tile_bytes=ccpdata.CHUNK_BYTES):
+    """Spectral analysis of the selection.
+    :Param out:
+        peak, the period (in time steps) with the most power,
+        band, the power in the periods between low and high,
+        fraction, that power over the variance, all maps, or
+        spectrum, the periodogram of the mean of the selection
+    :Param low, high:
+        Shortest and longest periods, in time steps, e.g. 24 and
+        84 for 2-7 years of monthly data
+    :Param detrend:
+        linear, mean or none
+    :Param window:
+        Taper: hann, hamming, bartlett, blackman or boxcar
+    :Param min_count:
+        Fewest values a series needs, default more than half,
+        missing values count as on the trend
+    :Param tile_bytes:
+        Most bytes of a tile, as complex values
+    :Return:
+        Masked array, squeezed
+    """
+    if out not in OUTPUTS:
+        raise ValueError("out should be one of {}, not {!r}".format(
+                         OUTPUTS, out))
+    coords = coords or dict()
+    time_range = time_range or dict()
+    inds = DataObj.get_inds(time_range, coords)
+    shape = DataObj.selection_shape(inds=inds)
+    ntime = shape[0]
+    if min_count is None:
+        min_count = ntime // 2 + 1
+    if out == 'spectrum':
+        (values, valid) = reference_series(DataObj, coords, time_range)
+        power = periodogram(values[:, None], valid[:, None], detrend,
+                            window)[:, 0]
+        mask = np.zeros(power.shape, bool)
+        mask[:] = valid.sum() < min_count
+        return np.ma.masked_array(power, mask=mask)
+    result = np.zeros(shape[1:]) + np.nan
+    # packed, so the missing values compare exactly, but sized for
+    # the complex transforms the tiles are worked on as
+    for rows, data in DataObj.iter_tiles(tile_bytes, coords=coords,
+                                         time_range=time_range,
+                                         dtype='packed',
+                                         work_dtype=np.complex128):
+        valid = ~missing(DataObj, data)
+        values = DataObj.unpack(data, np.float64).reshape(ntime, -1)
+        valid = valid.reshape(ntime, -1)
+        power = periodogram(values, valid, detrend, window)
+        maps = summarize(power, ntime, out, low, high)
+        maps[valid.sum(axis=0) < max(min_count, 2)] = np.nan
+        result[rows] = maps.reshape(data.shape[1:])
+    return np.ma.atleast_1d(np.ma.masked_invalid(result).squeeze())
+spectral.streaming = True
+
+def xaxis(DataObj, coords=None, time_range=None, out='peak', **kwargs):
+    """The x axis (see TemporalGraph.ccpshow) of a graph of the
+    spectrum, which isn't along time, None for the maps
+    """
+    if out != 'spectrum':
+        return None
+    inds = DataObj.get_inds(time_range or dict(), coords or dict())
+    ntime = DataObj.selection_shape(inds=inds)[0]
+    return dict(xdata=frequencies(ntime),
+                xlabel='frequency (cycles per time step)')
+spectral.xaxis = xaxis
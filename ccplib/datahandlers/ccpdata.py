@@ -22,11 +22,15 @@ import numpy as np
 # collection of mantainance functions 
 # (e.g. log and folder creation) 
 import ccplib.misc.utils
+from ccplib.misc import timing
 
-from ccplib.datahandlers import indices
+from ccplib.datahandlers import indices, slicecache
 
 log = logging.getLogger(ccplib.misc.utils.LOGNAME)
 
+# Size of the blocks iter_chunks reads at a time
+CHUNK_BYTES = 32 * 2**20
+
 class CCPData(object):
     """Returns an object containing attributes of the data and 
     extraction methods for the data.
@@ -60,8 +64,20 @@ class CCPData(object):
             The path to the folder in which to save the output.
         :Param shape:
             The shape of the array in the file. 
+        :Param dtype:
+            The type of the (packed) values in the file.
         :Param multifile:
             Bool - True if data is spread over multiple files, default is False
+        :Param slice_cache:
+            Keep the slices read by get_data in memory (see slicecache),
+            default is True
+        :Param prefetch:
+            Number of time steps to read ahead in the background when
+            the data is being stepped through in time, default is 0
+        :Param unpack_dtype:
+            Default type the data is unpacked to (see unpack), 
+            e.g. 'float32' or 'packed'. The default (None) is 
+            numpy's promotion of the packing formula.
         :Param labels:
             dict containing the (key, discriptive name) of each dimension
             keys: 'variable', 'latitude', 'longitude', 'time', 'dataset'
@@ -83,6 +99,9 @@ class CCPData(object):
         
         self.gridded = kwargs.get('gridded', True)
         self.multifile = kwargs.get('multifile', False)
+        self.slice_cache = kwargs.get('slice_cache', True)
+        self.prefetch = kwargs.get('prefetch', 0)
+        self.unpack_dtype = kwargs.get('unpack_dtype')
         # The formula for packed data is:
         # data = packed_data*scale_factor + add_offset
         self.add_offset = kwargs.get('add_offset', 0)
@@ -97,6 +116,7 @@ class CCPData(object):
     def __repr__(self):
         return "<{0!s}({1!r})>".format(self.__class__,self.__dict__)
   
+    @timing.timed('read')
     def get_all_data(self, file_list=None, concat_dim=-1, **kwargs):
         """Builds a numpy array out of all the data. 
         :Param file_list:
@@ -127,6 +147,9 @@ class CCPData(object):
                 http://docs.python.org/2.7/library/datetime.html
         :Param height:
             array of pressure of values
+        :Param dtype:
+            Type to unpack the data to, or 'packed' (see unpack).
+            The default is unpack_dtype.
 
         """
         # Note: This function can/should be parallelized
@@ -138,7 +161,9 @@ class CCPData(object):
         coords = kwargs.get('coords', dict())
         time_range = kwargs.get('time_range', dict())
         data_reshape = kwargs.get('data_reshape')
-        data_kw = dict(coords=coords, time_range=time_range, data_reshape=data_reshape)
+        dtype = kwargs.get('dtype', self.unpack_dtype)
+        data_kw = dict(coords=coords, time_range=time_range, 
+                       data_reshape=data_reshape, dtype=dtype)
         # Tries to pull data from whatever the file_path points to.
         return self.extract_func(self.file_path, **data_kw)
         
@@ -156,18 +181,20 @@ class CCPData(object):
         Note: see get_all_data docs for more detailed discription of coords and time_range
         :Param height:
             indices of selected height range if data has height (default is none)
+        :Param dtype:
+            Type to unpack the data to (see unpack)
         :Return data:
             The function returns the data as a numpy array.
         Note: This function assumes time is the first dimension
         
         """
         
-        log.debug("file on disk shape: {}".format(self.shape))
+        log.debug("file on disk shape: %s", self.shape)
 
         height = kwargs.get('height', Ellipsis)
         data = self.get_slice(file_obj, time_range, coords, height)
         
-        log.debug("extracted data shape: {}".format(data.shape))
+        log.debug("extracted data shape: %s", data.shape)
         
         # shrinks data to 
         data = np.squeeze(data)
@@ -178,15 +205,13 @@ class CCPData(object):
             if data_reshape == ('time', 'latlon'):
                 data_reshape = (data.shape[0], -1)
             data.shape = data_reshape
-            log.debug("data reshaped, new shape: {}".format(data.shape))
+            log.debug("data reshaped, new shape: %s", data.shape)
             
         # Unpacks data or data*1+0 by default
-        data = self.add_offset +  (data * self.scale_factor)
+        data = self.unpack(data, kwargs.get('dtype', self.unpack_dtype))
         
         # wraps a single digit in an array to keep return consistent 
-        if not isinstance(data, np.ndarray):
-            data = np.array([data])
-        return data
+        return np.atleast_1d(data)
    
     def extract_netcdf(self, extract_path, **kwargs):
         """Extracts netcdf files using python-netCDF4, 
@@ -201,10 +226,235 @@ class CCPData(object):
         
         open_nc, lib = netcdf_open(self.multifile)
         nc_data = open_nc(extract_path, 'r')
-        file_obj = nc_data.variables[self.data_key]
+        file_obj = self.get_variable(nc_data)
         data = self.get_data(file_obj, **kwargs)
         nc_data.close()
         return data
+    
+    def get_variable(self, nc_data):
+        """Returns the data variable of an open netcdf file.
+        python-netCDF4 is told not to mask and scale the values
+        because unpacking is done by CCPData.unpack.
+        """
+        file_obj = nc_data.variables[self.data_key]
+        if hasattr(file_obj, 'set_auto_maskandscale'):
+            file_obj.set_auto_maskandscale(False)
+        return file_obj
+    
+    def unpack(self, data, dtype=None):
+        """Applies the packing formula:
+        data = packed_data*scale_factor + add_offset
+        :Param dtype:
+            Type of the unpacked values (e.g. 'float32'). The values 
+            are scaled in place in one new array of that type instead 
+            of going through float64 temporaries. 
+            'packed' returns the data as it is in the file; since the
+            formula is linear, consumers can unpack reduced results 
+            instead (e.g. the mean, or just *scale_factor for the std).
+            The default (None) is numpy's promotion of the formula.
+        Missing values aren't unpacked, they stay missing_value so
+        that they can still be masked by comparing against it.
+        """
+        if dtype == 'packed':
+            return data
+        if dtype is None:
+            out = np.asarray(self.add_offset + (data * self.scale_factor))
+            return self.keep_missing(data, out)
+        out = np.empty(np.shape(data), dtype)
+        # computed in the type of out (a float32 scale_factor 
+        # would otherwise round float64 results to float32)
+        if self.scale_factor != 1:
+            np.multiply(data, self.scale_factor, out=out, dtype=out.dtype,
+                        casting='unsafe')
+        else:
+            out[...] = data
+        if self.add_offset != 0:
+            np.add(out, self.add_offset, out=out, dtype=out.dtype,
+                   casting='unsafe')
+        return self.keep_missing(data, out)
+    
+    def keep_missing(self, packed, out):
+        """Puts missing_value back where packed is missing, since
+        netCDF4 isn't left to mask the values (see get_variable)
+        """
+        missing_value = getattr(self, 'missing_value', None)
+        if missing_value is None or (self.scale_factor == 1 and 
+                                     self.add_offset == 0):
+            return out
+        missing = np.equal(packed, missing_value)
+        if missing.any():
+            if out.ndim:
+                out[missing] = missing_value
+            else:
+                out = np.asarray(missing_value, out.dtype)
+        return out
+    
+    def unpacked_dtype(self, dtype=None):
+        """Returns the dtype of the data once it's unpacked 
+        (see unpack), the default is unpack_dtype.
+        """
+        if dtype is None:
+            dtype = self.unpack_dtype
+        packed = np.zeros(1, getattr(self, 'dtype', np.float64))
+        return self.unpack(packed, dtype).dtype
+    
+    def iter_chunks(self, chunk_size=None, **kwargs):
+        """Yields the selected data a block of time steps at a time, 
+        so that selections that don't fit in memory can be streamed.
+        :Param chunk_size:
+            Number of time steps per chunk. The default is however 
+            many fit in CHUNK_BYTES.
+        :Param coords:
+            Dictionary containing the region to restrict the data to
+        :Param time_range:
+            Dictionary containing the time to restrict the data to
+        Note: see get_all_data docs for more detailed discription of coords and time_range
+        :Param rows:
+            Slice of the selected time steps (counted from the start 
+            of the selection) to restrict the iteration to.
+        :Param band:
+            Slice of the second dimension of the selection (see 
+            iter_tiles) to restrict the iteration to, so that tiles 
+            can be streamed separately (e.g. in parallel).
+        :Param dtype:
+            Type to unpack the data to (see unpack)
+        :Return:
+            Iterator of (time_slice, data) pairs. time_slice indexes
+            the time axis of the file and data is the unpacked chunk, 
+            not squeezed, with time as the first dimension. 
+        
+        """
+        coords = kwargs.get('coords', dict())
+        time_range = kwargs.get('time_range', dict())
+        inds = self.get_inds(time_range, coords)
+        if kwargs.get('band') is not None:
+            inds = self.band_inds(inds, kwargs['band'])
+        time = inds[0]
+        rows = kwargs.get('rows')
+        dtype = kwargs.get('dtype', self.unpack_dtype)
+        if rows is not None:
+            start, stop, step = rows.indices(time.stop - time.start)
+            time = slice(time.start + start, time.start + max(start, stop))
+        if chunk_size is None:
+            chunk_size = self.chunk_size(inds, dtype)
+        
+        open_nc, lib = netcdf_open(self.multifile)
+        with slicecache.IO_LOCK:
+            nc_data = open_nc(self.file_path, 'r')
+        try:
+            file_obj = self.get_variable(nc_data)
+            for start in xrange(time.start, time.stop, chunk_size):
+                tslice = slice(start, min(start + chunk_size, time.stop))
+                with slicecache.IO_LOCK:
+                    data = file_obj[(tslice,) + inds[1:]]
+                log.debug("chunk %s-%s", tslice.start, tslice.stop)
+                yield tslice, self.unpack(data, dtype)
+        finally:
+            with slicecache.IO_LOCK:
+                nc_data.close()
+    
+    def iter_tiles(self, tile_bytes=CHUNK_BYTES, **kwargs):
+        """Yields the selection a band of its second dimension 
+        (latitudes, or sites) at a time, with every selected time 
+        step, for computations that need a cell's whole series.
+        :Param tile_bytes:
+            Most bytes of a tile once it's in work_dtype (at least 
+            one row of the band is read)
+        :Param coords:
+            Dictionary containing the region to restrict the data to
+        :Param time_range:
+            Dictionary containing the time to restrict the data to
+        :Param dtype:
+            Type to unpack the data to (see unpack)
+        :Param work_dtype:
+            Type the tiles are computed in (e.g. float64 for packed 
+            data that's unpacked afterwards), which sizes them, 
+            default the unpacked dtype
+        :Return:
+            Iterator of (rows, data) pairs. rows slices the second 
+            dimension of the selection and data is the unpacked tile, 
+            not squeezed, with time as the first dimension. 
+        """
+        coords = kwargs.get('coords', dict())
+        time_range = kwargs.get('time_range', dict())
+        dtype = kwargs.get('dtype', self.unpack_dtype)
+        inds = self.get_inds(time_range, coords)
+        shape = self.selection_shape(inds=inds)
+        nrows = self.band_size(inds, tile_bytes, 
+                               kwargs.get('work_dtype', dtype))
+        
+        open_nc, lib = netcdf_open(self.multifile)
+        with slicecache.IO_LOCK:
+            nc_data = open_nc(self.file_path, 'r')
+        try:
+            file_obj = self.get_variable(nc_data)
+            for start in xrange(0, shape[1], nrows):
+                rows = slice(start, min(start + nrows, shape[1]))
+                with slicecache.IO_LOCK:
+                    data = file_obj[self.band_inds(inds, rows)]
+                log.debug("tile %s-%s", rows.start, rows.stop)
+                yield rows, self.unpack(data, dtype)
+        finally:
+            with slicecache.IO_LOCK:
+                nc_data.close()
+    
+    def band_size(self, inds, tile_bytes=CHUNK_BYTES, dtype=None):
+        """Returns the number of rows of the second dimension of the
+        selection whose every time step fits in tile_bytes once 
+        unpacked (at least one).
+        """
+        shape = self.selection_shape(inds=inds)
+        itemsize = self.unpacked_dtype(dtype).itemsize
+        row_bytes = shape[0] * max(np.prod(shape[2:]), 1) * itemsize
+        return max(int(tile_bytes // row_bytes), 1)
+    
+    def band_inds(self, inds, rows):
+        """Restricts the index tuple of a selection (see get_inds) to
+        the slice rows of its second dimension.
+        """
+        band = inds[1]
+        if isinstance(band, slice):
+            band = np.arange(*band.indices(self.shape[1]))
+        if np.ndim(band) == 1:
+            band = as_slice(np.asarray(band)[rows])
+        else:
+            band = band[rows]
+        return (inds[0], band) + tuple(inds[2:])
+    
+    def chunk_size(self, inds, dtype=None):
+        """Returns the number of time steps that fit in CHUNK_BYTES
+        once unpacked.
+        :Param inds:
+            Index tuple of the selection (see get_inds)
+        :Param dtype:
+            Type the data is unpacked to (see unpack)
+        """
+        step_shape = self.selection_shape(inds=inds)[1:]
+        itemsize = self.unpacked_dtype(dtype).itemsize
+        step_bytes = max(np.prod(step_shape), 1) * itemsize
+        return max(int(CHUNK_BYTES // step_bytes), 1)
+    
+    def selection_shape(self, **kwargs):
+        """Returns the shape of the selection as it's read from the file
+        (before squeezing and reshaping) without reading any data.
+        :Param coords:
+            Dictionary containing the region to restrict the data to
+        :Param time_range:
+            Dictionary containing the time to restrict the data to
+        :Param inds:
+            Index tuple from get_inds, used instead of coords and time_range
+        """
+        inds = kwargs.get('inds')
+        if inds is None:
+            inds = self.get_inds(kwargs.get('time_range', dict()), 
+                                 kwargs.get('coords', dict()))
+        shape = []
+        for ind, dim_len in zip(inds, self.shape):
+            if isinstance(ind, slice):
+                shape.append(len(xrange(*ind.indices(dim_len))))
+            else:
+                shape.append(np.size(ind))
+        return tuple(shape)
              
     def get_slice(self, file_obj, time_range, coords, height=Ellipsis):
         """Slices data assuming scipy.io is used to handle data, 
@@ -217,12 +467,49 @@ class CCPData(object):
         :Param coords:
             Dictionary containing the region to restrict the data to
         :Return: 
-            user selected subset of the data
+            user selected subset of the data, read only if it's
+            from the slice cache
+        """
+        inds = self.get_inds(time_range, coords, height)
+        if not self.slice_cache:
+            return file_obj[inds]
+        key = slicecache.slice_key(self, inds)
+        data = slicecache.SLICES.get(key)
+        if data is None:
+            with slicecache.IO_LOCK:
+                data = file_obj[inds]
+            data = slicecache.SLICES.put(key, data)
+        slicecache.PREFETCH.notice(self, inds, self.prefetch)
+        return data
+    
+    def read_slice(self, inds):
+        """Opens the file(s) and reads the data at inds 
+        (see get_inds), used to read ahead in the background.
+        """
+        open_nc, lib = netcdf_open(self.multifile)
+        with slicecache.IO_LOCK:
+            nc_data = open_nc(self.file_path, 'r')
+            try:
+                return np.array(self.get_variable(nc_data)[inds])
+            finally:
+                nc_data.close()
+    
+    def get_inds(self, time_range, coords, height=Ellipsis):
+        """Converts time_range and coords into a tuple of indices 
+        into the data on disk. Contiguous lat/lon ranges are returned 
+        as slices, so that they are read as a single block.
+        :Param time_range:
+            Dictionary containing the time to restrict the data to
+        :Param coords:
+            Dictionary containing the region to restrict the data to
+        :Return:
+            tuple of indices, time first
         """
         time = indices.time_to_slice(self.time, self.time_units, time_range)
         lat_lon = indices.coord_to_inds(self.lat, self.lon, coords, self.gridded)
+        height_ind = slice(None)
         if height != Ellipsis:
-            height_ind = height_to_slice(self.height, height)
+            height_ind = indices.height_to_slice(self.height, height)
     
         #assumes time is the first index
         inds = [time]
@@ -233,6 +520,11 @@ class CCPData(object):
             inds.append(height_ind)
         if self.gridded:
             (lat, lon) = lat_lon
+            # a slice and an np.ix_ array don't combine the way two
+            # np.ix_ arrays do, so slices are only used for both or neither
+            (lat_s, lon_s) = (as_slice(lat), as_slice(lon))
+            if isinstance(lat_s, slice) and isinstance(lon_s, slice):
+                (lat, lon) = (lat_s, lon_s)
             inds.append(lat)
             inds.append(lon)
         elif len(self.shape) == 2:
@@ -241,7 +533,7 @@ class CCPData(object):
             # This should probably be a different type of error
             raise ValueError("unhandled dimension")
         
-        return file_obj[tuple(inds)]
+        return tuple(inds)
     
     def get_extract_func(self):
         """Returns a function to extract the data 
@@ -266,5 +558,14 @@ def netcdf_open(multifile=False):
         return netCDF4.Dataset, 'netCDF4'
     except ImportError, e:                                                     
         import scipy.io.netcdf as nc                                           
-        return nc.netcdf_file, 'scipy.io'                                      
+        return nc.netcdf_file, 'scipy.io'
+
+def as_slice(ind):
+    """Returns an equivalent slice if the index array (e.g. from np.ix_)
+    is a contiguous run, otherwise returns the index unchanged. 
+    """
+    flat = np.ravel(ind)
+    if flat.size and (np.diff(flat) == 1).all():
+        return slice(int(flat[0]), int(flat[-1]) + 1)
+    return ind                                      
         
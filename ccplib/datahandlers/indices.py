@@ -20,8 +20,6 @@ import calendar
 import datetime
 # http://docs.scipy.org/doc/numpy-1.6.0/reference/
 import numpy as np
-# http://pypi.python.org/pypi/coards/0.2.2
-import coards
 
 import ccplib.misc.utils
 
@@ -49,12 +47,12 @@ def coord_to_inds(lat, lon, coords, gridded = True):
     
     """
     
-    log.debug("original coords: {!r}".format(coords))
+    log.debug("original coords: %r", coords)
     
     # Converts string coordinates into numbers
     top, bottom, right, left = convert_coords(lat, lon, coords)
     
-    log.debug("converted coords: {!r}".format(coords))
+    log.debug("converted coords: %r", coords)
       
     if not gridded:
         # only works if lat_1 and lon_1 are in the map
@@ -62,13 +60,14 @@ def coord_to_inds(lat, lon, coords, gridded = True):
         sites = zip(lat, lon)
         lat_lon = [sites.index((la,lo)) for (la,lo) in sites
                    if top >= la >= bottom and left <= lo <= right]
-        log.debug("number of site's found: {}".format(len(lat_lon)))
+        log.debug("number of site's found: %s", len(lat_lon))
     else:
         # np.where = np.zero if only condition is given
         lat_inds = ((top >= lat) & (lat >= bottom)).nonzero()
-        log.debug("lat shape: {}".format(lat_inds[0].shape))
         lon_inds = ((left <= lon) & (lon <= right)).nonzero()
-        log.debug("lon shape: {}".format(lon_inds[0].shape))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("lat shape: %s", lat_inds[0].shape)
+            log.debug("lon shape: %s", lon_inds[0].shape)
         # builds a meshgrid from two one dimensional scalers
         lat_lon = np.ix_(lat_inds[0], lon_inds[0])
     return lat_lon
@@ -124,22 +123,24 @@ def time_to_slice(time, time_units, time_range):
     
     """
     
-    log.debug("time units: {}".format(time_units))
+    log.debug("time units: %s", time_units)
+    # http://pypi.python.org/pypi/coards/0.2.2
+    import coards
 
     t_start = time_range.get('start', time.min())
-    log.debug("arg start time: {}".format(t_start))
+    log.debug("arg start time: %s", t_start)
     t_end = time_range.get('end', time.max())
-    log.debug("arg end time: {}".format(t_end))
+    log.debug("arg end time: %s", t_end)
     
     if isinstance(t_start, list):
         datetime_start = create_start_time(t_start)
         t_start = coards.to_udunits(datetime_start, time_units) 
-        log.debug("converted start time: {}".format(t_start))
+        log.debug("converted start time: %s", t_start)
         
     if isinstance(t_end, list):
         datetime_end = create_end_time(t_end)
         t_end = coards.to_udunits(datetime_end, time_units) 
-        log.debug("converted end time: {}".format(t_end))
+        log.debug("converted end time: %s", t_end)
     
     # flips time if t1>t2
     if t_start>t_end:
@@ -147,10 +148,44 @@ def time_to_slice(time, time_units, time_range):
         return time_to_slice(time, time_units, time2)
     
     t_inds = ((t_start <= time) & (time <= t_end)).nonzero()[0]
-    log.debug("time_inds: {}-{}".format(t_inds[0], t_inds[-1]))
+    log.debug("time_inds: %s-%s", t_inds[0], t_inds[-1])
 
     return slice(t_inds[0], t_inds[-1]+1)
     
+def time_to_iso(time, time_units):
+    """Converts an array of times to isoformat strings (to the second), 
+    the same as coards.from_udunits(t, time_units).isoformat()[:19] 
+    but for the whole array at once. 
+    :Param time: 
+        array of timestamps of the observations in the data.
+    :Param time_units:
+        A string  of the form 'time units since reference time' 
+    :Return:
+        Array of strings
+    """
+    dates = time_to_datetime64(time, time_units)
+    return np.datetime_as_string(dates, unit='s')
+
+def time_to_datetime64(time, time_units):
+    """Converts an array of times to numpy datetime64 (microseconds), 
+    so calendar fields (months, days) can be computed for the whole 
+    array at once.
+    :Param time: 
+        array of timestamps of the observations in the data.
+    :Param time_units:
+        A string  of the form 'time units since reference time' 
+    """
+    # http://pypi.python.org/pypi/coards/0.2.2
+    import coards
+    # the offset and unit length are converted once
+    # and the rest is numpy datetime arithmetic
+    origin = coards.from_udunits(0, time_units)
+    unit = coards.from_udunits(1, time_units) - origin
+    unit_us = (unit.days*86400 + unit.seconds)*10**6 + unit.microseconds
+    offsets = np.round(np.asarray(time, dtype=np.float64) * unit_us)
+    return (np.datetime64(origin, 'us') + 
+            offsets.astype(np.int64).astype('timedelta64[us]'))
+
 def create_start_time(t_start):
     """Pads start time to be the first possible time
        because datetime needs year, month, day
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+#
+# shmcache.py
+#
+# Hannah Aizenman, 2012-03
+#
+# http://www.opensource.org/licenses/bsd-license.php
+
+"""A slice cache shared by every process on the machine, e.g. the
+pre-forked ccpweb workers. Each slice is written once as a .npy file
+in /dev/shm (RAM backed) and every process that needs it maps the
+file read only, so the workers share one copy of the data in memory
+instead of reading and keeping their own.
+
+The index of the slices is a small json file, changed under an
+exclusive file lock. It records the size, last use and the processes
+holding a mapping of each slice (its reference count). Slices nobody
+holds are dropped least recently used first to stay under the budget.
+"""
+
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/2.7/library/os.html
+import os
+# http://docs.python.org/2.7/library/errno.html
+import errno
+# http://docs.python.org/2.7/library/fcntl.html
+import fcntl
+# http://docs.python.org/2.7/library/json.html
+import json
+# http://docs.python.org/2.7/library/time.html
+import time
+# http://docs.python.org/2.7/library/hashlib.html
+import hashlib
+# http://docs.python.org/2.7/library/logging.html
+import logging
+# http://docs.python.org/2.7/library/tempfile.html
+import tempfile
+# http://docs.python.org/2.7/library/threading.html
+import threading
+# http://docs.python.org/2.7/library/weakref.html
+import weakref
+# http://docs.python.org/2.7/library/contextlib.html
+from contextlib import contextmanager
+
+# http://docs.scipy.org/doc/numpy-1.6.0/reference/
+import numpy as np
+
+import ccplib.misc.utils
+
+log = logging.getLogger(ccplib.misc.utils.LOGNAME)
+
+# Budget of the shared slices, across all the processes
+SHARED_BYTES = 1024 * 2**20
+# tmpfs, so the files never go to disk
+SHM_PATH = '/dev/shm'
+
+class SharedCache(object):
+    """Slices shared between processes as memory mapped .npy files.
+    :Param path:
+        Folder the slices and the index are kept in, every process
+        sharing the cache must use the same one (see default_path)
+    :Param max_bytes:
+        Budget of all the slices, the least recently used slices
+        nobody holds are dropped to stay under it
+    """
+    INDEX = 'index.json'
+    LOCK = 'index.lock'
+
+    def __init__(self, path=None, max_bytes=SHARED_BYTES):
+        self.path = path or default_path()
+        self.max_bytes = max_bytes
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+        self.counters = dict(hits=0, misses=0, evictions=0, skipped=0)
+        self._reset()
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__, self.path)
+
+    def _reset(self):
+        """State that belongs to this process (redone after a fork)
+        """
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        # number of live arrays mapping each slice in this process
+        self._holds = dict()
+        # weak references to the arrays, by id
+        self._refs = dict()
+        # slices whose arrays were garbage collected, released
+        # the next time the index is open
+        self._released = []
+
+    def _check_fork(self):
+        if os.getpid() != self._pid:
+            self._reset()
+
+    def __contains__(self, key):
+        with self._index() as index:
+            return digest(key) in index
+
+    def get(self, key):
+        """Returns the slice mapped read only or None
+        """
+        name = digest(key)
+        with self._index() as index:
+            entry = index.get(name)
+            if entry is None or not os.path.exists(self._file(name)):
+                index.pop(name, None)
+                self.counters['misses'] += 1
+                return None
+            data = self._map(name, entry)
+            self.counters['hits'] += 1
+        return data
+
+    def put(self, key, data):
+        """Shares a slice and returns it mapped from the shared file,
+        or returns data as is if it can't be shared (masked, objects,
+        bigger than the budget).
+        """
+        if (data.nbytes > self.max_bytes or data.dtype.hasobject or
+            isinstance(data, np.ma.MaskedArray)):
+            return data
+        name = digest(key)
+        # written outside the lock, renamed into place atomically
+        (fd, tmp) = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                np.save(tmp_file, np.ascontiguousarray(data))
+            with self._index() as index:
+                entry = index.get(name)
+                if entry is None:
+                    if not self._make_room(index, data.nbytes):
+                        self.counters['skipped'] += 1
+                        return data
+                    os.rename(tmp, self._file(name))
+                    entry = dict(nbytes=data.nbytes, holders=[])
+                    index[name] = entry
+                return self._map(name, entry)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _map(self, name, entry):
+        """Maps the slice and holds it until the array is collected.
+        Called with the index open.
+        """
+        data = np.load(self._file(name), mmap_mode='r')
+        entry['used'] = time.time()
+        if self._pid not in entry['holders']:
+            entry['holders'].append(self._pid)
+        with self._lock:
+            self._holds[name] = self._holds.get(name, 0) + 1
+        ref = weakref.ref(data, self._release_callback(name))
+        self._refs[id(ref)] = ref
+        return data
+
+    def _release_callback(self, name):
+        pid = self._pid
+        def release(ref):
+            # may run in any thread: only note it, the index
+            # is changed next time it's open
+            if os.getpid() == pid:
+                self._refs.pop(id(ref), None)
+                self._released.append(name)
+        return release
+
+    def _release(self, index):
+        """Drops this process from the holders of the slices
+        it no longer maps. Called with the index open.
+        """
+        with self._lock:
+            released, self._released = self._released, []
+            for name in released:
+                count = self._holds.get(name, 0) - 1
+                if count > 0:
+                    self._holds[name] = count
+                    continue
+                self._holds.pop(name, None)
+                entry = index.get(name)
+                if entry is not None and self._pid in entry['holders']:
+                    entry['holders'].remove(self._pid)
+
+    def _make_room(self, index, nbytes):
+        """Drops least recently used slices that no live process holds
+        until nbytes fit in the budget.
+        :Return:
+            whether there's room
+        """
+        total = sum(entry['nbytes'] for entry in index.itervalues())
+        if total + nbytes <= self.max_bytes:
+            return True
+        free = []
+        for name, entry in index.items():
+            entry['holders'] = [pid for pid in entry['holders']
+                                if alive(pid)]
+            if not entry['holders']:
+                free.append((entry.get('used', 0), name))
+        for used, name in sorted(free):
+            if total + nbytes <= self.max_bytes:
+                break
+            total -= index.pop(name)['nbytes']
+            remove(self._file(name))
+            self.counters['evictions'] += 1
+        return total + nbytes <= self.max_bytes
+
+    @contextmanager
+    def _index(self):
+        """Opens the index under an exclusive lock, yields it as a
+        dictionary and writes it back if it changed.
+        """
+        self._check_fork()
+        with open(os.path.join(self.path, self.LOCK), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                index = self._read_index()
+                before = json.dumps(index, sort_keys=True)
+                self._release(index)
+                yield index
+                if json.dumps(index, sort_keys=True) != before:
+                    self._write_index(index)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_index(self):
+        try:
+            with open(os.path.join(self.path, self.INDEX)) as index_file:
+                return json.load(index_file)
+        except (IOError, ValueError), e:
+            return dict()
+
+    def _write_index(self, index):
+        (fd, tmp) = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+        with os.fdopen(fd, 'w') as index_file:
+            json.dump(index, index_file)
+        os.rename(tmp, os.path.join(self.path, self.INDEX))
+
+    def _file(self, name):
+        return os.path.join(self.path, name + '.npy')
+
+    def stats(self):
+        with self._index() as index:
+            stats = dict(self.counters)
+            holders = [len(entry['holders']) for entry in index.itervalues()]
+            stats.update(slices=len(index), max_bytes=self.max_bytes,
+                         nbytes=sum(entry['nbytes']
+                                    for entry in index.itervalues()),
+                         held=sum(1 for count in holders if count),
+                         path=self.path)
+        return stats
+
+    def clear(self):
+        """Drops every slice, mapped arrays stay valid until collected
+        """
+        with self._index() as index:
+            for name in index.keys():
+                remove(self._file(name))
+            index.clear()
+
+def digest(key):
+    """File name of a slice key (see slicecache.slice_key), the same
+    in every process
+    """
+    return hashlib.sha1(repr(key)).hexdigest()
+
+def default_path():
+    """Folder in /dev/shm (the temp folder where there's no /dev/shm)
+    for the user running the process
+    """
+    base = SHM_PATH if os.path.isdir(SHM_PATH) else tempfile.gettempdir()
+    return os.path.join(base, 'ccplib-{}'.format(os.getuid()))
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        return e.errno == errno.EPERM
+    return True
+
+def remove(path):
+    # processes that have it mapped keep their pages until they unmap
+    try:
+        os.remove(path)
+    except OSError, e:
+        if e.errno != errno.ENOENT:
+            raise
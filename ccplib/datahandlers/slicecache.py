@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+#
+# slicecache.py
+#
+# Hannah Aizenman, 2012-03
+#
+# http://www.opensource.org/licenses/bsd-license.php
+
+"""This module keeps recently read slices of the data in memory
+(SliceCache) and reads ahead when a dataset is being stepped through
+in time, e.g. a user paging through monthly maps (Prefetcher), so that
+the next step comes out of RAM instead of off the disk. With share()
+the slices also go in a cache shared by all the processes on the
+machine (see shmcache), so pre-forked web workers keep one copy.
+"""
+
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/2.7/library/os.html
+import os
+# http://docs.python.org/2.7/library/glob.html
+import glob
+# http://docs.python.org/2.7/library/logging.html
+import logging
+# http://docs.python.org/2.7/library/threading.html
+import threading
+# http://docs.python.org/2.7/library/queue.html
+import Queue
+# http://docs.python.org/2.7/library/collections.html
+import collections
+
+# http://docs.scipy.org/doc/numpy-1.6.0/reference/
+import numpy as np
+
+import ccplib.misc.utils
+from ccplib.datahandlers import shmcache
+
+log = logging.getLogger(ccplib.misc.utils.LOGNAME)
+
+# Memory budget of the shared cache of slices
+CACHE_BYTES = 256 * 2**20
+# Most memory the slices read ahead for one access may take up
+PREFETCH_BYTES = 64 * 2**20
+
+# netcdf libraries aren't thread safe, so reads in the prefetch
+# thread and the reads that might overlap them take turns
+IO_LOCK = threading.Lock()
+
+class SliceCache(object):
+    """Least recently used cache of slices (arrays as read from the
+    file) bounded by the total size of the arrays.
+    :Param max_bytes:
+        Memory budget, the least recently used slices are dropped
+        to stay under it
+    :Param shared:
+        shmcache.SharedCache to look in on a miss and to put the
+        slices in, None to keep them in this process only
+    """
+    def __init__(self, max_bytes=CACHE_BYTES, shared=None):
+        self._lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.nbytes = 0
+        self.slices = collections.OrderedDict()
+        self.counters = dict(hits=0, misses=0, evictions=0)
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__, self.stats())
+
+    def __contains__(self, key):
+        return key in self.slices or (self.shared is not None and
+                                      key in self.shared)
+
+    def get(self, key):
+        """Returns the cached slice or None
+        """
+        with self._lock:
+            data = self.slices.pop(key, None)
+            if data is not None:
+                # moves it to the most recently used end
+                self.slices[key] = data
+                self.counters['hits'] += 1
+                return data
+            self.counters['misses'] += 1
+        if self.shared is not None:
+            data = self.shared.get(key)
+            if data is not None:
+                self._keep(key, data)
+        return data
+
+    def put(self, key, data):
+        """Caches a slice (read only, since it's shared),
+        unless it's bigger than the budget.
+        """
+        if self.shared is not None:
+            data = self.shared.put(key, data)
+        if data.nbytes > self.max_bytes:
+            return data
+        if not (data.flags.owndata or isinstance(data, np.memmap)):
+            # e.g. a view of a memory mapped file that's about to close
+            data = data.copy()
+        data.flags.writeable = False
+        self._keep(key, data)
+        return data
+
+    def _keep(self, key, data):
+        with self._lock:
+            old = self.slices.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self.slices[key] = data
+            self.nbytes += data.nbytes
+            while self.nbytes > self.max_bytes:
+                (dropped, old) = self.slices.popitem(last=False)
+                self.nbytes -= old.nbytes
+                self.counters['evictions'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats.update(slices=len(self.slices), nbytes=self.nbytes,
+                         max_bytes=self.max_bytes)
+        if self.shared is not None:
+            stats['shared'] = self.shared.stats()
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self.slices.clear()
+            self.nbytes = 0
+
+class Prefetcher(object):
+    """Watches the time slices read from each dataset and, when they
+    step through time (forwards or backwards) with the same region,
+    reads the next steps into the cache in a background thread.
+    Pending reads are dropped as soon as the pattern breaks.
+    :Param cache:
+        SliceCache the slices are read into
+    :Param max_bytes:
+        Most memory the slices read ahead for one access may take up
+    """
+    def __init__(self, cache, max_bytes=PREFETCH_BYTES):
+        self._lock = threading.Lock()
+        self.cache = cache
+        self.max_bytes = max_bytes
+        # last access and generation of each dataset
+        self.last = dict()
+        self.generations = collections.defaultdict(int)
+        self.queue = Queue.Queue()
+        # keys of the slices that are queued
+        self.pending = set()
+        self.worker = None
+        self.counters = dict(scheduled=0, read=0, cancelled=0)
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__, self.stats())
+
+    def notice(self, data_obj, inds, steps):
+        """Records an access of data_obj at inds (see CCPData.get_inds)
+        and schedules the next steps slices if it continues a
+        sequential pattern.
+        :Param steps:
+            Number of steps to read ahead
+        """
+        time = inds[0]
+        if not (steps and isinstance(time, slice)):
+            return
+        token = dataset_token(data_obj)
+        region = inds_key(inds[1:])
+        length = time.stop - time.start
+        with self._lock:
+            last = self.last.get(token)
+            self.last[token] = (time, region)
+            if last is None:
+                return
+            (last_time, last_region) = last
+            delta = time.start - last_time.start
+            sequential = (region == last_region and delta in
+                          (length, -length) and
+                          length == last_time.stop - last_time.start)
+            if not sequential:
+                if delta:
+                    # pattern broke, the pending reads aren't needed
+                    self.generations[token] += 1
+                return
+            generation = self.generations[token]
+
+        step_bytes = self.step_bytes(data_obj, inds)
+        steps = min(steps, int(self.max_bytes // max(step_bytes, 1)))
+        for step in range(1, steps + 1):
+            start = time.start + step * delta
+            if start < 0 or start + length > data_obj.shape[0]:
+                break
+            ahead = (slice(start, start + length),) + tuple(inds[1:])
+            self.schedule((token, generation, data_obj, ahead))
+
+    def step_bytes(self, data_obj, inds):
+        shape = data_obj.selection_shape(inds=inds)
+        itemsize = np.dtype(getattr(data_obj, 'dtype', np.float64)).itemsize
+        return int(np.prod(shape)) * itemsize
+
+    def schedule(self, task):
+        """Queues (token, generation, data_obj, inds) unless 
+        the slice is already cached or queued
+        """
+        key = slice_key(task[2], task[3])
+        with self._lock:
+            if key in self.cache or key in self.pending:
+                return
+            self.pending.add(key)
+            self.counters['scheduled'] += 1
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self.run)
+                self.worker.daemon = True
+                self.worker.start()
+        self.queue.put(task)
+
+    def run(self):
+        """Reads the scheduled slices, one at a time
+        """
+        while True:
+            (token, generation, data_obj, inds) = self.queue.get()
+            key = slice_key(data_obj, inds)
+            try:
+                if generation != self.generations[token]:
+                    with self._lock:
+                        self.counters['cancelled'] += 1
+                elif key not in self.cache:
+                    self.cache.put(key, data_obj.read_slice(inds))
+                    with self._lock:
+                        self.counters['read'] += 1
+            except Exception, e:
+                log.warning("prefetch failed: %r", e)
+            finally:
+                with self._lock:
+                    self.pending.discard(key)
+                self.queue.task_done()
+
+    def wait(self):
+        """Blocks until all the scheduled reads are done
+        """
+        self.queue.join()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats['pending'] = self.queue.qsize()
+        return stats
+
+def slice_key(data_obj, inds):
+    """Key of a slice in the cache
+    """
+    return (dataset_token(data_obj), inds_key(inds))
+
+def inds_key(inds):
+    """Hashable version of a tuple of indices (slices, lists, arrays)
+    """
+    key = []
+    for ind in inds:
+        if isinstance(ind, slice):
+            key.append((ind.start, ind.stop, ind.step))
+        elif isinstance(ind, (np.ndarray, list, tuple)):
+            arr = np.asarray(ind)
+            key.append((arr.shape, tuple(arr.ravel().tolist())))
+        else:
+            key.append(ind)
+    return tuple(key)
+
+def dataset_token(data_obj):
+    """Identifies the dataset and the version of its files
+    (size and modification time), so that slices of a file that
+    changed are never returned. Computed once per CCPData object.
+    """
+    token = getattr(data_obj, '_cache_token', None)
+    if token is None:
+        file_path = data_obj.file_path
+        if isinstance(file_path, basestring):
+            file_path = sorted(glob.glob(file_path)) or [file_path]
+        stats = []
+        for path in file_path:
+            try:
+                stat = os.stat(path)
+                stats.append((path, stat.st_size, stat.st_mtime))
+            except OSError, e:
+                stats.append((path,))
+        token = (data_obj.data_key, tuple(stats))
+        data_obj._cache_token = token
+    return token
+
+def share(path=None, max_bytes=shmcache.SHARED_BYTES):
+    """Puts the slices read in this process (and its forks) in the
+    cache shared by all the processes using path.
+    :Param path:
+        Folder of the shared cache, default shmcache.default_path()
+    :Param max_bytes:
+        Budget of the shared cache
+    """
+    SLICES.shared = shmcache.SharedCache(path, max_bytes)
+    return SLICES.shared
+
+# shared by every CCPData object in the process
+SLICES = SliceCache()
+PREFETCH = Prefetcher(SLICES)
@@ -106,14 +106,14 @@ def fromNetCDF(file_path, **kwargs):
     open_nc, lib = ccpdata.netcdf_open(multifile)
     
     if open_nc and lib:
-        log.debug("ccpdata object handles info for: {}".format(file_path))
+        log.debug("ccpdata object handles info for: %s", file_path)
         nc_data = open_nc(file_path, 'r')   
     else:
         error_str = "invalid input: {} is not supported"
         raise Exception(error_str.format(file_path))
         
     meta_fields = nc_data.variables.keys()
-    log.debug("meta_fields: {!r}".format(meta_fields))
+    log.debug("meta_fields: %r", meta_fields)
     
     cname = get_common_dim_names()
     
@@ -178,16 +178,23 @@ def fromNetCDF(file_path, **kwargs):
                      data_key=data_key, 
                      time_units=time.units,
                      shape=data_field.shape, 
+                     dtype=data_field.dtype,
                      save_path=save_path,
                      labels = labels,
                      multifile = multifile
                      )
                      
     data_vals['gridded'] = kwargs.get('gridded', True)
+    for key in ['slice_cache', 'prefetch', 'unpack_dtype']:
+        if key in kwargs:
+            data_vals[key] = kwargs[key]
     # Extracts various params that don't show up in all netcdf files 
     for key in ['add_offset', 'scale_factor', 'missing_value']:
         if hasattr(data_field, key):
             data_vals[key] = getattr(data_field, key)
+    # netCDF4 would mask either, so both are missing values
+    if 'missing_value' not in data_vals and hasattr(data_field, '_FillValue'):
+        data_vals['missing_value'] = getattr(data_field, '_FillValue')
  
     nc_data.close()
     
@@ -223,7 +230,7 @@ def get_field_name(nc_field_keys, common_field_keys):
     # lower is used to provide case insensitivity.
     field_names = [key for key in nc_field_keys 
                         if key.lower() in common_field_keys]
-    log.debug("keys found: {!r}".format(field_names))
+    log.debug("keys found: %r", field_names)
     return field_names[0]  
 
 def get_data_field(nc_fields, data_dims):
@@ -246,6 +253,6 @@ def get_data_field(nc_fields, data_dims):
         if hasattr(nc_fields[key],'shape'):
             if data_dim.issubset(nc_fields[key].shape):
                 data_key_list.append(key)
-    log.debug("fields found: {!r}".format(data_key_list))
+    log.debug("fields found: %r", data_key_list)
     return data_key_list[0]                                
 
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+#
+# timing.py
+#
+# Hannah Aizenman, 2012-03
+#
+# http://www.opensource.org/licenses/bsd-license.php
+
+"""This module contains the spans used to time the stages of a request
+(url parsing, config lookup, reading, algorithm, drawing, png encoding):
+the spans of the current request are collected per thread so they can
+be reported back (e.g. in a Server-Timing header), and every span is
+also added to process wide histograms.
+"""
+
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/2.7/library/time.html
+import time
+# http://docs.python.org/2.7/library/threading.html
+import threading
+# http://docs.python.org/2.7/library/functools.html
+import functools
+# http://docs.python.org/2.7/library/contextlib.html
+import contextlib
+
+# upper bounds of the histogram buckets, in milliseconds
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000,
+           float('inf'))
+
+_local = threading.local()
+
+class Timer(object):
+    """Total time and number of calls of each span in a request,
+    in the order the spans were first entered.
+    """
+    def __init__(self):
+        self.start = time.time()
+        self.names = []
+        self.spans = dict()
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__, self.spans)
+
+    def record(self, name, seconds):
+        if name not in self.spans:
+            self.names.append(name)
+            self.spans[name] = [0.0, 0]
+        self.spans[name][0] += seconds
+        self.spans[name][1] += 1
+
+    def elapsed(self):
+        return time.time() - self.start
+
+class Histogram(object):
+    """Counts of durations by bucket (see BUCKETS), with the
+    count, total and max.
+    """
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__, self.stats())
+
+    def add(self, ms):
+        for i, bound in enumerate(BUCKETS):
+            if ms <= bound:
+                self.buckets[i] += 1
+                break
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def stats(self):
+        """Returns the histogram as a dictionary, the buckets are
+        keyed by upper bound ('le') like prometheus
+        """
+        mean = self.total / self.count if self.count else 0.0
+        buckets = [(str(bound), n) for bound, n in zip(BUCKETS, self.buckets)]
+        return dict(count=self.count, total_ms=round(self.total, 3),
+                    mean_ms=round(mean, 3), max_ms=round(self.max, 3),
+                    le=buckets)
+
+class Histograms(object):
+    """Histogram of each span name, shared by all the threads.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = dict()
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__, self.histograms.keys())
+
+    def add(self, name, seconds):
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].add(seconds * 1000.0)
+
+    def stats(self):
+        with self._lock:
+            return dict((name, hist.stats())
+                        for name, hist in self.histograms.items())
+
+    def clear(self):
+        with self._lock:
+            self.histograms.clear()
+
+HISTOGRAMS = Histograms()
+
+def start():
+    """Starts collecting the spans of the current thread,
+    returns the new Timer
+    """
+    _local.timer = Timer()
+    return _local.timer
+
+def stop():
+    """Stops collecting spans, returns the Timer (or None
+    if start wasn't called)
+    """
+    timer = current()
+    _local.timer = None
+    return timer
+
+def current():
+    """Returns the Timer of the current thread, if any
+    """
+    return getattr(_local, 'timer', None)
+
+def record(name, seconds):
+    """Adds a duration to the current Timer and the histograms
+    """
+    timer = current()
+    if timer is not None:
+        timer.record(name, seconds)
+    HISTOGRAMS.add(name, seconds)
+
+@contextlib.contextmanager
+def span(name):
+    """Times the body of a with statement:
+        with timing.span('read'):
+            ...
+    """
+    start_time = time.time()
+    try:
+        yield
+    finally:
+        record(name, time.time() - start_time)
+
+def timed(name):
+    """Decorator that times every call of a function as span name
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def server_timing(timer):
+    """Formats a Timer as the value of a Server-Timing header:
+        url;dur=0.1, read;dur=12.5, ..., total;dur=40.2
+    """
+    metrics = ["{};dur={:.1f}".format(name, timer.spans[name][0] * 1000.0)
+               for name in timer.names]
+    metrics.append("total;dur={:.1f}".format(timer.elapsed() * 1000.0))
+    return ", ".join(metrics)
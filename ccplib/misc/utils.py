@@ -43,6 +43,12 @@ def create_folder(save_path, overwrite = False):
 import logging
 # http://docs.python.org/2.7/library/logging.handlers.html
 import logging.handlers
+# http://docs.python.org/2.7/library/threading.html
+import threading
+# http://docs.python.org/2.7/library/queue.html
+import Queue
+# http://docs.python.org/2.7/library/time.html
+import time
 
 # User can change this through ccplib.misc.utils.logname = name
 # Must be set before unpack methods are called
@@ -51,40 +57,200 @@ import logging.handlers
 
 LOGNAME = 'ccplog'
 
-def setup_logging(save_path, scrnlog=True, txtlog=True, loglevel=logging.DEBUG):
+# handlers added by setup_logging, by log file (or 'console'),
+# so calling it again (fromNetCDF does for every dataset) adds none
+_HANDLERS = dict()
+# seconds QueueHandler.flush waits for the thread, 
+# so a stuck handler can't hang the exit
+FLUSH_TIMEOUT = 5
+_HANDLERS_LOCK = threading.Lock()
+# names of the loggers whose handlers are behind a QueueHandler
+# (see queue_logging), including the ones added later
+_QUEUED = set()
+
+def setup_logging(save_path, scrnlog=True, txtlog=True, loglevel=logging.INFO):
     """
     sets up a log in the logging directory, 
     adds new logs on every run
     an old log gets a number added to it, so for example:
     ccp.log becomes ccp.log.1
+    Each log file and the console get one handler per process,
+    and a log is rolled over when its handler is created, not on
+    every call. The level of the log is that of its lowest handler, 
+    and is left alone if there's nothing to log to, so debug messages
+    cost nothing unless loglevel is DEBUG. The records aren't passed 
+    on to the root logger's handlers too. 
     """
     
     log = logging.getLogger(LOGNAME)
-    log.setLevel(loglevel)
+    if not (scrnlog or txtlog):
+        return log
     
     log_format_str = "%(asctime)s - %(levelname)s :: %(message)s"
     log_formatter = logging.Formatter(log_format_str)
     
     lgfn = ".".join([LOGNAME, 'log']) 
     
-    if txtlog:
-        logdir = os.path.join(save_path, 'logs')
-        if not os.path.exists(logdir):
-            os.mkdir(logdir)
-        txt_handler = logging.handlers.RotatingFileHandler(
-                                os.path.join(logdir, lgfn), backupCount=5)
-        txt_handler.doRollover()
-        txt_handler.setLevel(loglevel)
-        txt_handler.setFormatter(log_formatter)
-        log.addHandler(txt_handler)
-        log.info("Logger initialised.")
+    with _HANDLERS_LOCK:
+        log.propagate = False
+        
+        if txtlog:
+            logdir = os.path.join(save_path, 'logs')
+            log_path = os.path.abspath(os.path.join(logdir, lgfn))
+            if log_path not in _HANDLERS:
+                if not os.path.exists(logdir):
+                    os.mkdir(logdir)
+                txt_handler = logging.handlers.RotatingFileHandler(
+                                        log_path, backupCount=5)
+                txt_handler.doRollover()
+                txt_handler.setLevel(loglevel)
+                txt_handler.setFormatter(log_formatter)
+                add_handler(log, txt_handler)
+                _HANDLERS[log_path] = txt_handler
+                log.info("Logger initialised.")
+                
+        if scrnlog and 'console' not in _HANDLERS:
+            console_handler = logging.StreamHandler()
+            console_handler.setLevel(logging.INFO)
+            console_handler.setFormatter(log_formatter)
+            add_handler(log, console_handler)
+            _HANDLERS['console'] = console_handler
+    return log
+
+def add_handler(logger, handler):
+    """Adds handler to logger, behind its QueueHandler if it's
+    queued (see queue_logging), and lowers the level of logger to 
+    that of its lowest handler
+    """
+    queued = [h for h in logger.handlers if isinstance(h, QueueHandler)]
+    if queued:
+        queued[0].handlers.append(handler)
+    elif logger.name in _QUEUED:
+        logger.addHandler(QueueHandler([handler]))
+    else:
+        logger.addHandler(handler)
+    levels = [h.level for h in logger.handlers 
+              if not isinstance(h, QueueHandler)]
+    for h in logger.handlers:
+        if isinstance(h, QueueHandler):
+            levels.extend(inner.level for inner in h.handlers)
+    lowest = min(levels)
+    if logger.level == logging.NOTSET or logger.level > lowest:
+        logger.setLevel(lowest)
+
+class QueueHandler(logging.Handler):
+    """Hands the records to a background thread that emits them with
+    the real handlers, so logging never waits on a file or a terminal.
+    Records are dropped (and counted) if the queue is full. The thread
+    is started in the process that logs, and the handlers get new locks
+    there, so it's safe to set up before forking workers.
+    :Param handlers:
+        Handlers the records are emitted with
+    :Param maxsize:
+        Most records waiting to be emitted
+    """
+    def __init__(self, handlers, maxsize=10000):
+        logging.Handler.__init__(self)
+        self.handlers = list(handlers)
+        self.maxsize = maxsize
+        self.dropped = 0
+        self.queue = None
+        self._pid = None
+        # by process: a lock held by another thread when the process
+        # forked is never released in the child
+        self._start_locks = dict()
+        
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__, self.handlers)
+        
+    def start(self):
+        """Starts the thread (and a new queue) in this process, with
+        new locks for the handlers, which the thread of the parent 
+        could have been holding when it forked
+        """
+        pid = os.getpid()
+        with self._start_locks.setdefault(pid, threading.Lock()):
+            if self._pid == pid:
+                return
+            for handler in self.handlers:
+                handler.createLock()
+            self._start_locks = {pid: self._start_locks[pid]}
+            self.queue = Queue.Queue(self.maxsize)
+            thread = threading.Thread(target=self.run, args=(self.queue,))
+            thread.daemon = True
+            thread.start()
+            self._pid = os.getpid()
+    
+    def prepare(self, record):
+        # the message is built now, the arguments may change
+        # before the thread gets to it
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                                                        record.exc_info)
+            record.exc_info = None
+        return record
+        
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
             
-    if scrnlog:
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(logging.INFO)
-        console_handler.setFormatter(log_formatter)
-        log.addHandler(console_handler)
+    def run(self, queue):
+        while True:
+            record = queue.get()
+            try:
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+            except Exception:
+                self.handleError(record)
+            finally:
+                queue.task_done()
+                
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        """Waits (at most timeout seconds) for the queued records 
+        to be emitted
+        """
+        if self._pid == os.getpid():
+            deadline = time.time() + timeout
+            with self.queue.all_tasks_done:
+                while self.queue.unfinished_tasks:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self.queue.all_tasks_done.wait(remaining)
+        for handler in self.handlers:
+            handler.flush()
         
+def queue_logging(names=('', LOGNAME), maxsize=10000):
+    """Moves the handlers of the loggers in names ('' is the root 
+    logger) behind a QueueHandler, for servers that shouldn't 
+    wait on logging. The handlers setup_logging adds later are
+    queued too.
+    :Return:
+        list of the QueueHandlers
+    """
+    queued = []
+    for name in names:
+        logger = logging.getLogger(name or None)
+        _QUEUED.add(logger.name)
+        handlers = [handler for handler in logger.handlers 
+                    if not isinstance(handler, QueueHandler)]
+        if not handlers:
+            continue
+        for handler in handlers:
+            logger.removeHandler(handler)
+        queue_handler = QueueHandler(handlers, maxsize)
+        logger.addHandler(queue_handler)
+        queued.append(queue_handler)
+    return queued
 
 # http://docs.python.org/2.7/library/smtplib.html    
 import smtplib                                          
@@ -18,16 +18,11 @@ import logging
 
 # http://docs.scipy.org/doc/numpy-1.6.0/user/
 import numpy as np
-# http://matplotlib.sourceforge.net/contents.html
-import matplotlib
-# http://matplotlib.sourceforge.net/api/ticker_api.html
-import matplotlib.ticker
-# http://matplotlib.sourceforge.net/api/cm_api.html
-import matplotlib.figure
-# http://matplotlib.sourceforge.net/api/backend_bases_api.html
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+# matplotlib is imported when a figure is first drawn (ccpfig), 
+# so that the helpers here don't pull it in
 
-import ccplib.misc
+import ccplib.misc.utils
+from ccplib.misc import timing
 
 log = logging.getLogger(ccplib.misc.utils.LOGNAME)
 
@@ -81,11 +76,17 @@ class Graph(object):
             save_path = kwargs.get('save_path', self.save_path)
             outfile = os.path.join(save_path, image_name)
             
+        # http://matplotlib.sourceforge.net/api/figure_api.html
+        import matplotlib.figure
+        # http://matplotlib.sourceforge.net/api/backend_bases_api.html
+        from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
         fig = matplotlib.figure.Figure(self.figsize, **figargs)
         canvas = FigureCanvas(fig)
         ax = fig.add_subplot(1,1,1)
-        self.ccpshow(im, ax, **kwargs)
-        canvas.print_figure(outfile)
+        with timing.span('draw'):
+            self.ccpshow(im, ax, **kwargs)
+        with timing.span('png'):
+            canvas.print_figure(outfile)
         return ax
     
     def get_labels(self, graph_data, kwargs):
@@ -162,7 +163,7 @@ def centered(im, threshold):
         log.debug("imrange is nan")
         return False
     place = int(np.log10(imrange))
-    log.debug("image range: {}, place: {}".format(imrange, place))
+    log.debug("image range: %s, place: %s", imrange, place)
     return (imrange/(10**place))<= threshold
                                                          
     
@@ -18,6 +18,10 @@ import os
 import logging
 # http://docs.python.org/2.7/library/datetime.html
 import datetime
+# http://docs.python.org/2.7/library/threading.html
+import threading
+# http://docs.python.org/2.7/library/collections.html
+import collections
 
 # http://pypi.python.org/pypi/coards/0.2.2
 import coards
@@ -31,13 +35,12 @@ import matplotlib.cm
 import matplotlib.axes
 # http://matplotlib.sourceforge.net/api/ticker_api.html
 import matplotlib.ticker
-# http://matplotlib.sourceforge.net/basemap/doc/html/api/basemap_api.html
-from mpl_toolkits.basemap import Basemap
-# http://matplotlib.sourceforge.net/mpl_toolkits/axes_grid/index.html
-import mpl_toolkits.axes_grid
+# Basemap and axes_grid (most of the import time) are imported
+# when the first map and colorbar are drawn
 
 import ccplib
 from ccplib.datahandlers import ccpdata, indices
+from ccplib.misc import timing
 from ccplib.visualization import ccpgraph
 
 log = logging.getLogger(ccplib.misc.utils.LOGNAME)
@@ -232,9 +235,10 @@ class SpatialGraph(ccpgraph.Graph):
                             lon_0=np.median(lon[:])
                             )
                             
-        log.debug("projection parameters: {!r}".format(proj_params))
+        log.debug("projection parameters: %r", proj_params)
         return (proj_params, lat, lon)
         
+    @timing.timed('basemap')
     def mapped_plot(self, im, ax, coords=None):
         """Returns an image of the projected data. 
         """
@@ -253,27 +257,40 @@ class SpatialGraph(ccpgraph.Graph):
             projection = self.projection
             
         # sets up map
-        mp = Basemap(projection=projection, ax=ax, **proj_kwargs)
-        mp.drawcoastlines()
-    
-        if self.map_grid:
-            parallels = np.arange(lat[-1], lat[0], self.par_deg)
-            meridians = np.arange(lon[0], lon[-1], self.mer_deg)
-            mp.drawparallels(parallels)
-            mp.drawmeridians(meridians) 
-        
-        mp.drawmapboundary()
+        mp = BASEMAPS.checkout(projection, **proj_kwargs)
+        try:
+            mp.drawcoastlines(ax=ax)
         
-        # Maps lats and lons to x and y coordinates in the mp object
-        # Credit goes to Ronan Lamy
-        # might need to be moved out of function
-        if projection in ['cyl']:
-            mg = mp.imshow(im, norm=self.norm, cmap=self.cmap, interpolation = "nearest")
-        else:
-            x, y = mp(*np.meshgrid(lon[:], lat[:]))
-            mg = mp.pcolor(x, y, im, norm=self.norm, cmap=self.cmap, ax=ax)
+            if self.map_grid:
+                parallels = np.arange(lat[-1], lat[0], self.par_deg)
+                meridians = np.arange(lon[0], lon[-1], self.mer_deg)
+                mp.drawparallels(parallels, ax=ax)
+                mp.drawmeridians(meridians, ax=ax) 
+            
+            mp.drawmapboundary(ax=ax)
+            
+            # Maps lats and lons to x and y coordinates in the mp object
+            # Credit goes to Ronan Lamy
+            # might need to be moved out of function
+            if projection in ['cyl']:
+                mg = mp.imshow(im, norm=self.norm, cmap=self.cmap, 
+                               interpolation = "nearest", ax=ax)
+            else:
+                x, y = mp(*np.meshgrid(lon[:], lat[:]))
+                mg = mp.pcolor(x, y, im, norm=self.norm, cmap=self.cmap, ax=ax)
+        finally:
+            BASEMAPS.checkin(mp)
         return 
     
+    def warm_basemaps(self, coords=None):
+        """Builds the Basemaps of projection and alt_projection
+        for coords (default the whole grid) ahead of the first map
+        """
+        (proj_kwargs, lat, lon) = self.get_projection_params(coords or dict())
+        projections = [self.projection, getattr(self, 'alt_projection', None)]
+        for projection in set(projections) - set([None]):
+            BASEMAPS.checkin(BASEMAPS.checkout(projection, **proj_kwargs))
+    
     def get_norm(self, im, bounds):
         """ Determines the value distribution of the data 
             for the colormap by mapping the data to a 0-1 scale.  
@@ -295,7 +312,7 @@ class SpatialGraph(ccpgraph.Graph):
             vmax = max(vmax, np.abs(vmin))
             vmin = vmax * -1
             
-        log.debug("norm: vmin={:.3}, vmax={:.3}".format(vmin, vmax))
+        log.debug("norm: vmin=%.3g, vmax=%.3g", vmin, vmax)
         if self.discrete:
             return discrete_norm(vmin, vmax, self.cmap)
         return matplotlib.colors.Normalize(vmin, vmax)    
@@ -308,6 +325,8 @@ class SpatialGraph(ccpgraph.Graph):
         # tries to ensure that the colorbar will be proportional 
         # to the axis
        
+        # http://matplotlib.sourceforge.net/mpl_toolkits/axes_grid/index.html
+        import mpl_toolkits.axes_grid
         divider = mpl_toolkits.axes_grid.make_axes_locatable(ax) 
         if self.orientation == 'vertical':
             cax = divider.new_horizontal(size="5%", pad=0.05, axes_class=matplotlib.axes.Axes) 
@@ -332,7 +351,7 @@ class SpatialGraph(ccpgraph.Graph):
         """Sets the labels based on the object, function, or data labels
         """
         
-        log.debug("Label kwargs: {!r}".format(kwargs))
+        log.debug("Label kwargs: %r", kwargs)
         # Maps the object keys to the dataobj keys
         graph_data = [('title', 'dataset'), 
                       ('cblabel', 'variable'),
@@ -349,6 +368,61 @@ class SpatialGraph(ccpgraph.Graph):
         ccpgraph.labelgraph(ax=ax, cb=cb, labels=labels)
         
         
+class BasemapPool(object):
+    """Basemaps by projection and parameters. Building a Basemap 
+    (projecting the coastlines) takes longer than drawing the map,
+    so they're reused. A Basemap is checked out while it draws, 
+    so no two graphs use one at the same time.
+    :Param max_size:
+        Number of Basemaps kept, the least recently used are dropped
+    """
+    def __init__(self, max_size=32):
+        self._lock = threading.Lock()
+        self.max_size = max_size
+        self.basemaps = collections.OrderedDict()
+        self.counters = dict(hits=0, misses=0)
+        
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__, self.basemaps.keys())
+        
+    def checkout(self, projection, **proj_kwargs):
+        """Returns a Basemap for the projection, 
+        which has to be checked back in after drawing
+        """
+        key = (projection, tuple(sorted((name, float(value)) for 
+                                        name, value in proj_kwargs.items())))
+        with self._lock:
+            mp = self.basemaps.pop(key, None)
+            self.counters['hits' if mp else 'misses'] += 1
+        if mp is None:
+            # http://matplotlib.sourceforge.net/basemap/doc/html/api/basemap_api.html
+            from mpl_toolkits.basemap import Basemap
+            mp = Basemap(projection=projection, **proj_kwargs)
+            mp._ccp_key = key
+        return mp
+        
+    def checkin(self, mp):
+        # forgets the axes it drew on, like a new Basemap
+        mp._mapboundarydrawn = False
+        mp._initialized_axes = set()
+        with self._lock:
+            self.basemaps[mp._ccp_key] = mp
+            while len(self.basemaps) > self.max_size:
+                self.basemaps.popitem(last=False)
+        
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['basemaps'] = len(self.basemaps)
+        return stats
+        
+    def clear(self):
+        with self._lock:
+            self.basemaps.clear()
+
+# shared by every SpatialGraph in the process
+BASEMAPS = BasemapPool()
+
 def add_time_to_label(time, labels, dtime = None, units=None):
     """Inserts time into title.
     """
@@ -104,8 +104,12 @@ class TemporalGraph(ccpgraph.Graph):
                 Dictionary of start and end points  if the time series is 
                 restricted, follows the conventions for time_range: 
                     {start: start_time, end: end_time}
-            :Param x data:
+            :Param xdata:
                 Numpy array of x axis data if it isn't time.
+            :Param xlabel:
+                The label for the x axis if it isn't time.
+            :Param xticklabels:
+                Names of the points of xdata, e.g. of periods
             :Param labels:
                 Dictionary containing various label fields:
                     :Param title:
@@ -138,6 +142,11 @@ class TemporalGraph(ccpgraph.Graph):
         elif 'xdata' in kwargs:
             ax.plot(kwargs['xdata'], im, linestyle = 'solid', 
                     marker = '.')
+            if 'xticklabels' in kwargs:
+                self.format_xlabels(ax, kwargs['xdata'], 
+                                    kwargs['xticklabels'])
+            if 'xlabel' in kwargs:
+                ax.set_xlabel(kwargs['xlabel'])
             log.debug("x/y plot")
         else:
             time_range = kwargs.get('time_range', dict())
@@ -150,6 +159,17 @@ class TemporalGraph(ccpgraph.Graph):
             self.set_labels(ax, **labels)
         return
     
+    def format_xlabels(self, ax, xdata, names):
+        """Labels the points of xdata with names, at most 
+        max_ticks of them
+        """
+        step = max(int(np.ceil(len(xdata) / float(self.max_ticks))), 1)
+        ax.xaxis.grid(True)
+        ax.xaxis.set_ticks_position('bottom')
+        ax.set_xlim(xdata[0] - 0.5, xdata[-1] + 0.5)
+        ax.set_xticks(xdata[::step])
+        ax.set_xticklabels(names[::step], rotation = 45)
+        
     def format_timelabels(self, ax, time_range):
         """Formats tick marks and creates x labels
         """
@@ -182,7 +202,7 @@ class TemporalGraph(ccpgraph.Graph):
         locater = matplotlib.ticker.MultipleLocator(base)
         ax.xaxis.set_major_locator(locater)
         ax.xaxis.set_ticklabels(dates, rotation = 45)
-        log.debug("time series containing {} points".format(len(times)))
+        log.debug("time series containing %s points", len(times))
       
     def get_base(self, num_pts):
         """Tries to find a base (multiplier) that returns
@@ -215,7 +235,7 @@ class TemporalGraph(ccpgraph.Graph):
         """
         Sets the labels based on the object, function, or labels
         """
-        log.debug("Label kwargs: {!r}".format(kwargs))
+        log.debug("Label kwargs: %r", kwargs)
         
         graph_data = [('title', 'dataset'),
                       ('ylabel', 'variable')]
@@ -268,7 +288,7 @@ def get_num_obs(dates, default):
         # assembles the spares back into lists/strings:
             #[[10-10], [10-19], [11-19]]
         rest = ['-'.join(d[1:]) for d in datesegs]
-        get_num_obs(rest, default)
+        return get_num_obs(rest, default)
         
 def add_location_to_label(location, labels):
     """Inserts the location into the graph
@@ -1,12 +1,33 @@
 from pyramid.config import Configurator
+from pyramid.settings import asbool
 from ccpweb.resources import Root
+from ccpweb import warmup
 
 def main(global_config, **settings):
     """ This function returns a Pyramid WSGI application.
     """
+    if asbool(settings.get('ccpweb.shared_cache', False)):
+        share_slices(settings)
+    if asbool(settings.get('ccpweb.log_queue', False)):
+        # requests don't wait on the log files or the console, 
+        # including the ccplog ones the datasets add as they open
+        from ccplib.misc import utils
+        utils.queue_logging(['', 'ccpweb', utils.LOGNAME])
     config = Configurator(root_factory=Root, settings=settings)
     config.scan()
-    app = config.make_wsgi_app()
     config.add_static_view('static', 'ccpweb:static')
-    return config.make_wsgi_app()
+    app = config.make_wsgi_app()
+    # opens the datasets, builds the Basemaps, draws the default graphs
+    warmup.start(app, settings)
+    return app
 
+def share_slices(settings):
+    """Keeps the slices read by the datasets in the cache shared by 
+    the worker processes (ccpweb.shared_cache_path, 
+    ccpweb.shared_cache_mb in the ini file)
+    """
+    from ccplib.datahandlers import slicecache, shmcache
+    max_mb = settings.get('ccpweb.shared_cache_mb')
+    max_bytes = int(max_mb) * 2**20 if max_mb else shmcache.SHARED_BYTES
+    return slicecache.share(settings.get('ccpweb.shared_cache_path'), 
+                            max_bytes)
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+#
+# autocomplete.py
+#
+# Hannah Aizenman, 2012-03
+#
+# http://www.opensource.org/licenses/bsd-license.php
+
+"""Prefix index used to answer autocomplete queries (e.g. time) 
+server side, so the client only gets the entries that match.
+"""
+
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/2.7/library/bisect.html
+import bisect
+
+class PrefixIndex(object):
+    """Sorted list of strings searched by prefix with a binary search.
+    :Param strings:
+        The entries to complete, duplicates are dropped
+    """
+    def __init__(self, strings):
+        self.keys = sorted(set(strings))
+        
+    def __repr__(self):
+        return "<{0!s}({1!r} entries)>".format(self.__class__, 
+                                               len(self.keys))
+        
+    def __len__(self):
+        return len(self.keys)
+        
+    def complete(self, prefix, limit=None):
+        """Returns the entries starting with prefix, in order.
+        :Param prefix:
+            The string typed so far
+        :Param limit:
+            Maximum number of entries returned (default is all)
+        """
+        start = bisect.bisect_left(self.keys, prefix)
+        # every entry with the prefix sorts before prefix + the max char
+        end = bisect.bisect_left(self.keys, prefix + unichr(0xffff), start)
+        if limit is not None:
+            end = min(end, start + limit)
+        return self.keys[start:end]
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+#
+# coalesce.py
+#
+# Hannah Aizenman, 2012-03
+#
+# http://www.opensource.org/licenses/bsd-license.php
+
+"""Coalesces identical concurrent requests (single-flight), so that a
+burst of requests for the same graph only renders it once.
+"""
+
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/2.7/library/sys.html
+import sys
+# http://docs.python.org/2.7/library/threading.html
+import threading
+
+from ccpweb import urltranslate
+
+class SingleFlight(object):
+    """Runs a function once per key for any number of concurrent callers.
+    The first caller for a key (the leader) does the work, callers that
+    arrive while the leader is still working wait on the same call and
+    share its result (or its exception). Nothing is cached once the
+    call finishes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = dict()
+        # requests: all calls to do
+        # leaders: calls that actually ran func
+        # coalesced: calls that shared a leader's result
+        self.counters = dict(requests=0, leaders=0, coalesced=0, errors=0)
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__, self.stats())
+
+    def do(self, key, func, *args, **kwargs):
+        """Returns func(*args, **kwargs), running it only if no other
+        call with the same key is in flight.
+        :Param key:
+            Hashable key identifying the work, see canonical_key
+        :Param func:
+            Function doing the work
+        """
+        with self._lock:
+            self.counters['requests'] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.counters['leaders'] += 1
+            else:
+                self.counters['coalesced'] += 1
+
+        if leader:
+            try:
+                call.result = func(*args, **kwargs)
+            except Exception:
+                call.error = sys.exc_info()
+                with self._lock:
+                    self.counters['errors'] += 1
+            finally:
+                # later requests start a new flight
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error:
+            raise call.error[0], call.error[1], call.error[2]
+        return call.result
+
+    def stats(self):
+        """Returns a copy of the counters and the number of
+        calls currently in flight.
+        """
+        with self._lock:
+            stats = dict(self.counters)
+            stats['inflight'] = len(self._calls)
+        return stats
+
+class _Call(object):
+    """A single in-flight call shared by the leader and its waiters.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+def canonical_key(data_name, view_name, url_args):
+    """Builds a key that is the same for every url that selects the same
+    data and graph, regardless of arg order or redundant fields
+    (e.g. 41T73L and 41T41B73L73R).
+    :Param data_name:
+        The dataset (conf_id) the request is for
+    :Param view_name:
+        The view serving the request (graph, data, etc.)
+    :Param url_args:
+        The url subpath
+    """
+    kwargs = urltranslate.get_kwargs_from_url(url_args)
+    return (data_name.lower(), view_name, freeze(kwargs))
+
+def freeze(obj):
+    """Recursively converts dicts and lists into sorted tuples
+    so that they can be compared and hashed.
+    """
+    if isinstance(obj, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in obj.items()))
+    if isinstance(obj, (list, tuple)):
+        return tuple(freeze(v) for v in obj)
+    return obj
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+#
+# datastream.py
+#
+# Hannah Aizenman, 2012-03
+#
+# http://www.opensource.org/licenses/bsd-license.php
+
+"""Streams selected data to the client as a .npy file or as raw
+little-endian values, straight from the array buffers.
+"""
+
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/2.7/library/re.html
+import re
+# http://docs.python.org/2.7/library/stringio.html
+import cStringIO
+
+# http://docs.scipy.org/doc/numpy-1.6.0/reference/
+import numpy as np
+# http://docs.scipy.org/doc/numpy/reference/generated/numpy.lib.format.html
+import numpy.lib.format
+
+# Size of the pieces handed to the server
+PIECE_BYTES = 2**20
+
+FORMATS = ['npy', 'raw']
+
+class DataStream(object):
+    """Byte stream of an array that is built a block of rows at a time.
+    :Param shape:
+        Shape of the array as the client should see it
+    :Param dtype:
+        Type of the values, sent little-endian
+    :Param nrows:
+        Number of rows (first dimension of the blocks) in the array
+    :Param read_rows:
+        function(rows) returning an iterator of array blocks for
+        the slice of rows, in order
+    :Param fmt:
+        'npy' (default) for a .npy file, 'raw' for just the values
+    """
+
+    def __init__(self, shape, dtype, nrows, read_rows, fmt='npy'):
+        if fmt not in FORMATS:
+            raise ValueError("unknown format: {}".format(fmt))
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        self.nrows = nrows
+        self.read_rows = read_rows
+        self.fmt = fmt
+        self.header = ''
+        if fmt == 'npy':
+            self.header = npy_header(self.shape, self.dtype)
+        self.nbytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.row_bytes = 0
+        if nrows:
+            self.row_bytes = self.nbytes // nrows
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__,self.__dict__)
+
+    def __len__(self):
+        return len(self.header) + self.nbytes
+
+    def iter_bytes(self, first=0, last=None):
+        """Yields the bytes first through last (inclusive), like a http
+        range. Only a piece (PIECE_BYTES) of the array data is copied 
+        at a time, as wsgi servers only accept strings.
+        """
+        if last is None:
+            last = len(self) - 1
+        hlen = len(self.header)
+        if first < hlen:
+            yield self.header[first:last+1]
+        if last < hlen or not self.row_bytes:
+            return
+
+        # offsets into the data, after the header
+        start = max(first - hlen, 0)
+        stop = last - hlen + 1
+        rows = slice(start // self.row_bytes,
+                     (stop - 1) // self.row_bytes + 1)
+        # bytes to trim off the first block
+        skip = start - rows.start * self.row_bytes
+        remaining = stop - start
+
+        for block in self.read_rows(rows):
+            block = np.ascontiguousarray(block, dtype=self.dtype)
+            buf = buffer(block)
+            offset = skip
+            skip = 0
+            while offset < len(buf) and remaining > 0:
+                size = min(PIECE_BYTES, len(buf) - offset, remaining)
+                yield buf[offset:offset+size]
+                offset += size
+                remaining -= size
+            if remaining <= 0:
+                break
+
+    def headers(self):
+        """Http headers describing the stream.
+        """
+        headers = [('Accept-Ranges', 'bytes'),
+                   ('X-Data-Dtype', self.dtype.str),
+                   ('X-Data-Shape', ",".join(str(n) for n in self.shape))]
+        return headers
+
+def from_array(arr, fmt='npy', fill_value=None):
+    """Returns a DataStream for an array that's already in memory
+    (e.g. the output of an algorithm)
+    :Param fill_value:
+        Value masked elements are sent as (default is the 
+        array's fill_value)
+    """
+    if isinstance(arr, np.ma.MaskedArray):
+        arr = arr.filled(fill_value)
+    arr = np.asarray(arr)
+    nrows = arr.shape[0] if arr.ndim else 1
+    def read_rows(rows):
+        yield arr.reshape(nrows, -1)[rows]
+    return DataStream(arr.shape, arr.dtype, nrows, read_rows, fmt)
+
+def from_selection(data_obj, data_kw, fmt='npy'):
+    """Returns a DataStream that reads the selection from
+    the file a chunk at a time (see CCPData.iter_chunks).
+    :Param data_obj:
+        CCPData object
+    :Param data_kw:
+        Selection kwargs (coords, time_range, data_reshape)
+    """
+    coords = data_kw.get('coords', dict())
+    time_range = data_kw.get('time_range', dict())
+    read_shape = data_obj.selection_shape(coords=coords,
+                                          time_range=time_range)
+    shape = final_shape(read_shape, data_kw.get('data_reshape'))
+    def read_rows(rows):
+        for tslice, data in data_obj.iter_chunks(coords=coords,
+                                                 time_range=time_range,
+                                                 rows=rows):
+            yield data
+    return DataStream(shape, data_obj.unpacked_dtype(), read_shape[0],
+                      read_rows, fmt)
+
+def final_shape(read_shape, data_reshape=None):
+    """Returns the shape CCPData.get_data gives a selection:
+    squeezed and then reshaped. The values are in the
+    same (C) order either way.
+    """
+    shape = tuple(n for n in read_shape if n != 1)
+    if data_reshape:
+        if data_reshape == ('time', 'latlon'):
+            data_reshape = (shape[0], -1)
+        size = int(np.prod(shape))
+        known = int(np.prod([n for n in data_reshape if n != -1]))
+        shape = tuple(size // known if n == -1 else n 
+                      for n in data_reshape)
+    if not shape:
+        shape = (1,)
+    return shape
+
+def npy_header(shape, dtype):
+    """Returns the .npy (version 1.0) header for an array.
+    """
+    buf = cStringIO.StringIO()
+    header = dict(descr=numpy.lib.format.dtype_to_descr(dtype),
+                  fortran_order=False, shape=shape)
+    numpy.lib.format.write_array_header_1_0(buf, header)
+    header = buf.getvalue()
+    # older versions of numpy leave the magic string to the caller
+    if not header.startswith(numpy.lib.format.MAGIC_PREFIX):
+        header = numpy.lib.format.magic(1, 0) + header
+    return header
+
+def parse_range(range_header, length):
+    """Parses a http Range header of the form bytes=first-last.
+    Only single ranges are supported.
+    :Return:
+        (first, last) or None if the header is missing or
+        isn't a single satisfiable byte range
+    """
+    if not range_header:
+        return None
+    found = re.match(r'^bytes=(\d*)-(\d*)$', range_header.strip())
+    if not found or not any(found.groups()):
+        return None
+    first, last = found.groups()
+    if not first:
+        # suffix range: the last n bytes
+        first = max(length - int(last), 0)
+        last = length - 1
+    else:
+        first = int(first)
+        last = int(last) if last else length - 1
+    last = min(last, length - 1)
+    if first > last:
+        return None
+    return (first, last)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+#
+# metacache.py
+#
+# Hannah Aizenman, 2012-03
+#
+# http://www.opensource.org/licenses/bsd-license.php
+
+"""Caches the metadata documents (menu, grid, time, etc.) of each
+dataset, pre-gzipped and with an ETag, and other objects derived from 
+the metadata, so that they're built once per version of the dataset 
+instead of on every request.
+"""
+
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/2.7/library/os.html
+import os
+# http://docs.python.org/2.7/library/glob.html
+import glob
+# http://docs.python.org/2.7/library/gzip.html
+import gzip
+# http://docs.python.org/2.7/library/hashlib.html
+import hashlib
+# http://docs.python.org/2.7/library/threading.html
+import threading
+# http://docs.python.org/2.7/library/stringio.html
+import cStringIO
+
+# http://docs.pylonsproject.org/projects/pyramid/1.0/api/response.html
+from pyramid.response import Response
+
+class Payload(object):
+    """A document stored both plain and gzipped.
+    :Param body:
+        The document as a string
+    :Param content_type:
+        Mime type of the document
+    """
+    def __init__(self, body, content_type):
+        self.body = body
+        self.content_type = content_type
+        self.gzipped = gzip_string(body)
+        self.etag = hashlib.sha1(body).hexdigest()
+        # a strong validator differs between content-codings
+        self.gzip_etag = self.etag + '-gzip'
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__,
+                                       dict(etag=self.etag,
+                                            content_type=self.content_type,
+                                            size=len(self.body)))
+
+    def response(self, request):
+        """Returns a 304 if the client has this version, the gzipped
+        body if the client accepts gzip, and the plain body otherwise.
+        """
+        response = Response(content_type=self.content_type)
+        response.vary = ('Accept-Encoding',)
+        # without the header webob treats every encoding as acceptable
+        gzipped = 'gzip' in request.headers.get('Accept-Encoding', '')
+        response.etag = self.gzip_etag if gzipped else self.etag
+        if (self.etag in request.if_none_match or 
+            self.gzip_etag in request.if_none_match):
+            response.status = 304
+            return response
+        if gzipped:
+            response.body = self.gzipped
+            response.content_encoding = 'gzip'
+        else:
+            response.body = self.body
+        return response
+
+class MetaCache(object):
+    """Objects (payloads, indexes) built from a dataset, keyed by dataset 
+    and name, rebuilt whenever the version of the dataset changes 
+    (see dataset_version).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.entries = dict()
+
+    def get(self, data_obj, name, build, version=''):
+        """Returns the cached object for the dataset, building it 
+        if the dataset changed since it was cached.
+        :Param data_obj:
+            CCPData object
+        :Param name:
+            Name of the object (e.g. 'grid')
+        :Param build:
+            function(data_obj, name) returning the object 
+            (see payload for documents)
+        :Param version:
+            Version of anything else the object is built from
+            (e.g. the config files)
+        """
+        version = version + dataset_version(data_obj)
+        key = (dataset_key(data_obj), name)
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != version:
+            entry = (version, build(data_obj, name))
+            with self._lock:
+                self.entries[key] = entry
+        return entry[1]
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+def payload(build):
+    """Wraps a function(data_obj, name) returning (body, content_type)
+    so that it returns a Payload, for use with MetaCache.get 
+    """
+    def build_payload(data_obj, name):
+        body, content_type = build(data_obj, name)
+        return Payload(body, content_type)
+    return build_payload
+
+def dataset_key(data_obj):
+    """Identifies the dataset independent of the url used to get to it
+    """
+    return (repr(data_obj.file_path), data_obj.data_key)
+
+def dataset_version(data_obj):
+    """Returns a hash of the size and modification time of the file(s)
+    the dataset is read from, which changes whenever the data does.
+    """
+    file_path = data_obj.file_path
+    if isinstance(file_path, basestring):
+        file_path = sorted(glob.glob(file_path)) or [file_path]
+    version = hashlib.sha1(repr(dataset_key(data_obj)))
+    for path in file_path:
+        try:
+            stat = os.stat(path)
+            version.update("{}:{}:{}".format(path, stat.st_size,
+                                             stat.st_mtime))
+        except OSError, e:
+            version.update(path)
+    return version.hexdigest()
+
+def gzip_string(body):
+    """Gzips a string, with a fixed timestamp so that
+    the output only depends on the input
+    """
+    buf = cStringIO.StringIO()
+    gzfile = gzip.GzipFile(fileobj=buf, mode='wb', mtime=0)
+    gzfile.write(body)
+    gzfile.close()
+    return buf.getvalue()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+#
+# registry.py
+#
+# Hannah Aizenman, 2012-03
+#
+# http://www.opensource.org/licenses/bsd-license.php
+
+"""Keeps the CCPData object of each configured dataset around between 
+requests, instead of re-reading the configs and the netcdf header 
+every time a url goes through Root.__getitem__.
+"""
+
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/2.7/library/threading.html
+import threading
+
+from ccpweb import tasks, metacache
+
+class DatasetRegistry(object):
+    """CCPData objects by dataset name, rebuilt when the configs or 
+    the data files change.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.datasets = dict()
+        
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__, self.datasets.keys())
+        
+    def get(self, data_name):
+        """Returns the CCPData object for data_name, 
+        or None if there's no config for it.
+        """
+        key = data_name.lower()
+        entry = self.datasets.get(key)
+        if entry is not None and entry[0] == self.version(entry[1]):
+            return entry[1]
+        
+        data_obj = tasks.create_data_obj(data_name)
+        if data_obj is not None:
+            data_obj.conf_id = data_name
+            with self._lock:
+                self.datasets[key] = (self.version(data_obj), data_obj)
+        return data_obj
+    
+    def names(self):
+        """Returns the names of the configured datasets
+        """
+        return tasks.get_configs(" ")['names']
+    
+    def version(self, data_obj):
+        """Version of a dataset: changes with its files and the configs
+        """
+        return tasks.config_version() + metacache.dataset_version(data_obj)
+    
+    def clear(self):
+        with self._lock:
+            self.datasets.clear()
+
+# shared by all the requests in a process
+DATASETS = DatasetRegistry()
@@ -27,7 +27,7 @@ from pyramid.view import view_config
 from pyramid.exceptions import NotFound
 
 from ccplib.datahandlers.ccpdata import CCPData
-import tasks
+from ccpweb.registry import DATASETS
 
 class Root(object):
     """Base node in the web site 
@@ -46,11 +46,19 @@ class Root(object):
             return DataList()
         if key == 'alglist':
             return AlgList()
-        # tries to create a data object based 
+        # server counters (coalescing, etc)
+        if key == '_stats':
+            return Stats()
+        # 200 once the process is warm (see warmup)
+        if key == '_ready':
+            return Ready()
+        # everything the page needs on load
+        if key == 'bootstrap':
+            return Bootstrap()
+        # tries to get the data object based 
         # on the key (url subpath) passed in
-        data_obj = tasks.create_data_obj(key)
+        data_obj = DATASETS.get(key)
         if data_obj:
-            data_obj.conf_id = key
             # http://docs.pylonsproject.org/projects/pyramid/1.0/narr/resources.html#location-aware
             data_obj.__name__ = ''
             # returns CCPData Object 
@@ -72,4 +80,16 @@ class AlgList(object):
     
 class Static(object):        
     def __getitem__(self, key):
-        pass
\ No newline at end of file
+        pass
+
+class Stats(object):
+    def __getitem__(self, key):
+        pass
+
+class Bootstrap(object):
+    def __getitem__(self, key):
+        pass
+
+class Ready(object):
+    def __getitem__(self, key):
+        pass
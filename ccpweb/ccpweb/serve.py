@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+#
+# serve.py
+#
+# Hannah Aizenman, 2012-03
+#
+# http://www.opensource.org/licenses/bsd-license.php
+
+"""Pre-fork server for production: the master process loads and warms
+the app (ccpweb.warmup, see warmup.py), then forks workers that each
+serve one request at a time on the shared listening socket, so the
+matplotlib work of different requests runs in different processes
+(and GILs) and the warmed datasets are shared copy-on-write.
+
+- a worker exits after max_requests requests or once it uses more
+  than max_rss_mb of memory, and the master forks a fresh one
+- when the ini file or the dataset configs change (or on SIGHUP), the
+  master reloads and warms the app, forks new workers and lets the old
+  ones finish their requests before they exit
+- SIGTERM/SIGINT stop the workers gracefully and then the master
+
+Use it from the ini file (see production.ini)::
+
+    [server:main]
+    use = egg:ccpweb#prefork
+
+or without installing ccpweb, from the ccpweb folder::
+
+    python -m ccpweb.serve production.ini
+"""
+
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/2.7/library/os.html
+import os
+# http://docs.python.org/2.7/library/sys.html
+import sys
+# http://docs.python.org/2.7/library/errno.html
+import errno
+# http://docs.python.org/2.7/library/time.html
+import time
+# http://docs.python.org/2.7/library/signal.html
+import signal
+# http://docs.python.org/2.7/library/socket.html
+import socket
+# http://docs.python.org/2.7/library/random.html
+import random
+# http://docs.python.org/2.7/library/logging.html
+import logging
+# http://docs.python.org/2.7/library/resource.html
+import resource
+# http://docs.python.org/2.7/library/configparser.html
+import ConfigParser
+# http://docs.python.org/2.7/library/wsgiref.html
+from wsgiref import simple_server
+
+log = logging.getLogger(__name__)
+
+class Arbiter(object):
+    """Forks the workers and keeps the right number of them running.
+    :Param load_app:
+        Function that returns the (warmed) wsgi app, called before the
+        first fork and on every reload
+    :Param host:
+        Address to listen on
+    :Param port:
+        Port to listen on, 0 for any free port (see address)
+    :Param workers:
+        Number of worker processes
+    :Param max_requests:
+        Requests a worker serves before it's replaced, 0 for no limit
+    :Param max_requests_jitter:
+        Up to this many requests are added to each worker's
+        max_requests, so that the workers aren't all replaced at once
+    :Param max_rss_mb:
+        Memory (resident set size) above which a worker is replaced
+        after its current request, 0 for no limit
+    :Param watch:
+        Function that returns something that changes when the app
+        should be reloaded (e.g. config_version), None to only reload
+        on SIGHUP
+    :Param check_interval:
+        Seconds between checks of the workers and of watch
+    :Param graceful_timeout:
+        Seconds the workers get to finish their requests when stopping
+        before they're killed
+    """
+    def __init__(self, load_app, host='0.0.0.0', port=6543, workers=2,
+                 max_requests=0, max_requests_jitter=0, max_rss_mb=0,
+                 watch=None, check_interval=1.0, graceful_timeout=30.0):
+        self.load_app = load_app
+        self.host = host
+        self.port = port
+        self.num_workers = workers
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.max_rss = max_rss_mb * 2**20
+        self.watch = watch
+        self.check_interval = check_interval
+        self.graceful_timeout = graceful_timeout
+        self.sock = None
+        self.app = None
+        self.version = None
+        # generation of each worker by pid, reloads start a new one
+        self.workers = dict()
+        self.generation = 0
+        self.signals = []
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__, self.address)
+
+    @property
+    def address(self):
+        return self.sock.getsockname() if self.sock else (self.host,
+                                                          self.port)
+
+    def listen(self):
+        """Opens the socket the workers share
+        """
+        if self.sock is None:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.sock.bind((self.host, self.port))
+            self.sock.listen(128)
+            # workers that lose the race for a connection go back to
+            # waiting instead of blocking in accept
+            self.sock.setblocking(0)
+        return self.sock
+
+    def run(self):
+        """Loads the app, forks the workers and looks after them until
+        SIGTERM or SIGINT
+        """
+        self.listen()
+        self.app = self.load_app()
+        self.version = self.watch() if self.watch else None
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(sig, lambda sig, frame: self.signals.append(sig))
+        log.info("listening on %s:%s, %s workers", self.address[0],
+                 self.address[1], self.num_workers)
+        self.spawn_workers()
+        while True:
+            sig = self.signals.pop(0) if self.signals else None
+            if sig in (signal.SIGTERM, signal.SIGINT):
+                break
+            if sig == signal.SIGHUP or self.changed():
+                self.reload()
+            self.reap()
+            self.spawn_workers()
+            if not self.signals:
+                # signals cut the sleep short
+                time.sleep(self.check_interval)
+        self.stop()
+
+    def changed(self):
+        if self.watch is None:
+            return False
+        try:
+            version = self.watch()
+        except Exception, e:
+            log.warning("can't check for changes: %r", e)
+            return False
+        if version == self.version:
+            return False
+        self.version = version
+        return True
+
+    def reload(self):
+        """Loads the app again, replaces the workers with ones running
+        the new app and stops the old ones once their request is done.
+        The old app keeps being served if the new one fails to load.
+        """
+        log.info("reloading")
+        try:
+            app = self.load_app()
+        except Exception, e:
+            log.exception("reload failed, still serving the old app")
+            return
+        self.app = app
+        self.generation += 1
+        old = [pid for pid, gen in self.workers.items()
+               if gen < self.generation]
+        self.spawn_workers()
+        self.kill(old, signal.SIGTERM)
+
+    def spawn_workers(self):
+        current = sum(1 for gen in self.workers.itervalues()
+                      if gen == self.generation)
+        for i in range(self.num_workers - current):
+            self.spawn()
+
+    def spawn(self):
+        max_requests = self.max_requests
+        if max_requests and self.max_requests_jitter:
+            max_requests += random.randint(0, self.max_requests_jitter)
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = self.generation
+            return pid
+        status = 0
+        try:
+            worker = Worker(self.sock, self.app, max_requests, self.max_rss)
+            worker.run()
+        except Exception, e:
+            log.exception("worker failed")
+            status = 1
+        finally:
+            os._exit(status)
+
+    def reap(self):
+        """Forgets the workers that exited
+        """
+        while True:
+            try:
+                (pid, status) = os.waitpid(-1, os.WNOHANG)
+            except OSError, e:
+                if e.errno == errno.ECHILD:
+                    return
+                raise
+            if not pid:
+                return
+            if self.workers.pop(pid, None) is not None and status:
+                log.warning("worker %s exited with %s", pid, status)
+
+    def kill(self, pids, sig):
+        for pid in pids:
+            try:
+                os.kill(pid, sig)
+            except OSError, e:
+                if e.errno != errno.ESRCH:
+                    raise
+                self.workers.pop(pid, None)
+
+    def stop(self):
+        """Stops the workers, killing the ones that don't finish
+        within graceful_timeout
+        """
+        self.kill(list(self.workers), signal.SIGTERM)
+        deadline = time.time() + self.graceful_timeout
+        while self.workers and time.time() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        self.kill(list(self.workers), signal.SIGKILL)
+        self.reap()
+        self.sock.close()
+        log.info("stopped")
+
+class Worker(object):
+    """Serves requests one at a time until it's asked to stop or it
+    reached max_requests or max_rss.
+    """
+    def __init__(self, sock, app, max_requests=0, max_rss=0):
+        self.server = WorkerServer(sock, app)
+        self.max_requests = max_requests
+        self.max_rss = max_rss
+        self.stopping = False
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__, self.server.requests)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        # the master decides what ctrl-c and SIGHUP do
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        while not self.stopping:
+            self.server.handle_request()
+            if self.max_requests and self.server.requests >= self.max_requests:
+                log.info("worker %s served %s requests", os.getpid(),
+                         self.server.requests)
+                break
+            if self.max_rss and rss_bytes() > self.max_rss:
+                log.info("worker %s is using %s MB", os.getpid(),
+                         rss_bytes() // 2**20)
+                break
+
+    def stop(self, sig, frame):
+        self.stopping = True
+
+class WorkerServer(simple_server.WSGIServer):
+    """wsgiref server on the socket shared with the other workers
+    """
+    # seconds handle_request waits, so that stop is noticed
+    timeout = 1.0
+
+    def __init__(self, sock, app):
+        simple_server.WSGIServer.__init__(self, sock.getsockname(),
+                                          RequestHandler,
+                                          bind_and_activate=False)
+        self.socket.close()
+        self.socket = sock
+        (host, port) = sock.getsockname()[:2]
+        self.server_name = socket.getfqdn(host)
+        self.server_port = port
+        self.setup_environ()
+        self.set_app(app)
+        self.requests = 0
+
+    def get_request(self):
+        (request, client_address) = simple_server.WSGIServer.get_request(
+                                                                    self)
+        # the listening socket doesn't block, and on BSD and os x
+        # the accepted ones inherit that
+        request.setblocking(1)
+        return request, client_address
+
+    def process_request(self, request, client_address):
+        self.requests += 1
+        simple_server.WSGIServer.process_request(self, request,
+                                                 client_address)
+
+class RequestHandler(simple_server.WSGIRequestHandler):
+    """Logs the requests with logging instead of to stderr
+    """
+    def log_message(self, format, *args):
+        # on every request, so nothing is formatted unless it's logged
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("%s " + format, self.client_address[0], *args)
+
+def rss_bytes():
+    """Resident set size of this process
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * resource.getpagesize()
+    except (IOError, IndexError, ValueError), e:
+        # the peak, in kilobytes on linux and bytes on os x
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak * 1024 if sys.platform.startswith('linux') else peak
+
+def config_watcher(ini_path):
+    """Returns a function whose result changes with the ini file
+    and the dataset configs
+    """
+    from ccpweb import tasks
+    def version():
+        return (os.stat(ini_path).st_mtime, tasks.config_version())
+    return version
+
+def app_loader(ini_path, name='main'):
+    """Returns a function that loads the app in ini_path (which warms
+    it, see warmup)
+    """
+    from paste.deploy import loadapp
+    def load_app():
+        from ccpweb.registry import DATASETS
+        # datasets are opened again with the new configs
+        DATASETS.clear()
+        return loadapp('config:' + ini_path, name=name)
+    return load_app
+
+def asint(value, default=0):
+    return int(value) if value not in (None, '') else default
+
+def arbiter(load_app, ini_path=None, host='0.0.0.0', port=6543,
+            workers=2, max_requests=0, max_requests_jitter=0,
+            max_rss_mb=0, reload=True, check_interval=1.0,
+            graceful_timeout=30.0, **ignored):
+    """Arbiter from the (string) options of the [server:main] section
+    """
+    watch = None
+    if reload and str(reload).lower() not in ('false', 'off', 'no', '0') \
+       and ini_path:
+        watch = config_watcher(ini_path)
+    return Arbiter(load_app, host=host, port=asint(port),
+                   workers=asint(workers, 2),
+                   max_requests=asint(max_requests),
+                   max_requests_jitter=asint(max_requests_jitter),
+                   max_rss_mb=asint(max_rss_mb), watch=watch,
+                   check_interval=float(check_interval),
+                   graceful_timeout=float(graceful_timeout))
+
+def server_runner(wsgi_app, global_conf, **kwargs):
+    """Paste server runner (use = egg:ccpweb#prefork)
+    """
+    ini_path = global_conf.get('__file__')
+    load_app = app_loader(ini_path) if ini_path else lambda: wsgi_app
+    # the app paste loaded is the first generation
+    apps = [wsgi_app]
+    def first_then_reload():
+        return apps.pop() if apps else load_app()
+    arbiter(first_then_reload, ini_path, **kwargs).run()
+
+def main(argv=None):
+    """python -m ccpweb.serve production.ini"""
+    argv = argv or sys.argv[1:]
+    if not argv:
+        print("usage: python -m ccpweb.serve <ini file>")
+        return 2
+    ini_path = os.path.abspath(argv[0])
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s "
+                        "%(levelname)-5.5s [%(name)s][%(process)d] %(message)s")
+    config = ConfigParser.SafeConfigParser(dict(
+        here=os.path.dirname(ini_path), __file__=ini_path))
+    config.read(ini_path)
+    options = dict(config.items('server:main'))
+    for key in ('use', 'here', '__file__'):
+        options.pop(key, None)
+    arbiter(app_loader(ini_path), ini_path, **options).run()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
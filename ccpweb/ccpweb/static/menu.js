@@ -8,24 +8,42 @@
 
 $(document).ready(function(){
     hideMenu();  
-    loadDataList();
-    loadAlgList();
+    loadBootstrap("bootstrap");
 });
 
 // changes menus if dataset selection changes
 $("#dataList").change(function() { hideMenu(); 
-    loadDataOptions($("#dataList :selected").text()) 
+    loadBootstrap([$("#dataList :selected").text(), "bootstrap"].join("/"));
 });
 
 
 // helper function 'cause I couldn't find an auto version
 function fieldLabel(field) { return [field, "Label"].join(""); };
 
+// gets the lists and the dataset's menus in one request
+function loadBootstrap(bootURL){
+     $.getJSON(bootURL, function(data) {
+                  if ($("#dataList option").length == 0){
+                      fillDropDown("#dataList", data.datalist.names);
+                  };
+                  if ($("#algList option").length == 0){
+                      fillDropDown("#algList", data.alglist.names);
+                  };
+                  if (data.dataset){
+                      loadDataOptions(data.dataset, data);
+                  };
+                  })
+                  .error(function(data, status, xhr) { 
+                        alert("can't obtain dataset menus"); })
+                  .complete(function(data, status, xhr) {
+                        console.log("bootstrap obtained"); });
+};
+
 //creates menu
-function loadDataOptions(dataSet){
-    validRange(dataSet);    
+function loadDataOptions(dataSet, data){
+    validRange(data.validrange);    
     loadTime(dataSet);
-    loadGrid(dataSet);
+    loadGrid(data.grid);
     //uncomment to have a default graph of the most recent data
     //defaultGraph(dataSet);
 };
@@ -40,51 +58,25 @@ function hideMenu(){
     $("#loading").hide();
 };
 
-function loadDataList(){
-  // get list of datasets from server
-     $.getJSON("datalist", function(data) {
-                  fillDropDown("#dataList", data.names);
-                  loadDataOptions($("#dataList :selected").text());
-                  })
-                  .error(function(data, status, xhr) { 
-                        alert("can't obtain datalist"); })
-                  .complete(function(data, status, xhr) {
-                        console.log("dataList obtained"); });
-};        
-
-function loadAlgList(){
-  // get list of datasets from server
-     $.getJSON("alglist", function(data) {
-                fillDropDown("#algList", data.names);
-                  })
-                  .error(function(data, status, xhr) {
-                        alert("can't obtain alglist"); })
-                  .complete(function(data, status, xhr) {
-                   console.log("get alglist finished"); });
-};
-
-function validRange(dataSet){
-    validURL = [dataSet, "validrange"].join("/");
-    $.getJSON(validURL, function(data){
-        if (data.time){
-            var time_str = ["Time ranges from", data.time.start, 
-                            "to", data.time.end, "<br />"].join(" ") 
-            $("#validRange").append(time_str);
-        };
-        if (data.grid){    
-            var lat_str = ["Latitude ranges from", data.grid.bottom, 
-                           "to", data.grid.top, "in increments of", 
-                            data.grid.lat_inc, "degrees", "<br />"].join(" "); 
-
-            var lon_str = ["Longitude ranges from", data.grid.left, 
-                           "to", data.grid.right, "in increments of", 
-                            data.grid.lon_inc, "degrees", "<br />"].join(" "); 
+function validRange(data){
+    if (data.time){
+        var time_str = ["Time ranges from", data.time.start, 
+                        "to", data.time.end, "<br />"].join(" ") 
+        $("#validRange").append(time_str);
+    };
+    if (data.grid){    
+        var lat_str = ["Latitude ranges from", data.grid.bottom, 
+                       "to", data.grid.top, "in increments of", 
+                        data.grid.lat_inc, "degrees", "<br />"].join(" "); 
+
+        var lon_str = ["Longitude ranges from", data.grid.left, 
+                       "to", data.grid.right, "in increments of", 
+                        data.grid.lon_inc, "degrees", "<br />"].join(" "); 
  
-            $("#validRange").append(lat_str);
-            $("#validRange").append(lon_str);        
-        };
+        $("#validRange").append(lat_str);
+        $("#validRange").append(lon_str);        
+    };
     $("#validRange").show();
-    });
 };
 
 function defaultGraph(dataSet){
@@ -100,25 +92,41 @@ function defaultGraph(dataSet){
 
 
 function loadTime(dataSet){   
-    var timeURL = [dataSet, "time"].join("/");
+    // the server completes whatever has been typed (q=...)
+    var timeURL = [dataSet, "time", "complete"].join("/");
     $.each(["#startTime", "#endTime"], function(index, value){
             loadAutoComplete(value, timeURL, 12)
     });
 };
 
-function loadGrid(dataSet){
-    var gridURL = [dataSet, "grid"].join("/");
-     $.getJSON(gridURL, function(data){
-        var latStr = maxString(data.lat);
-        var lonStr = maxString(data.lon);
-        $.each(["#topLat", "#bottomLat"], function(index, value){
-                loadAutoComplete(value, data.lat, latStr);
-               });
-        $.each(["#leftLon", "#rightLon"], function(index, value){
-                loadAutoComplete(value, data.lon, lonStr);   
-               });
-        //add in menu for latlon here
-    });
+function loadGrid(data){
+    var lat = expandAxis(data.lat);
+    var lon = expandAxis(data.lon);
+    var latStr = maxString(lat);
+    var lonStr = maxString(lon);
+    $.each(["#topLat", "#bottomLat"], function(index, value){
+            loadAutoComplete(value, lat, latStr);
+           });
+    $.each(["#leftLon", "#rightLon"], function(index, value){
+            loadAutoComplete(value, lon, lonStr);   
+           });
+    //add in menu for latlon here
+};
+
+// evenly spaced axes are sent as {start, step, count} 
+// and everything else as a list of values
+function expandAxis(axis){
+    var values = [];
+    if ($.isArray(axis)){
+        values = axis;
+    }
+    else {
+        for (var i = 0; i<axis.count; ++i){
+            values.push(axis.start + i*axis.step);
+        };
+    };
+    return $.map(values, function(value){ 
+                    return parseFloat(value.toFixed(6)).toString(); });
 };
 
 function fillDropDown(menu, options) {
@@ -14,11 +14,15 @@ import re
 import os
 # http://docs.python.org/2.7/library/configparser.html
 import ConfigParser
+# http://docs.python.org/2.7/library/stringio.html
+import cStringIO
+# http://docs.python.org/2.7/library/json.html
+import json
+# http://docs.python.org/2.7/library/hashlib.html
+import hashlib
 
 # http://docs.scipy.org/doc/numpy-1.6.0/reference/
 import numpy as np
-# http://pypi.python.org/pypi/coards/0.2.2
-import coards
 # http://docs.pylonsproject.org/projects/pyramid/1.0/api/response.html 
 import pyramid.response 
 # http://docs.pylonsproject.org/projects/pyramid/1.0/api/exceptions.html
@@ -26,11 +30,41 @@ import pyramid.exceptions
 # http://docs.pylonsproject.org/projects/pyramid/1.0/api/url.html
 import pyramid.url
 
-from ccplib.datahandlers import unpack
-from ccplib.visualization import spatial, temporal, ccpgraph
+from ccplib.datahandlers import unpack, indices
+from ccplib.misc import timing
+# spatial and temporal (matplotlib, Basemap) are imported by set_graph,
+# so processes that only serve metadata never load them
+from ccplib.visualization import ccpgraph
 from ccplib.algorithms import algutils
-from ccpweb import urltranslate
+from ccpweb import urltranslate, datastream, autocomplete
 
+# time steps read ahead when a user steps through a dataset,
+# unless the config says otherwise (prefetch = n in [data])
+PREFETCH_STEPS = 3
+# type the data is unpacked to, half the memory of float64 and 
+# plenty of precision for graphs (unpack_dtype = ... in [data])
+UNPACK_DTYPE = 'float32'
+
+CONF_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), 
+                                         os.path.pardir, os.path.pardir, 
+                                         'configs'))
+
+def config_files():
+    """Returns the paths of all the .cfg files in CONF_PATH
+    """
+    return sorted(os.path.join(CONF_PATH, fl) for fl in os.listdir(CONF_PATH)
+                  if (os.path.splitext(fl)[-1] == '.cfg'))
+
+def config_version():
+    """Returns a hash of the names and modification times of
+    the config files, which changes whenever a config does.
+    """
+    version = hashlib.sha1()
+    for conf in config_files():
+        version.update("{}:{}".format(conf, os.stat(conf).st_mtime))
+    return version.hexdigest()
+
+@timing.timed('config')
 def get_configs(data_name, section=None):
     """
     Returns all the parameters in a given section
@@ -43,12 +77,8 @@ def get_configs(data_name, section=None):
         If a config doesn't exist: a list of datasets for which configs
         exist
     """
-    curdir = os.path.abspath(os.path.dirname(__file__))
-    CONF_PATH = os.path.abspath(os.path.join(curdir, os.path.pardir, os.path.pardir, 'configs'))
     data_list = []
-    conf_list = [os.path.join(CONF_PATH, fl) for fl in os.listdir(CONF_PATH)
-                 if (os.path.splitext(fl)[-1] == '.cfg')]
-    for conf in conf_list:
+    for conf in config_files():
         #unique config object per dataset 
         config = ConfigParser.SafeConfigParser(allow_no_value=True)
         with open(conf) as confile: 
@@ -83,9 +113,12 @@ def create_data_obj(data_name):
         in the config file and returns a ccpfig object. 
     """
     kwargs = get_configs(data_name, 'data')
-    if isinstance(kwargs, list):
+    # no config for data_name, just the list of names
+    if 'file_path' not in kwargs:
         raise pyramid.exceptions.NotFound()
     if kwargs:
+        kwargs.setdefault('prefetch', PREFETCH_STEPS)
+        kwargs.setdefault('unpack_dtype', UNPACK_DTYPE)
         unpack_func = unpack.get_unpack_func(kwargs['file_type'])
         return unpack_func(**kwargs)
     return None
@@ -96,19 +129,38 @@ def select_data(data_obj, url_args):
     """
     
     data_kw = urltranslate.get_kwargs_from_url(url_args)
-    data = data_obj.get_all_data(**data_kw)  
     
     # none is used as the default client side
     algkw = data_kw.get('algorithm', "none")
+    alg = algutils.dispatch().get(algkw) if algkw != "none" else None
+    alg_args = data_kw.get('alg_args', dict())
+    
+    # streaming algorithms read the selection a chunk at a time
+    if alg and algutils.streaming(alg):
+        with timing.span('alg'):
+            return alg(data_obj, coords=data_kw.get('coords'), 
+                       time_range=data_kw.get('time_range'), **alg_args)
     
-    if algkw != "none":
-        algmap = algutils.dispatch()
-        alg = algmap.get(algkw)
-        if alg:
-            data = alg(data_obj, data)
+    data = data_obj.get_all_data(**data_kw)  
+    if alg:
+        with timing.span('alg'):
+            data = alg(data_obj, data, **alg_args)
             
     return data
 
+def data_stream(data_obj, url_args, fmt='npy'):
+    """Returns a DataStream of the selection. Raw selections are read
+       from the file a chunk at a time, algorithm output is streamed 
+       from memory.
+    """
+    data_kw = urltranslate.get_kwargs_from_url(url_args)
+    algkw = data_kw.get('algorithm', "none")
+    if algkw in algutils.dispatch():
+        data = select_data(data_obj, url_args)
+        fill_value = getattr(data_obj, 'missing_value', None)
+        return datastream.from_array(data, fmt, fill_value)
+    return datastream.from_selection(data_obj, data_kw, fmt)
+
 def objattrs(context, request):
     """Lists attributes that aren't machine specific"""
     # add keys as needed
@@ -152,6 +204,8 @@ def valid_range(data_obj):
 def valid_time(time, units):
     """Returns the first and last times in the dataset
     """
+    # http://pypi.python.org/pypi/coards/0.2.2
+    import coards
     ti = ccpgraph.timestr_ind(units)
     start = coards.from_udunits(time[0], units).isoformat()[:ti]
     end = coards.from_udunits(time[-1], units).isoformat()[:ti]
@@ -207,35 +261,93 @@ def get_time(data_obj):
     if hasattr(data_obj, 'time'):
         units = data_obj.time_units
         ti = ccpgraph.timestr_ind(units)
-        time = [coards.from_udunits(t, units).isoformat()[:ti].lstrip('0')
-                for t in data_obj.time]
-        return time
+        isotime = indices.time_to_iso(data_obj.time, units).tolist()
+        return [t[:ti].lstrip('0') for t in isotime]
     return 
 
 def get_grid(data_obj):
     """Returns a dictionary containing either:
-           1) the lat and lon of the dataset as lists
+           1) the lat and lon of the dataset (see encode_axis)
            2) one list of lat and lon pairs    
     """
     
     grid = dict(gridded=data_obj.gridded)
     if hasattr(data_obj, 'lat') and hasattr(data_obj, 'lon'):
-        lonarr=data_obj.lon.tolist()
-        lonarr = [str(lon) for lon in lonarr]
-        latarr = data_obj.lat.tolist()       
-        latarr = [str(lat) for lat in latarr]
         if data_obj.gridded:
-            grid.update(dict(lat=latarr, lon=lonarr))
+            grid.update(dict(lat=encode_axis(data_obj.lat), 
+                             lon=encode_axis(data_obj.lon)))
         else:
-            grid.update(dict(latlon=zip(latarr, lonarr)))
+            grid.update(dict(latlon=zip(data_obj.lat.tolist(), 
+                                        data_obj.lon.tolist())))
     return grid
+
+def encode_axis(values):
+    """Compact encoding of an axis: 
+       {start, step, count} if the values are evenly spaced,
+       otherwise the list of values
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) > 1:
+        steps = np.diff(values)
+        if np.allclose(steps, steps[0], rtol=1e-5, atol=1e-6):
+            step = float(np.round(steps.mean(), 6))
+            return dict(start=float(np.round(values[0], 6)), step=step, 
+                        count=len(values))
+    return values.tolist()
+
+def get_menu(data_obj):
+    """Bundles time and grid, time is encoded like encode_axis 
+       but with isoformat start: {start, step, units, count}
+    """
+    dsmenu = dict(time=None)
+    if hasattr(data_obj, 'time'):
+        axis = encode_axis(data_obj.time)
+        if isinstance(axis, dict):
+            axis.update(start=get_time(data_obj)[0], 
+                        units=data_obj.time_units)
+        else:
+            axis = get_time(data_obj)
+        dsmenu['time'] = axis
+    dsmenu.update(get_grid(data_obj))
+    return dsmenu
+
+def metadata(data_obj, name):
+    """Returns (body, content_type) of one of the metadata documents:
+       menu, grid, validrange (json) or time (newline seperated)
+    """
+    if name == 'time':
+        time = get_time(data_obj) or []
+        return "\n".join(time), 'text/plain'
+    builders = dict(menu=get_menu, grid=get_grid, validrange=valid_range)
+    doc = builders[name](data_obj)
+    return json.dumps(doc, separators=(',', ':')), 'application/json'
     
+def bootstrap(data_obj, name=None):
+    """Returns (body, content_type) of a json document with 
+       everything the page needs when a dataset is loaded: 
+       datalist, alglist, menu, validrange and grid
+    """
+    doc = dict(datalist=get_configs(" "), alglist=alglist())
+    if data_obj is not None:
+        doc.update(dataset=data_obj.conf_id,
+                   menu=get_menu(data_obj), 
+                   validrange=valid_range(data_obj),
+                   grid=get_grid(data_obj))
+    return json.dumps(doc, separators=(',', ':')), 'application/json'
+
+def time_index(data_obj, name=None):
+    """Returns a prefix index of the isoformatted times, 
+       used for autocomplete
+    """
+    return autocomplete.PrefixIndex(get_time(data_obj) or [])
+
 def set_graph(data_obj, lenshape):
     """Tries to automatically figure out if the graph should be
        spatial or temporal
    
     """
     
+    from ccplib.visualization import spatial, temporal
     if lenshape == 2:
         graph_attrs = get_configs(data_obj.conf_id, 'spatial_graph')
         graph_obj = spatial.SpatialGraph(data_obj, **graph_attrs)
@@ -246,12 +358,77 @@ def set_graph(data_obj, lenshape):
         raise pyramid.exceptions.NotFound()
     return graph_obj
     
-def drawgraph(graph_obj, im, url_args):
-    """Generates the graph and writes it to the string buffer. 
+def graph_args(data_obj, url_args):
+    """Adds ALGregionmean to the url of a graph of a region over 
+       more than one time step without an algorithm, which is 
+       neither a map nor a series, so it's drawn as the series of
+       the region's mean.
+    """
+    data_kw = urltranslate.get_kwargs_from_url(url_args)
+    if data_kw.get('algorithm', "none") != "none":
+        return url_args
+    shape = data_obj.selection_shape(coords=data_kw.get('coords', dict()), 
+                                     time_range=data_kw.get('time_range', 
+                                                            dict()))
+    if shape[0] > 1 and np.prod(shape[1:]) > 1:
+        return list(url_args) + ['ALGregionmean']
+    return url_args
+    
+def render_graph(data_obj, url_args):
+    """Selects the data and draws the graph for the url,
+       returning the png as a string.
+    """
+    url_args = graph_args(data_obj, url_args)
+    image = select_data(data_obj, url_args)
+    graph_obj = set_graph(data_obj, image.ndim)
+    xaxis = x_axis(data_obj, url_args) if image.ndim == 1 else None
+    return drawgraph(graph_obj, image, url_args, xaxis)
+
+def x_axis(data_obj, url_args):
+    """Returns the kwargs (xdata, xlabel and xticklabels) of the 
+       x axis of the graph of an algorithm whose output isn't along 
+       time (e.g. a spectrum, or a series of yearly means), or None
+    """
+    data_kw = urltranslate.get_kwargs_from_url(url_args)
+    alg = algutils.dispatch().get(data_kw.get('algorithm', "none"))
+    xaxis = getattr(alg, 'xaxis', None)
+    if xaxis is None:
+        return None
+    return xaxis(data_obj, coords=data_kw.get('coords'), 
+                 time_range=data_kw.get('time_range'), 
+                 **data_kw.get('alg_args', dict()))
+
+def drawgraph(graph_obj, im, url_args, xaxis=None):
+    """Generates the graph and writes it to a string buffer,
+       returns the contents of the buffer (the png).
+       xaxis is the x axis of graphs not along time (see x_axis).
+    """
+    graph_kw = graph_kwargs(url_args, xaxis)
+       
+    # changes the figsize for a picture that's 
+    # going to have an error message
+    if hasattr(graph_obj, 'missing_value'): 
+        if np.equal(im, graph_obj.missing_value).all():
+            graph_obj.figsize = (5,5)
+            # could probably just do  
+            # graph_obj.ccpshow = graph_obj.nodata
+    
+    
+    fargs = dict(facecolor='w', edgecolor='k', linewidth=2)
+    # the png is returned as a string so that it can be 
+    # shared between coalesced requests
+    buf = cStringIO.StringIO()
+    graph_obj.ccpfig(im, buf, fargs, **graph_kw)
+    return buf.getvalue()
+
+def graph_kwargs(url_args, xaxis=None):
+    """Returns the kwargs of ccpfig for the url
     """
     
     # get kwargs for the graph:
     graph_kw = urltranslate.get_kwargs_from_url(url_args)
+    if xaxis is not None:
+        graph_kw.update(xaxis)
     
     # time_range almost always has to be in graph_kw
     # so this may be pointless
@@ -268,22 +445,4 @@ def drawgraph(graph_obj, im, url_args):
     alg = graph_kw.get('algorithm', "none")
     if alg != "none":
        graph_kw['labels'].update(alg_name=alg)
-       
-    # changes the figsize for a picture that's 
-    # going to have an error message
-    if hasattr(graph_obj, 'missing_value'): 
-        if np.equal(im, graph_obj.missing_value).all():
-            graph_obj.figsize = (5,5)
-            # could probably just do  
-            # graph_obj.ccpshow = graph_obj.nodata
-    
-    
-    fargs = dict(facecolor='w', edgecolor='k', linewidth=2)
-    # I think it turns the buffer into an httpResponse
-    response = pyramid.response.Response(content_type='image/png')
-    graph_obj.ccpfig(im, response, fargs, **graph_kw)
-    
-    return response
-    
-
-
+    return graph_kw
@@ -7,12 +7,24 @@
 
 __docformat__ = "restructuredtext"
 
+# http://docs.python.org/library/os.html
+import os
+# http://docs.python.org/library/sys.html
+import sys
 # http://docs.python.org/library/unittest.html
 import unittest
 
 # https://docs.pylonsproject.org/projects/pyramid/1.0/api/testing.html
 from pyramid import testing
 
+# the synthetic datasets are shared with the benchmarks and ccplib tests
+REPO_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), 
+                                         os.path.pardir, os.path.pardir))
+if REPO_PATH not in sys.path:
+    sys.path.append(REPO_PATH)
+
+from benchmarks import synthetic
+
 # Note: do more with this
 class ViewTests(unittest.TestCase):
     def setUp(self):
@@ -26,3 +38,536 @@ class ViewTests(unittest.TestCase):
         request = testing.DummyRequest()
         info = my_view(request)
         self.assertEqual(info['project'], 'ccpweb')
+
+class CoalesceTests(unittest.TestCase):
+    def test_single_flight(self):
+        import threading
+        from ccpweb.coalesce import SingleFlight
+        flights = SingleFlight()
+        release = threading.Event()
+        calls = []
+        def render():
+            calls.append(1)
+            release.wait()
+            return 'png'
+        results = []
+        def request():
+            results.append(flights.do('key', render))
+        threads = [threading.Thread(target=request) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        # waits until every request has joined the flight
+        while flights.stats()['requests'] < 5:
+            release.wait(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['png']*5)
+        stats = flights.stats()
+        self.assertEqual(stats['leaders'], 1)
+        self.assertEqual(stats['coalesced'], 4)
+        self.assertEqual(stats['inflight'], 0)
+
+    def test_single_flight_error(self):
+        from ccpweb.coalesce import SingleFlight
+        flights = SingleFlight()
+        def render():
+            raise ValueError("bad selection")
+        self.assertRaises(ValueError, flights.do, 'key', render)
+        self.assertEqual(flights.stats()['errors'], 1)
+        
+    def test_canonical_key(self):
+        from ccpweb.coalesce import canonical_key
+        key1 = canonical_key('gistemp', 'graph', 
+                             ['ALGmean', '41T73L', '1990ST2000ED'])
+        key2 = canonical_key('GISTEMP', 'graph', 
+                             ['1990ST2000ED', '41T41B73L73R', 'ALGmean'])
+        key3 = canonical_key('gistemp', 'graph', ['ALGstd', '41T73L'])
+        self.assertEqual(key1, key2)
+        self.assertNotEqual(key1, key3)
+
+class TimingTests(unittest.TestCase):
+    def test_server_timing(self):
+        from pyramid.request import Request
+        from pyramid.response import Response
+        from pyramid.events import NewRequest, NewResponse
+        from ccplib.misc import timing
+        from ccpweb.views import start_timing, add_server_timing
+        from ccpweb.urltranslate import get_kwargs_from_url
+        timing.HISTOGRAMS.clear()
+        request = Request.blank('/gistemp/graph')
+        request.view_name = 'graph'
+        start_timing(NewRequest(request))
+        get_kwargs_from_url(['1990-01'])
+        with timing.span('read'):
+            pass
+        response = Response()
+        add_server_timing(NewResponse(request, response))
+        names = [metric.split(';')[0] for metric in 
+                 response.headers['Server-Timing'].split(', ')]
+        self.assertEqual(names, ['url', 'read', 'total'])
+        stats = timing.HISTOGRAMS.stats()
+        self.assertEqual(stats['url']['count'], 1)
+        self.assertEqual(stats['total:graph']['count'], 1)
+        self.assertEqual(timing.current(), None)
+
+def synthetic_data(folder):
+    """Writes a small packed netcdf file and returns its CCPData object
+    """
+    import numpy as np
+    packed = np.arange(30*18*36).reshape(30, 18, 36) % 3000
+    file_path = synthetic.packed_grid(folder, packed, 
+                                      np.linspace(85, -85, 18), 
+                                      np.arange(5, 360, 10))
+    data_obj = synthetic.open_grid(file_path)
+    data_obj.conf_id = 'synthetic'
+    return data_obj
+
+class SyntheticCase(synthetic.SyntheticCase):
+    """Tests on the dataset of synthetic_data, as data_obj"""
+    def make_data(self):
+        self.data_obj = synthetic_data(self.folder)
+        return self.data_obj
+
+class DataStreamTests(SyntheticCase):
+    def setUp(self):
+        self.config = testing.setUp()
+        SyntheticCase.setUp(self)
+        
+    def tearDown(self):
+        testing.tearDown()
+        SyntheticCase.tearDown(self)
+        
+    def get_data(self, subpath, **kwargs):
+        from ccpweb.views import get_data
+        request = testing.DummyRequest(**kwargs)
+        request.subpath = subpath
+        response = get_data(self.data_obj, request)
+        body = ''.join(response.app_iter)
+        return response, body
+        
+    def test_npy(self):
+        import cStringIO
+        import numpy as np
+        subpath = ['40T40SB100L200R', '1880-03ST1881-02ED']
+        response, body = self.get_data(subpath)
+        data = np.load(cStringIO.StringIO(body))
+        kwargs = dict(coords=dict(top=40, bottom=-40, left=100, right=200),
+                      time_range=dict(start=[1880, 3], end=[1881, 2]))
+        np.testing.assert_array_equal(data, 
+                                      self.data_obj.get_all_data(**kwargs))
+        self.assertEqual(response.content_length, len(body))
+        
+    def test_raw_range(self):
+        import numpy as np
+        response, body = self.get_data([], params=dict(format='raw'), 
+                                       headers=dict(Range='bytes=800-1599'))
+        self.assertEqual(response.status_int, 206)
+        self.assertEqual(len(body), 800)
+        self.assertEqual(response.headers['X-Data-Shape'], '30,18,36')
+        dtype = np.dtype(response.headers['X-Data-Dtype'])
+        data = self.data_obj.get_all_data().astype(dtype)
+        self.assertEqual(body, data.tostring()[800:1600])
+
+    def test_parse_range(self):
+        from ccpweb.datastream import parse_range
+        self.assertEqual(parse_range('bytes=10-', 100), (10, 99))
+        self.assertEqual(parse_range('bytes=-10', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=0-500', 100), (0, 99))
+        self.assertEqual(parse_range('bytes=0-1,5-6', 100), None)
+        self.assertEqual(parse_range(None, 100), None)
+
+class AlgorithmTests(SyntheticCase):
+    def test_url_to_alg(self):
+        from ccpweb.urltranslate import get_kwargs_from_url
+        kwargs = get_kwargs_from_url(['ALGtrend:out=pvalue,per=3650'])
+        self.assertEqual(kwargs['algorithm'], 'trend')
+        self.assertEqual(kwargs['alg_args'], dict(out='pvalue', per=3650))
+        kwargs = get_kwargs_from_url(['ALGquantile:q=0.9,approximate=false'])
+        self.assertEqual(kwargs['alg_args'], dict(q=0.9, approximate=False))
+        self.assertFalse('alg_args' in get_kwargs_from_url(['ALGmean']))
+        
+    def test_trend(self):
+        import numpy as np
+        from ccpweb.tasks import select_data
+        slope = select_data(self.data_obj, ['ALGtrend:per=365.25', 
+                                            '40T40SB100L200R'])
+        data = self.data_obj.get_all_data(
+                    coords=dict(top=40, bottom=-40, left=100, right=200))
+        self.assertEqual(slope.shape, data.shape[1:])
+        expected = np.polyfit(self.data_obj.time, data[:, 0, 0], 1)[0]
+        self.assertAlmostEqual(slope[0, 0], expected * 365.25, 6)
+        
+    def test_anomaly(self):
+        import os
+        from ccplib.algorithms import anomaly
+        from ccpweb.tasks import select_data
+        saved = anomaly.CLIMATOLOGIES
+        anomaly.CLIMATOLOGIES = anomaly.ClimatologyCache(
+                                    os.path.join(self.folder, 'clim'))
+        try:
+            url_args = ['ALGanomaly:base=1880', '1881-01ST1881-06ED']
+            anom = select_data(self.data_obj, url_args)
+            again = select_data(self.data_obj, url_args)
+            self.assertEqual(anom.shape, (6, 18, 36))
+            self.assertEqual(anomaly.CLIMATOLOGIES.stats()['computes'], 1)
+        finally:
+            anomaly.CLIMATOLOGIES = saved
+            
+    def test_resample(self):
+        from ccpweb.tasks import select_data
+        jja = select_data(self.data_obj, 
+                          ['ALGresample:freq=seasonal,season=JJA'])
+        self.assertEqual(jja.shape, (2, 18, 36))
+        data = self.data_obj.get_all_data()
+        self.assertAlmostEqual(jja[1, 2, 3], data[17:20, 2, 3].mean(), 5)
+        
+    def test_resample_labels(self):
+        import cStringIO
+        from ccpweb.tasks import (select_data, set_graph, graph_kwargs, 
+                                  x_axis)
+        url_args = ['ALGresample', '1880-01ST1882-06ED', 
+                    '45NT45NB105EL105ER']
+        series = select_data(self.data_obj, url_args)
+        self.assertEqual(series.shape, (2,))
+        xaxis = x_axis(self.data_obj, url_args)
+        self.assertEqual(list(xaxis['xticklabels']), ['1880', '1881'])
+        graph_obj = set_graph(self.data_obj, series.ndim)
+        ax = graph_obj.ccpfig(series, cStringIO.StringIO(), dict(), 
+                              **graph_kwargs(url_args, xaxis))
+        self.assertEqual([label.get_text() 
+                          for label in ax.get_xticklabels()], 
+                         ['1880', '1881'])
+        self.assertEqual(ax.get_xlabel(), 'annual')
+        
+    def test_rolling_series(self):
+        from ccpweb.tasks import select_data, render_graph
+        url_args = ['ALGrolling:window=12,min_count=12', 
+                    '45NT45NB105EL105ER']
+        series = select_data(self.data_obj, url_args)
+        self.assertEqual(series.shape, (30,))
+        self.assertTrue(series.mask[4])
+        self.assertFalse(series.mask[5])
+        png = render_graph(self.data_obj, url_args)
+        self.assertEqual(png[:4], '\x89PNG')
+        
+    def test_quantile(self):
+        import numpy as np
+        from ccpweb.tasks import select_data
+        median = select_data(self.data_obj, ['ALGquantile:q=50'])
+        data = self.data_obj.get_all_data()
+        np.testing.assert_allclose(median, np.median(data, axis=0))
+
+    def test_correlation(self):
+        from ccpweb.tasks import select_data
+        r = select_data(self.data_obj, ['ALGcorrelation:lat=45N,lon=105E'])
+        self.assertEqual(r.shape, (18, 36))
+        i = abs(self.data_obj.lat - 45).argmin()
+        j = abs(self.data_obj.lon - 105).argmin()
+        self.assertAlmostEqual(r[i, j], 1.0, 6)
+
+    def test_eof(self):
+        from ccpweb.tasks import select_data, render_graph, x_axis
+        from ccplib.algorithms import eof
+        saved = eof.EOFS
+        eof.EOFS = eof.EOFCache()
+        try:
+            pattern = select_data(self.data_obj, ['ALGeof:mode=2'])
+            self.assertEqual(pattern.shape, (18, 36))
+            url_args = ['ALGeof:out=pc,mode=2']
+            pc = select_data(self.data_obj, url_args)
+            self.assertEqual(pc.shape, (30,))
+            self.assertAlmostEqual(pc.std(), 1.0, 6)
+            png = render_graph(self.data_obj, url_args)
+            self.assertEqual(png[:4], '\x89PNG')
+            self.assertEqual(eof.EOFS.stats()['computes'], 1)
+            url_args = ['ALGeof:out=variance,modes=4']
+            variance = select_data(self.data_obj, url_args)
+            xaxis = x_axis(self.data_obj, url_args)
+            self.assertEqual(list(xaxis['xdata']), [1, 2, 3, 4])
+            self.assertEqual(xaxis['xlabel'], 'mode')
+            self.assertEqual(variance.shape, xaxis['xdata'].shape)
+            png = render_graph(self.data_obj, url_args)
+            self.assertEqual(png[:4], '\x89PNG')
+        finally:
+            eof.EOFS = saved
+
+    def test_spectral(self):
+        from ccpweb.tasks import select_data, render_graph, x_axis
+        peak = select_data(self.data_obj, ['ALGspectral:low=2,high=10'])
+        self.assertEqual(peak.shape, (18, 36))
+        url_args = ['ALGspectral:out=spectrum', '45NT45NB105EL105ER']
+        power = select_data(self.data_obj, url_args)
+        freqs = x_axis(self.data_obj, url_args)['xdata']
+        self.assertEqual(power.shape, freqs.shape)
+        self.assertEqual(freqs[-1], 0.5)
+        png = render_graph(self.data_obj, url_args)
+        self.assertEqual(png[:4], '\x89PNG')
+        self.assertTrue(x_axis(self.data_obj, ['ALGspectral']) is None)
+
+    def test_extremes(self):
+        import numpy as np
+        from ccpweb.tasks import select_data
+        url_arg = 'ALGextremes:threshold=20'
+        count = select_data(self.data_obj, [url_arg])
+        self.assertEqual(count.shape, (18, 36))
+        data = self.data_obj.get_all_data()
+        np.testing.assert_array_equal(count, (data > 20).sum(axis=0))
+        # the first cell is 6.48 * t % 30, above 20 at the steps 
+        # 4, 8-9, 13, 17-18, 22-23 and 27
+        self.assertEqual(count[0, 0], 9)
+        longest = select_data(self.data_obj, [url_arg + ',out=longest'])
+        self.assertEqual(longest[0, 0], 2)
+        runs = select_data(self.data_obj, [url_arg + ',out=runs,min_run=2'])
+        self.assertEqual(runs[0, 0], 3)
+        below = select_data(self.data_obj, [url_arg + ',below=true'])
+        self.assertEqual(below[0, 0], 21)
+
+    def test_region_series(self):
+        import numpy as np
+        from ccpweb.tasks import select_data, render_graph, graph_args
+        region = '45NT15NB90EL150ER'
+        url_args = ['1880-01ST1881-12ED', region]
+        self.assertEqual(graph_args(self.data_obj, url_args)[-1], 
+                         'ALGregionmean')
+        # maps and series of a point are drawn as they are
+        for args in [['1880-01', region], 
+                     ['1880-01ST1881-12ED', '45NT45NB105EL105ER'],
+                     url_args + ['ALGmean']]:
+            self.assertEqual(graph_args(self.data_obj, args), args)
+        series = select_data(self.data_obj, url_args + ['ALGregionmean'])
+        self.assertEqual(series.shape, (24,))
+        box = select_data(self.data_obj, url_args)
+        # 45N to 15N
+        weights = np.cos(np.radians(self.data_obj.lat[4:8]))
+        expected = (box.mean(axis=2) * weights).sum(axis=1) / weights.sum()
+        np.testing.assert_allclose(series, expected, rtol=1e-5)
+        png = render_graph(self.data_obj, url_args)
+        self.assertEqual(png[:4], '\x89PNG')
+
+class MetadataTests(SyntheticCase):
+    def setUp(self):
+        self.config = testing.setUp()
+        SyntheticCase.setUp(self)
+        
+    def tearDown(self):
+        testing.tearDown()
+        SyntheticCase.tearDown(self)
+    
+    def test_encode_axis(self):
+        import numpy as np
+        from ccpweb.tasks import encode_axis
+        self.assertEqual(encode_axis(np.linspace(88.75, -88.75, 72)), 
+                         dict(start=88.75, step=-2.5, count=72))
+        self.assertEqual(encode_axis([0, 1, 3]), [0, 1, 3])
+        
+    def test_time(self):
+        from ccpweb.tasks import get_time
+        time = get_time(self.data_obj)
+        self.assertEqual(len(time), 30)
+        self.assertEqual(time[0], '1880-01-15')
+        
+    def test_cached_gzip(self):
+        import gzip
+        import json
+        import cStringIO
+        from ccpweb.views import get_grid, METADATA
+        from pyramid.request import Request
+        request = Request.blank('/', headers={'Accept-Encoding': 'gzip'})
+        response = get_grid(self.data_obj, request)
+        self.assertEqual(response.content_encoding, 'gzip')
+        body = gzip.GzipFile(fileobj=cStringIO.StringIO(response.body))
+        grid = json.loads(body.read())
+        self.assertEqual(grid['lon'], dict(start=5, step=10, count=36))
+        # same version of the dataset, same payload
+        payload = METADATA.get(self.data_obj, 'grid', None)
+        self.assertEqual(payload.gzipped, response.body)
+        self.assertEqual(payload.gzip_etag, response.etag)
+        plain = get_grid(self.data_obj, Request.blank('/'))
+        self.assertEqual(plain.body, payload.body)
+        self.assertEqual(plain.etag, payload.etag)
+        self.assertNotEqual(plain.etag, response.etag)
+        for etag in [payload.etag, payload.gzip_etag]:
+            request = Request.blank('/', 
+                                    headers={'If-None-Match': '"%s"' % etag})
+            self.assertEqual(get_grid(self.data_obj, request).status_int, 
+                             304)
+
+    def test_complete_time(self):
+        from ccpweb.views import get_time
+        request = testing.DummyRequest(params=dict(q='1881-0', limit='3'))
+        request.subpath = ('complete',)
+        response = get_time(self.data_obj, request)
+        self.assertEqual(response.body, "1881-01-15\n1881-02-15\n1881-03-15")
+        
+    def test_prefix_index(self):
+        from ccpweb.autocomplete import PrefixIndex
+        index = PrefixIndex(['1998-02', '1999-01', '1998-01', '1998-11'])
+        self.assertEqual(index.complete('1998-0'), ['1998-01', '1998-02'])
+        self.assertEqual(index.complete('1998', 2), ['1998-01', '1998-02'])
+        self.assertEqual(index.complete('2000'), [])
+
+    def test_bootstrap(self):
+        import json
+        from ccpweb.views import get_dsbootstrap
+        from pyramid.request import Request
+        response = get_dsbootstrap(self.data_obj, Request.blank('/'))
+        doc = json.loads(response.body)
+        for key in ['datalist', 'alglist', 'menu', 'validrange', 'grid']:
+            self.assertTrue(key in doc)
+        self.assertEqual(doc['dataset'], 'synthetic')
+        self.assertEqual(doc['grid']['lon'], dict(start=5, step=10, count=36))
+
+class WorkerServerTests(unittest.TestCase):
+    def test_blocking_request(self):
+        import socket
+        from ccpweb import serve
+        listening = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listening.bind(('127.0.0.1', 0))
+        listening.listen(1)
+        listening.setblocking(0)
+        client = socket.create_connection(listening.getsockname())
+        try:
+            server = serve.WorkerServer(listening, lambda e, s: [])
+            (request, address) = server.get_request()
+            # wsgiref reads the request as if it blocked
+            self.assertEqual(request.gettimeout(), None)
+            request.close()
+        finally:
+            client.close()
+            listening.close()
+
+    def test_rss_fallback(self):
+        import resource
+        from ccpweb import serve
+        def no_proc(*args):
+            raise IOError("no /proc")
+        serve.open = no_proc
+        try:
+            rss = serve.rss_bytes()
+        finally:
+            del serve.open
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on linux, bytes on os x
+        if sys.platform.startswith('linux'):
+            peak *= 1024
+        # not 1024 times off
+        self.assertTrue(peak // 2 <= rss <= 2 * peak)
+
+class ServeTests(unittest.TestCase):
+    """Runs the pre-fork server on a free port with an app 
+    that answers with its generation and process id
+    """
+    def setUp(self):
+        import os
+        from ccpweb import serve
+        loads = []
+        def load_app():
+            loads.append(1)
+            generation = str(len(loads))
+            def app(environ, start_response):
+                start_response('200 OK', [('Content-Type', 'text/plain')])
+                return ["{}:{}".format(generation, os.getpid())]
+            return app
+        self.arbiter = serve.Arbiter(load_app, host='127.0.0.1', port=0, 
+                                     workers=1, max_requests=2, 
+                                     check_interval=0.1, graceful_timeout=5)
+        self.arbiter.listen()
+        self.pid = os.fork()
+        if self.pid == 0:
+            try:
+                self.arbiter.run()
+            finally:
+                os._exit(0)
+        self.url = "http://127.0.0.1:{}/".format(self.arbiter.address[1])
+        
+    def tearDown(self):
+        import os, signal
+        os.kill(self.pid, signal.SIGTERM)
+        os.waitpid(self.pid, 0)
+        self.arbiter.sock.close()
+        
+    def get(self):
+        import urllib2
+        return urllib2.urlopen(self.url, timeout=10).read().split(':')
+        
+    def test_recycle(self):
+        pids = set(self.get()[1] for i in range(6))
+        # a new worker every 2 requests
+        self.assertEqual(len(pids), 3)
+        
+    def test_reload(self):
+        import os, time, signal
+        self.assertEqual(self.get()[0], '1')
+        os.kill(self.pid, signal.SIGHUP)
+        deadline = time.time() + 10
+        while self.get()[0] != '2':
+            self.assertTrue(time.time() < deadline)
+            time.sleep(0.1)
+
+class WarmupTests(unittest.TestCase):
+    """Warms an app serving the synthetic dataset"""
+    def setUp(self):
+        import os
+        import tempfile
+        from ccpweb import tasks
+        from ccpweb.registry import DATASETS
+        self.folder = tempfile.mkdtemp()
+        data_obj = synthetic_data(self.folder)
+        with open(os.path.join(self.folder, 'synthetic.cfg'), 'w') as cfg:
+            cfg.write("[data]\nname = synthetic\nfile_type = netcdf\n"
+                      "file_path = {}\n"
+                      "txtlog = False\nscrnlog = False\n"
+                      "create_folder = False\n\n[spatial_graph]\n"
+                      "projection = moll\nalt_projection = mill\n"
+                      "create_folder = False\n\n[temporal_graph]\n"
+                      "create_folder = False\n".format(data_obj.file_path))
+        self.conf_path = tasks.CONF_PATH
+        tasks.CONF_PATH = self.folder
+        DATASETS.clear()
+        
+    def tearDown(self):
+        import shutil
+        from ccpweb import tasks, warmup
+        from ccpweb.registry import DATASETS
+        tasks.CONF_PATH = self.conf_path
+        DATASETS.clear()
+        warmup.WARMUP.skip()
+        shutil.rmtree(self.folder)
+        
+    def test_warmup(self):
+        import json
+        import ccpweb
+        from webob import Request
+        from ccplib.visualization import spatial
+        from ccpweb.registry import DATASETS
+        spatial.BASEMAPS.clear()
+        app = ccpweb.main({}, **{'ccpweb.warmup': 'true'})
+        self.assertTrue('synthetic' in DATASETS.datasets)
+        # moll for the map and mill for subsets
+        self.assertEqual(spatial.BASEMAPS.stats()['basemaps'], 2)
+        response = Request.blank('/_ready').get_response(app)
+        self.assertEqual(response.status_int, 200)
+        report = json.loads(response.body)
+        self.assertEqual(report['errors'], [])
+        self.assertTrue(report['ready'])
+        
+    def test_not_ready(self):
+        from ccpweb import warmup
+        from ccpweb.views import get_ready
+        request = testing.DummyRequest()
+        warmup.WARMUP.state = 'warming'
+        self.assertFalse(get_ready(None, request)['ready'])
+        self.assertEqual(request.response.status_int, 503)
+
+class ImportTests(unittest.TestCase):
+    def test_views_are_light(self):
+        # metadata only workers never load matplotlib or Basemap
+        import os, sys, subprocess
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        script = ("import sys, ccpweb.views; print([m for m in "
+                  "['matplotlib', 'mpl_toolkits.basemap'] if m in sys.modules])")
+        out = subprocess.check_output([sys.executable, '-W', 'ignore', 
+                                       '-c', script], env=env)
+        self.assertEqual(out.strip().splitlines()[-1], '[]')
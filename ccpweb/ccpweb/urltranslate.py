@@ -11,6 +11,9 @@ __docformat__ = "restructuredtext"
 # http://docs.python.org/library/re.html 
 import re
 
+from ccplib.misc import timing
+
+@timing.timed('url')
 def get_kwargs_from_url(url_args):
     """
     Parses the url into its component kwargs.
@@ -28,7 +31,9 @@ def get_kwargs_from_url(url_args):
         if 'LABELS' in arg:
             kwargs['labels'] = url_to_labels(arg)
         elif 'ALG' in arg:
-            kwargs['algorithm'] = arg.strip('ALG')
+            kwargs['algorithm'], alg_args = url_to_alg(arg)
+            if alg_args:
+                kwargs['alg_args'] = alg_args
         elif (('T' and 'B' and 'L' and 'R') in arg) or (('T' and 'L') in arg):
             kwargs['coords'] = url_to_coords(arg)
         elif ('X' in arg) and ('Y' in arg):
@@ -74,6 +79,28 @@ def url_to_time(arg):
         time_range['end'] = int_dates[0]
     return time_range
 
+def url_to_alg(arg):
+    """Extracts the algorithm name and its parameters from a url arg
+    of the form:
+        ALGname or ALGname:key1=value1,key2=value2
+        numbers are converted to ints and floats, true and false
+        to booleans
+    """
+    name, _, params = arg[3:].partition(':')
+    alg_args = dict()
+    for param in params.split(','):
+        if not param:
+            continue
+        key, _, value = param.partition('=')
+        if value.lower() in ('true', 'false'):
+            value = value.lower() == 'true'
+        elif re.match("^[-+]?\d+$", value):
+            value = int(value)
+        elif re.match("^[-+]?(\d+\.\d*|\.\d+)([eE][-+]?\d+)?$", value):
+            value = float(value)
+        alg_args[str(key)] = value
+    return name, alg_args
+
 def url_to_coords(arg):
     """Extracts the coords kwargs dict from a url arg of the form:
         lat1NTlat2SBlon1WLlon2ER
@@ -13,6 +13,8 @@ __docformat__ = "restructuredtext"
 
 # http://docs.python.org/library/os.html
 import os
+# http://docs.python.org/library/sys.html
+import sys
 
 # https://docs.pylonsproject.org/projects/pyramid/1.0/api/response.html
 from pyramid.response import Response
@@ -20,13 +22,29 @@ from pyramid.response import Response
 from pyramid.view import view_config
 # http://docs.pylonsproject.org/projects/pyramid/1.0/api/exceptions.html
 from pyramid.exceptions import NotFound
+# http://docs.pylonsproject.org/projects/pyramid/1.0/api/events.html
+from pyramid.events import subscriber, NewRequest, NewResponse
 
 from ccplib.datahandlers.ccpdata import CCPData
-from ccpweb.resources import DataList, AlgList, Static
-from ccpweb import tasks
+from ccplib.datahandlers import slicecache
+from ccplib.algorithms import anomaly, eof
+from ccplib.misc import timing
+from ccpweb.resources import DataList, AlgList, Static, Stats, Bootstrap
+from ccpweb.resources import Ready
+from ccpweb.registry import DATASETS
+from ccpweb import tasks, coalesce, datastream, metacache, warmup
 
 SITE_LIB_ROOT = os.path.abspath(os.path.dirname(__file__))
 
+# identical concurrent graph requests share one render
+GRAPH_FLIGHTS = coalesce.SingleFlight()
+# gzipped menu, grid, time and validrange documents 
+# and the time autocomplete index per dataset
+METADATA = metacache.MetaCache()
+PAYLOAD = metacache.payload(tasks.metadata)
+BOOTSTRAP = metacache.payload(tasks.bootstrap)
+MAX_COMPLETIONS = 1000
+
 # ccpviz.html
 @view_config(context=Static, request_method='GET')
 def page_view(context, request):
@@ -48,52 +66,140 @@ def get_datalist(context, request):
 def get_alglist(context, request):
     return tasks.alglist()
 
+# datalist, alglist, and the menu, validrange and grid 
+# of the first dataset in one document
+@view_config(context=Bootstrap, request_method='GET')
+def get_bootstrap(context, request):
+    names = DATASETS.names()
+    data_obj = None
+    if names:
+        data_obj = DATASETS.get(names[0])
+    return bootstrap_response(data_obj, request)
+
+# same as above for a specific dataset
+@view_config(context=CCPData, name='bootstrap', request_method='GET')
+def get_dsbootstrap(context, request):
+    return bootstrap_response(context, request)
+
+def bootstrap_response(data_obj, request):
+    if data_obj is None:
+        body, content_type = tasks.bootstrap(None)
+        return metacache.Payload(body, content_type).response(request)
+    # datalist depends on the configs too
+    payload = METADATA.get(data_obj, 'bootstrap', BOOTSTRAP, 
+                           tasks.config_version())
+    return payload.response(request)
+
 # random metadata about the dataset 
 @view_config(context=CCPData, request_method='GET')
 def get_objattrs(context, request):
     return Response(tasks.objattrs(context, request))
 
 #bundles time and grid in one request/json object
-@view_config(context=CCPData, name='menu', request_method='GET', renderer='json')
+@view_config(context=CCPData, name='menu', request_method='GET')
 def get_dsmenu(context, request):
-    dsmenu = dict(time=tasks.get_time(context))
-    dsmenu.update(tasks.get_grid(context))
-    return dsmenu
+    return METADATA.get(context, 'menu', PAYLOAD).response(request)
 
 # Returns dictionary of valid ranges 
-@view_config(context=CCPData, name='validrange', request_method='GET', renderer='json')
+@view_config(context=CCPData, name='validrange', request_method='GET')
 def get_valid_range(context, request):
-   return tasks.valid_range(context)
+    return METADATA.get(context, 'validrange', PAYLOAD).response(request)
 
-# returns time as a long space seperated string so that
-# it's used to populate autocomplete
+# returns time as a long newline seperated string, 
+# time/complete?q=prefix&limit=n returns only the times 
+# starting with prefix so that it's used to populate autocomplete
 @view_config(context=CCPData, name='time', request_method='GET')
 def get_time(context, request):
-    time = tasks.get_time(context)
-    return Response("\n".join(time))
+    if 'complete' in request.subpath:
+        return complete_time(context, request)
+    return METADATA.get(context, 'time', PAYLOAD).response(request)
+
+def complete_time(context, request):
+    index = METADATA.get(context, 'time_index', tasks.time_index)
+    try:
+        limit = min(int(request.GET.get('limit', 20)), MAX_COMPLETIONS)
+    except ValueError, e:
+        limit = 20
+    times = index.complete(request.GET.get('q', ''), limit)
+    return Response(content_type='text/plain', body="\n".join(times))
     
 # bundles the lat and lon arrays/list into a json object
-@view_config(context=CCPData, name='grid', request_method='GET', renderer='json')
+@view_config(context=CCPData, name='grid', request_method='GET')
 def get_grid(context, request):
-    latlon = tasks.get_grid(context)
-    return latlon
+    return METADATA.get(context, 'grid', PAYLOAD).response(request)
     
-# returns the data/doesn't quite work as expected
+# streams the data as a .npy file (or ?format=raw for just the values), 
+# supports single http byte ranges
 @view_config(context=CCPData, name='data', request_method='GET')
 def get_data(context, request):  
-    image = tasks.select_data(context, request.subpath)
-    return Response(image)
+    fmt = request.GET.get('format', 'npy')
+    if fmt not in datastream.FORMATS:
+        return NotFound()
+    stream = tasks.data_stream(context, request.subpath, fmt)
+    length = len(stream)
+    response = Response(content_type='application/octet-stream')
+    response.headerlist.extend(stream.headers())
+    response.content_disposition = "attachment; filename={}.{}".format(
+                                                    context.conf_id, fmt)
+    byte_range = datastream.parse_range(request.headers.get('Range'), length)
+    if byte_range:
+        first, last = byte_range
+        response.status = 206
+        response.content_range = (first, last + 1, length)
+    else:
+        first, last = 0, length - 1
+    response.app_iter = stream.iter_bytes(first, last)
+    response.content_length = last - first + 1
+    return response
 
 # returns the graph as a response
 @view_config(context=CCPData, name='graph', request_method='GET')
 def make_graph(context, request):
-    image = tasks.select_data(context, request.subpath)
-    graph_obj = tasks.set_graph(context, image.ndim)
-    return tasks.drawgraph(graph_obj, image, request.subpath)             
+    key = coalesce.canonical_key(context.conf_id, 'graph', request.subpath)
+    image = GRAPH_FLIGHTS.do(key, tasks.render_graph, 
+                             context, request.subpath)
+    return Response(content_type='image/png', body=image)
+
+# server counters
+@view_config(context=Stats, request_method='GET', renderer='json')
+def get_stats(context, request):
+    stats = dict(graph=GRAPH_FLIGHTS.stats(), 
+                 timing=timing.HISTOGRAMS.stats(),
+                 slices=slicecache.SLICES.stats(), 
+                 prefetch=slicecache.PREFETCH.stats(),
+                 climatologies=anomaly.CLIMATOLOGIES.stats(),
+                 eofs=eof.EOFS.stats())
+    # only once a map has been drawn, importing spatial loads Basemap
+    spatial = sys.modules.get('ccplib.visualization.spatial')
+    if spatial is not None:
+        stats['basemaps'] = spatial.BASEMAPS.stats()
+    return stats
+
+# readiness for the load balancer: 503 until the warmup is done
+@view_config(context=Ready, request_method='GET', renderer='json')
+def get_ready(context, request):
+    if not warmup.WARMUP.ready():
+        request.response.status = 503
+    return warmup.WARMUP.report()
+
+# times every request: the spans (url, config, read, alg, draw, 
+# basemap, png) go in the Server-Timing header and the /_stats histograms
+@subscriber(NewRequest)
+def start_timing(event):
+    timing.start()
+
+@subscriber(NewResponse)
+def add_server_timing(event):
+    timer = timing.stop()
+    if timer is None:
+        return
+    event.response.headers['Server-Timing'] = timing.server_timing(timer)
+    view_name = getattr(event.request, 'view_name', '') or 'page'
+    timing.HISTOGRAMS.add("total:{}".format(view_name), timer.elapsed())
 
 # 404 page-should be replaced with something fun
 @view_config(context='pyramid.exceptions.NotFound')
-def notfound_view(self):
+def notfound_view(request):
     return Response('404: Page Not Found.')
                  
 # used to test stuff/part of the paster default
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+#
+# warmup.py
+#
+# Hannah Aizenman, 2012-03
+#
+# http://www.opensource.org/licenses/bsd-license.php
+
+"""Warms a new ccpweb process before it takes requests: opens the
+datasets, fills the metadata caches, builds the Basemaps of each
+dataset's projection and alt_projection and draws each dataset's
+default map and time series (which loads matplotlib, the fonts and
+the coastlines). host:/_ready answers 503 until it's done, so a load
+balancer checking it never sends requests to a cold process.
+
+Turned on in the ini file (see production.ini)::
+
+    ccpweb.warmup = true
+    # optional:
+    ccpweb.warmup_datasets = gistemp ccsm  (default all)
+    ccpweb.warmup_graphs = true
+    ccpweb.warmup_background = false
+"""
+
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/2.7/library/time.html
+import time
+# http://docs.python.org/2.7/library/logging.html
+import logging
+# http://docs.python.org/2.7/library/threading.html
+import threading
+
+# http://docs.pylonsproject.org/projects/pyramid/1.0/api/settings.html
+from pyramid.settings import asbool
+# http://docs.webob.org/en/latest/reference.html
+from webob import Request
+
+from ccpweb import tasks
+from ccpweb.registry import DATASETS
+
+log = logging.getLogger(__name__)
+
+class Warmup(object):
+    """Runs the warmup and keeps track of how it went.
+    state is cold, warming or ready.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.state = 'cold'
+        self.steps = []
+        self.errors = []
+        self.started = None
+        self.finished = None
+
+    def __repr__(self):
+        return "<{0!s}({1!r})>".format(self.__class__, self.state)
+
+    def ready(self):
+        return self.state == 'ready'
+
+    def skip(self):
+        """Ready without warming (warmup is off)
+        """
+        self.state = 'ready'
+
+    def run(self, app, names=None, graphs=True):
+        """Warms app for the datasets in names (default all).
+        A dataset that fails to warm is logged in errors and
+        doesn't stop the others or keep the process from being ready.
+        """
+        with self._lock:
+            self.state = 'warming'
+            self.steps = []
+            self.errors = []
+            self.started = time.time()
+            for url in ['/datalist', '/alglist', '/bootstrap']:
+                self.step(url, get, app, url)
+            if names is None:
+                names = self.step('names', DATASETS.names) or []
+            for name in names:
+                self.warm_dataset(app, name, graphs)
+            self.finished = time.time()
+            self.state = 'ready'
+        log.info("warm in %.1fs, %s errors", self.finished - self.started,
+                 len(self.errors))
+
+    def warm_dataset(self, app, name, graphs=True):
+        data_obj = self.step(name + '.open', DATASETS.get, name)
+        if data_obj is None:
+            return
+        for doc in ['bootstrap', 'menu', 'validrange', 'grid', 'time']:
+            url = '/{}/{}'.format(name, doc)
+            self.step(url, get, app, url)
+        if not data_obj.gridded:
+            return
+        self.step(name + '.basemaps', warm_basemaps, data_obj)
+        if graphs:
+            for url in default_graphs(name, data_obj):
+                self.step(url, get, app, url)
+
+    def step(self, name, func, *args):
+        """Calls func(*args), recording how long it took or the error
+        """
+        start = time.time()
+        try:
+            return func(*args)
+        except Exception, e:
+            log.warning("warmup %s failed: %r", name, e)
+            self.errors.append(dict(step=name, error=repr(e)))
+        finally:
+            self.steps.append(dict(step=name, ms=round(
+                                   (time.time() - start) * 1000.0, 1)))
+
+    def report(self):
+        report = dict(ready=self.ready(), state=self.state,
+                      errors=list(self.errors), steps=len(self.steps))
+        if self.finished:
+            report['seconds'] = round(self.finished - self.started, 3)
+        return report
+
+def get(app, url):
+    """Requests url from the app, raises an error unless it's a 200
+    """
+    response = Request.blank(url).get_response(app)
+    if response.status_int != 200:
+        raise ValueError("{} returned {}".format(url, response.status))
+    return response
+
+def warm_basemaps(data_obj):
+    """Builds the Basemaps of the dataset's projection and
+    alt_projection for the whole grid
+    """
+    graph_attrs = tasks.get_configs(data_obj.conf_id, 'spatial_graph')
+    if not graph_attrs.get('projection'):
+        return
+    from ccplib.visualization import spatial
+    spatial.SpatialGraph(data_obj, **graph_attrs).warm_basemaps()
+
+def default_graphs(name, data_obj):
+    """Urls of the map of the first time step and of the time series
+    at the middle of the grid, what users ask for first
+    """
+    times = tasks.valid_range(data_obj).get('time')
+    if not times:
+        return []
+    lat = float(data_obj.lat[len(data_obj.lat)//2])
+    lon = float(data_obj.lon[len(data_obj.lon)//2])
+    point = "{0}T{0}B{1}L{1}R".format(
+        "{:.2f}{}".format(abs(lat), 'N' if lat >= 0 else 'S'),
+        "{:.2f}{}".format(abs(lon), 'E' if lon >= 0 else 'W'))
+    return ['/{}/graph/{}'.format(name, times['start']),
+            '/{}/graph/{}ST{}ED/{}'.format(name, times['start'],
+                                           times['end'], point)]
+
+def start(app, settings):
+    """Warms app as configured in settings (ccpweb.warmup*), in the
+    background if ccpweb.warmup_background (for single process
+    servers, the pre-fork server needs it done before it forks)
+    """
+    if not asbool(settings.get('ccpweb.warmup', False)):
+        WARMUP.skip()
+        return WARMUP
+    names = settings.get('ccpweb.warmup_datasets')
+    names = names.split() if names else None
+    graphs = asbool(settings.get('ccpweb.warmup_graphs', True))
+    if asbool(settings.get('ccpweb.warmup_background', False)):
+        thread = threading.Thread(target=WARMUP.run,
+                                  args=(app, names, graphs))
+        thread.daemon = True
+        thread.start()
+    else:
+        WARMUP.run(app, names, graphs)
+    return WARMUP
+
+# state of this process
+WARMUP = Warmup()
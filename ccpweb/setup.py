@@ -31,6 +31,8 @@ setup(name='ccpweb',
       entry_points = """\
       [paste.app_factory]
       main = ccpweb:main
+      [paste.server_runner]
+      prefork = ccpweb.serve:server_runner
       """,
       paster_plugins=['pyramid'],
       )
@@ -0,0 +1,507 @@
+#!/usr/bin/env python
+#
+# test_algorithms.py
+#
+# Hannah Aizenman, 2012-03
+#
+# http://www.opensource.org/licenses/bsd-license.php
+
+"""Tests the algorithms against numpy and scipy on a small packed
+file written by the test
+"""
+
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/2.7/library/os.html
+import os
+# http://docs.python.org/2.7/library/sys.html
+import sys
+# http://docs.python.org/2.7/library/threading.html
+import threading
+# http://docs.python.org/2.7/library/unittest.html
+import unittest
+
+# http://docs.scipy.org/doc/numpy-1.6.0/user/
+import numpy as np
+
+# the synthetic datasets are shared with the benchmarks and ccpweb
+REPO_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), 
+                                         os.path.pardir))
+if REPO_PATH not in sys.path:
+    sys.path.append(REPO_PATH)
+
+from ccplib.algorithms import algutils, regression
+from benchmarks import synthetic
+
+class Trend(synthetic.SyntheticCase):
+    def test_dispatch(self):
+        alg = algutils.dispatch()['trend']
+        self.assertTrue(algutils.streaming(alg))
+        self.assertFalse(algutils.streaming(algutils.dispatch()['mean']))
+
+    def test_polyfit(self):
+        from scipy import stats
+        slope = regression.trend(self.obj, chunk_size=7)
+        intercept = regression.trend(self.obj, out='intercept')
+        pvalue = regression.trend(self.obj, out='pvalue', chunk_size=3)
+        self.assertTrue(slope.mask[0, 0])
+        time = self.obj.time
+        for (i, j) in [(0, 1), (3, 4), (5, 7)]:
+            valid = self.valid[:, i, j]
+            fit = stats.linregress(time[valid], self.data[valid, i, j])
+            self.assertAlmostEqual(slope[i, j], fit[0], 10)
+            self.assertAlmostEqual(intercept[i, j], fit[1], 6)
+            self.assertAlmostEqual(pvalue[i, j], fit[3], 8)
+
+    def test_count(self):
+        count = regression.trend(self.obj, out='count', chunk_size=5)
+        np.testing.assert_array_equal(count, self.valid.sum(axis=0))
+
+    def test_selection(self):
+        coords = dict(top=45, bottom=-45, left=60, right=200)
+        time_range = dict(start=[1880, 6], end=[1882, 1])
+        slope = regression.trend(self.obj, coords=coords,
+                                 time_range=time_range, per=3650)
+        data = self.obj.get_all_data(coords=coords, time_range=time_range)
+        self.assertEqual(slope.shape, data.shape[1:])
+
+class Anomaly(synthetic.SyntheticCase):
+    def setUp(self):
+        from ccplib.algorithms import anomaly
+        synthetic.SyntheticCase.setUp(self)
+        self.cache = anomaly.ClimatologyCache(os.path.join(self.folder, 
+                                                           'clim'))
+        self.saved = anomaly.CLIMATOLOGIES
+        anomaly.CLIMATOLOGIES = self.cache
+
+    def tearDown(self):
+        from ccplib.algorithms import anomaly
+        anomaly.CLIMATOLOGIES = self.saved
+        synthetic.SyntheticCase.tearDown(self)
+
+    def months(self):
+        import datetime
+        start = datetime.date(1880, 1, 1)
+        return np.array([(start + datetime.timedelta(days=t)).month - 1 
+                         for t in self.obj.time])
+    
+    def test_calendar_slots(self):
+        from ccplib.algorithms import anomaly
+        self.obj.time = np.array([58., 59., 60., 424., 425.])
+        days = anomaly.calendar_slots(self.obj, slice(None), 'daily')
+        # 1880 is a leap year, 1881 isn't
+        self.assertEqual(days.tolist(), [58, 59, 60, 58, 60])
+        months = anomaly.calendar_slots(self.obj, slice(None))
+        self.assertEqual(months.tolist(), [1, 1, 2, 1, 2])
+
+    def test_climatology(self):
+        from ccplib.algorithms import anomaly
+        data = self.data
+        months = self.months()
+        base = months[(self.obj.time < 730)]
+        clim = anomaly.Climatology.compute(self.obj, base=(1880, 1881), 
+                                           chunk_size=7)
+        for month in [0, 5, 11]:
+            expected = data[:len(base)][base == month].mean(axis=0)
+            np.testing.assert_allclose(clim.means[month, 3:], 
+                                       expected[3:], rtol=1e-5)
+            
+    def test_anomaly(self):
+        from ccplib.algorithms import anomaly
+        coords = dict(top=45, bottom=-45, left=60, right=200)
+        time_range = dict(start=[1881, 3], end=[1882, 6])
+        anom = anomaly.anomaly(self.obj, coords, time_range)
+        clim = anomaly.climatology(self.obj, coords, time_range)
+        data = self.obj.get_all_data(coords=coords, time_range=time_range)
+        self.assertEqual(anom.shape, data.shape)
+        valid = ~anom.mask
+        np.testing.assert_allclose(anom[valid] + clim[valid], 
+                                   data[valid], rtol=1e-5)
+        self.assertEqual(self.cache.stats()['computes'], 1)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        # another process loads the saved one
+        other = anomaly.ClimatologyCache(self.cache.path)
+        other.get(self.obj)
+        self.assertEqual(other.stats()['loads'], 1)
+
+    def test_single_flight(self):
+        from ccplib.algorithms import anomaly
+        release = threading.Event()
+        compute = anomaly.Climatology.compute
+        def gated(DataObj, period='monthly', base=None):
+            if period == 'monthly':
+                release.wait()
+            return compute(DataObj, period, base)
+        anomaly.Climatology.compute = staticmethod(gated)
+        try:
+            threads = [threading.Thread(target=self.cache.get, 
+                                        args=(self.obj,)) 
+                       for i in range(3)]
+            for thread in threads:
+                thread.start()
+            # another key isn't held up by the monthly one
+            daily = threading.Thread(target=self.cache.get, 
+                                     args=(self.obj, 'daily'))
+            daily.start()
+            daily.join(10)
+            self.assertFalse(daily.is_alive())
+            self.assertEqual(self.cache.stats()['computes'], 1)
+        finally:
+            release.set()
+            for thread in threads:
+                thread.join()
+            anomaly.Climatology.compute = compute
+        stats = self.cache.stats()
+        self.assertEqual(stats['computes'], 2)
+        self.assertEqual(stats['hits'], 2)
+
+class Resample(synthetic.SyntheticCase):
+    # monthly, January 1880 to April 1883
+
+    def resample(self, **kwargs):
+        from ccplib.algorithms import resample
+        return resample.resample(self.obj, chunk_size=5, **kwargs)
+
+    def test_annual(self):
+        annual = self.resample()
+        # 1883 is partial
+        self.assertEqual(annual.shape, (3, 6, 8))
+        np.testing.assert_allclose(annual[1], self.data[12:24].mean(axis=0),
+                                   rtol=1e-6)
+        self.assertEqual(self.resample(partial=True).shape, (4, 6, 8))
+
+    def test_seasonal(self):
+        djf = self.resample(freq='seasonal', season='DJF')
+        # the winter of 1880 has no December 1879
+        self.assertEqual(djf.shape, (3, 6, 8))
+        np.testing.assert_allclose(djf[0], self.data[11:14].mean(axis=0),
+                                   rtol=1e-6)
+        # the partial winter is dropped, spring comes first
+        seasons = self.resample(freq='seasonal')
+        np.testing.assert_allclose(seasons[0], self.data[2:5].mean(axis=0),
+                                   rtol=1e-6)
+
+    def test_custom(self):
+        winter = self.resample(freq='months', months='11-3', how='max')
+        np.testing.assert_allclose(winter[0], self.data[10:15].max(axis=0),
+                                   rtol=1e-6)
+
+    def test_missing(self):
+        annual = self.resample(min_count=12)
+        self.assertTrue(annual.mask[0, 0, 0])
+        complete = ~self.data[12:24].mask.any(axis=0)
+        np.testing.assert_array_equal(~annual.mask[1], complete)
+
+class Rolling(synthetic.SyntheticCase):
+    def windows(self, series, window, func):
+        # the O(n*w) way
+        (before, after) = (window - 1) // 2, window // 2
+        return [func(series[max(i - before, 0):i + after + 1])
+                for i in range(len(series))]
+
+    def test_moving(self):
+        from ccplib.algorithms import rolling
+        series = np.random.RandomState(1).normal(1000, 1, 50)
+        series[[3, 20, 21]] = np.nan
+        for how, func in [('mean', np.nanmean), ('sum', np.nansum), 
+                          ('std', np.nanstd)]:
+            result = rolling.moving(series, 7, how, min_count=1)
+            np.testing.assert_allclose(result, 
+                                       self.windows(series, 7, func), 
+                                       rtol=1e-9)
+        self.assertTrue(rolling.moving(series, 7).mask[0])
+        
+    def test_rolling(self):
+        from ccplib.algorithms import rolling
+        result = rolling.rolling(self.obj, window=6, how='std', 
+                                 min_count=1, chunk_size=8)
+        self.assertEqual(result.shape, self.data.shape)
+        for (i, j) in [(0, 1), (4, 4)]:
+            series = self.data[:, i, j]
+            expected = self.windows(series, 6, np.ma.std)
+            np.testing.assert_allclose(result[:, i, j], expected, 
+                                       rtol=1e-6)
+
+    def test_read_once(self):
+        from ccplib.algorithms import rolling
+        reads = []
+        iter_chunks = self.obj.iter_chunks
+        def counted(*args, **kwargs):
+            for tslice, data in iter_chunks(*args, **kwargs):
+                reads.append(len(data))
+                yield tslice, data
+        self.obj.iter_chunks = counted
+        # a window longer than the chunks
+        result = rolling.rolling(self.obj, window=15, min_count=1, 
+                                 chunk_size=4)
+        self.assertEqual(len(reads), 10)
+        self.assertEqual(sum(reads), len(self.data))
+        series = self.data[:, 4, 4]
+        np.testing.assert_allclose(result[:, 4, 4], 
+                                   self.windows(series, 15, np.ma.mean), 
+                                   rtol=1e-6)
+
+class Quantile(synthetic.SyntheticCase):
+    ntime = 300
+
+    def expected(self, q, data=None):
+        data = self.data if data is None else data
+        return np.array([[np.percentile(data[:, i, j].compressed(), q)
+                          for j in range(data.shape[2])]
+                         for i in range(data.shape[1])])
+
+    def test_tiles(self):
+        coords = dict(top=45, bottom=-45, left=60, right=300)
+        data = self.obj.get_all_data(coords=coords)
+        # one row of the selection per tile
+        tiles = list(self.obj.iter_tiles(data[:, 0].nbytes, coords=coords))
+        self.assertEqual(len(tiles), data.shape[1])
+        joined = np.concatenate([tile for rows, tile in tiles], axis=1)
+        np.testing.assert_array_equal(joined, data)
+        # packed tiles sized for the float64 values they unpack to
+        row_bytes = data[:, 0].astype(np.float64).nbytes
+        tiles = list(self.obj.iter_tiles(2 * row_bytes, coords=coords,
+                                         dtype='packed', 
+                                         work_dtype=np.float64))
+        (pairs, odd) = divmod(data.shape[1], 2)
+        self.assertEqual([tile.shape[1] for rows, tile in tiles], 
+                         [2] * pairs + [1] * odd)
+
+    def test_exact(self):
+        from ccplib.algorithms import quantile
+        median = quantile.quantile(self.obj, tile_bytes=10000)
+        self.assertTrue(median.mask[0, 0] == False)
+        np.testing.assert_allclose(median, self.expected(50), rtol=1e-6)
+        high = quantile.quantile(self.obj, q=90)
+        np.testing.assert_allclose(high, self.expected(90), rtol=1e-6)
+
+    def test_approximate(self):
+        from ccplib.algorithms import quantile
+        median = quantile.quantile(self.obj, approximate=True, sketch=100)
+        # the sample has 100 of the ~270 values of a cell
+        error = np.abs(median - self.expected(50))[1:]
+        self.assertLess(np.median(error.compressed()), 0.2)
+        # with room for every value it's exact
+        whole = quantile.quantile(self.obj, approximate=True, sketch=300)
+        np.testing.assert_allclose(whole, self.expected(50), rtol=1e-5)
+
+class Correlation(synthetic.SyntheticCase):
+    def expected(self, x):
+        r = np.zeros(self.data.shape[1:])
+        for (i, j), value in np.ndenumerate(r):
+            y = self.data[:, i, j]
+            both = ~(np.ma.getmaskarray(x) | np.ma.getmaskarray(y))
+            r[i, j] = np.corrcoef(x[both], y[both])[0, 1]
+        return r
+
+    def test_point(self):
+        from ccplib.algorithms import correlation
+        # closest to 45N, -65 (295E)
+        r = correlation.correlation(self.obj, lat='44N', lon='65W', 
+                                    chunk_size=7)
+        expected = self.expected(self.data[:, 1, 6])
+        self.assertAlmostEqual(r[1, 6], 1.0)
+        self.assertTrue(r.mask[0, 0])
+        np.testing.assert_allclose(r[1:], expected[1:], rtol=1e-8)
+
+    def test_region(self):
+        from scipy import stats
+        from ccplib.algorithms import correlation
+        region = dict(top=15, bottom=-15, left=100, right=200)
+        x = self.data[:, 2:4, 2:5].reshape(len(self.data), -1).mean(axis=1)
+        parallel = correlation.correlation(self.obj, workers=3, **region)
+        np.testing.assert_allclose(parallel[1:], self.expected(x)[1:], 
+                                   rtol=1e-8)
+        pvalue = correlation.correlation(self.obj, out='pvalue', **region)
+        y = self.data[:, 4, 4]
+        both = ~y.mask
+        self.assertAlmostEqual(pvalue[4, 4], 
+                               stats.pearsonr(x[both], y[both])[1], 8)
+
+class EOF(synthetic.SyntheticCase):
+    def setUp(self):
+        from ccplib.algorithms import eof
+        synthetic.SyntheticCase.setUp(self)
+        (valid, data) = (self.valid, self.data.data)
+        mean = np.where(valid, data, 0).sum(axis=0) / valid.sum(axis=0)
+        self.weights = (np.sqrt(np.cos(np.radians(self.obj.lat)))[:, None] *
+                        np.ones(data.shape[1:]))
+        anomalies = np.where(valid, data - mean, 0) * self.weights
+        self.matrix = anomalies.reshape(len(data), -1)
+        self.saved = eof.EOFS
+        eof.EOFS = eof.EOFCache()
+
+    def tearDown(self):
+        from ccplib.algorithms import eof
+        eof.EOFS = self.saved
+        synthetic.SyntheticCase.tearDown(self)
+
+    def test_exact(self):
+        from ccplib.algorithms import eof
+        # as many random vectors as time steps, the SVD is exact
+        eofs = eof.EOFs.compute(self.obj, modes=3, oversample=40, 
+                                iterations=0, chunk_size=7)
+        (U, s, Vt) = np.linalg.svd(self.matrix, full_matrices=False)
+        np.testing.assert_allclose(eofs.variance, 
+                                   s[:3]**2 / (self.matrix**2).sum())
+        ntime = len(self.matrix)
+        for mode in range(3):
+            np.testing.assert_allclose(np.abs(eofs.pcs[:, mode]), 
+                                       np.abs(U[:, mode]) * np.sqrt(ntime),
+                                       atol=1e-6)
+        # the patterns times the pcs are the anomalies of the modes
+        modes = np.dot(U[:, :3] * s[:3], Vt[:3]).reshape(
+                                            (ntime,) + self.weights.shape)
+        rebuilt = np.tensordot(eofs.pcs, eofs.patterns, axes=1)
+        np.testing.assert_allclose(rebuilt[:, 1:], 
+                                   (modes / self.weights)[:, 1:], atol=1e-6)
+
+    def test_randomized(self):
+        from ccplib.algorithms import eof
+        (U, s, Vt) = np.linalg.svd(self.matrix, full_matrices=False)
+        pc = eof.eof(self.obj, out='pc')
+        self.assertEqual(pc.shape, (40,))
+        self.assertAlmostEqual(abs(np.dot(pc, U[:, 0])) / np.sqrt(40), 1, 4)
+        pattern = eof.eof(self.obj, out='eof', mode=2)
+        self.assertEqual(pattern.shape, (6, 8))
+        self.assertTrue(pattern.mask.sum() == 0)
+        self.assertEqual(eof.EOFS.stats()['computes'], 1)
+        self.assertEqual(eof.EOFS.stats()['hits'], 1)
+        eof.eof(self.obj, time_range=dict(start=[1880, 1], end=[1881, 12]))
+        self.assertEqual(eof.EOFS.stats()['computes'], 2)
+
+    def test_limits(self):
+        from ccplib.algorithms import eof
+        self.assertRaises(ValueError, eof.eof, self.obj, max_bytes=1000)
+        self.assertRaises(ValueError, eof.eof, self.obj, mode=4)
+        monthly = eof.eof(self.obj, out='variance', period='monthly')
+        self.assertEqual(monthly.shape, (3,))
+        self.assertTrue((np.diff(monthly) <= 0).all())
+
+class Spectral(synthetic.SyntheticCase):
+    ntime = 41
+
+    def test_periodogram(self):
+        from scipy import signal
+        from ccplib.algorithms import spectral
+        rand = np.random.RandomState(1)
+        for ntime in [40, 41]:
+            values = (rand.normal(size=(ntime, 5)) + 
+                      0.1 * np.arange(ntime)[:, None])
+            valid = np.ones(values.shape, bool)
+            for window in ['hann', 'boxcar']:
+                (freqs, expected) = signal.periodogram(values, window=window,
+                                                       detrend='linear', 
+                                                       axis=0)
+                power = spectral.periodogram(values, valid, 'linear', window)
+                np.testing.assert_allclose(power, expected, atol=1e-12)
+                np.testing.assert_allclose(spectral.frequencies(ntime), freqs)
+
+    def test_maps(self):
+        from ccplib.algorithms import spectral
+        # the power of every period is the variance (Parseval)
+        variance = spectral.spectral(self.obj, out='band', detrend='mean', 
+                                     window='boxcar', tile_bytes=200)
+        residuals = (self.data - self.data.mean(axis=0)).filled(0)
+        expected = (residuals**2).sum(axis=0) / len(self.data)
+        self.assertTrue(variance.mask[0, 0])
+        np.testing.assert_allclose(variance[1:], expected[1:], rtol=1e-6)
+        peak = spectral.spectral(self.obj, low=4, high=12, tile_bytes=200)
+        self.assertTrue(((peak[1:] >= 4) & (peak[1:] <= 12)).all())
+        np.testing.assert_allclose(peak, spectral.spectral(self.obj, low=4,
+                                                           high=12))
+        fraction = spectral.spectral(self.obj, out='fraction', low=2)
+        np.testing.assert_allclose(fraction[1:], 1.0)
+        self.assertRaises(ValueError, spectral.spectral, self.obj, low=50)
+
+    def test_tile_budget(self):
+        from ccplib.algorithms import spectral
+        widths = []
+        iter_tiles = self.obj.iter_tiles
+        def counted(*args, **kwargs):
+            for rows, data in iter_tiles(*args, **kwargs):
+                widths.append(data.shape[1])
+                yield rows, data
+        self.obj.iter_tiles = counted
+        # two rows of complex values
+        row_bytes = self.data[:, 0].size * np.dtype(np.complex128).itemsize
+        spectral.spectral(self.obj, tile_bytes=2 * row_bytes)
+        self.assertEqual(widths, [2, 2, 2])
+
+    def test_spectrum(self):
+        from scipy import signal
+        from ccplib.algorithms import spectral
+        region = dict(top=15, bottom=-15, left=100, right=200)
+        power = spectral.spectral(self.obj, out='spectrum', 
+                                  coords=region)
+        x = self.data[:, 2:4, 2:5].reshape(len(self.data), -1).mean(axis=1)
+        self.assertFalse(x.mask.any())
+        expected = signal.periodogram(x.data, window='hann', 
+                                      detrend='linear')[1]
+        np.testing.assert_allclose(power, expected, rtol=1e-6)
+
+class Extremes(synthetic.SyntheticCase):
+    def runs(self, exceeds):
+        """Lengths of the runs of every cell, by looping"""
+        lengths = np.empty(exceeds.shape[1:], object)
+        for cell in np.ndindex(*exceeds.shape[1:]):
+            (found, run) = ([], 0)
+            for value in exceeds[(slice(None),) + cell]:
+                if value:
+                    run += 1
+                elif run:
+                    (found, run) = (found + [run], 0)
+            lengths[cell] = found + [run] if run else found
+        return lengths
+
+    def test_counts(self):
+        from ccplib.algorithms import extremes
+        exceeds = self.valid & (self.data > 10.5)
+        count = extremes.extremes(self.obj, threshold=10.5, chunk_size=7)
+        np.testing.assert_array_equal(count, exceeds.sum(axis=0))
+        fraction = extremes.extremes(self.obj, threshold=10.5, 
+                                     out='fraction')
+        np.testing.assert_allclose(fraction, exceeds.sum(axis=0) / 
+                                   self.valid.sum(axis=0).astype(float))
+        below = extremes.extremes(self.obj, threshold=10.5, below=True)
+        np.testing.assert_array_equal(below, (self.valid & 
+                                              (self.data < 10.5)).sum(axis=0))
+
+    def test_runs(self):
+        from ccplib.algorithms import extremes
+        exceeds = self.valid & (self.data > 10.0)
+        lengths = self.runs(exceeds)
+        for chunk_size in [1, 3, 40]:
+            longest = extremes.extremes(self.obj, threshold=10, 
+                                        out='longest', chunk_size=chunk_size)
+            runs = extremes.extremes(self.obj, threshold=10, out='runs', 
+                                     min_run=3, chunk_size=chunk_size)
+            for cell, found in np.ndenumerate(lengths):
+                self.assertEqual(longest[cell], max(found + [0]))
+                self.assertEqual(runs[cell], 
+                                 len([run for run in found if run >= 3]))
+
+class RegionMean(synthetic.SyntheticCase):
+    def test_weighted(self):
+        from ccplib.algorithms import regional
+        weights = np.cos(np.radians(self.obj.lat))[:, None] * np.ones(8)
+        expected = np.ma.average(self.data.reshape(40, -1), axis=1,
+                                 weights=weights.ravel())
+        for chunk_size in [1, 7, None]:
+            series = regional.regionmean(self.obj, chunk_size=chunk_size)
+            self.assertEqual(series.shape, (40,))
+            np.testing.assert_allclose(series, expected)
+
+    def test_region(self):
+        from ccplib.algorithms import regional
+        region = dict(top=15, bottom=-45, left=100, right=200)
+        series = regional.regionmean(self.obj, coords=region, weighted=False,
+                                     time_range=dict(start=[1881, 1]))
+        expected = self.data[12:, 2:5, 2:5].reshape(28, -1).mean(axis=1)
+        np.testing.assert_allclose(series, expected)
+        # every cell missing
+        point = dict(top=75, bottom=75, left=20, right=20)
+        self.assertTrue(regional.regionmean(self.obj, coords=point).mask[2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -204,6 +204,171 @@ class mann(unittest.TestCase):
         ccp_data = ccp_obj.get_all_data()
         print "mann size", ccp_data.size
 
+
+class synthetic(unittest.TestCase):
+    """test cases for a small packed file written by the test
+    """
+    def setUp(self):
+        import tempfile
+        import scipy.io.netcdf
+        self.folder = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.folder, 'synthetic.nc')
+        nc = scipy.io.netcdf.netcdf_file(self.file_path, 'w')
+        nc.createDimension('time', 30)
+        nc.createDimension('lat', 18)
+        nc.createDimension('lon', 36)
+        time = nc.createVariable('time', 'f8', ('time',))
+        time.units = 'months since 1880-01-01'
+        time[:] = np.arange(30)
+        lat = nc.createVariable('lat', 'f4', ('lat',))
+        lat[:] = np.linspace(85, -85, 18)
+        lon = nc.createVariable('lon', 'f4', ('lon',))
+        lon[:] = np.arange(5, 360, 10)
+        temp = nc.createVariable('temp', 'i2', ('time', 'lat', 'lon'))
+        temp.scale_factor = 0.01
+        temp.add_offset = 1.0
+        temp[:] = np.arange(30*18*36).reshape(30, 18, 36) % 3000
+        nc.close()
+        self.obj = unpack.fromNetCDF(self.file_path, scrnlog=False, 
+                                     txtlog=False, create_folder=False)
+        
+    def tearDown(self):
+        import shutil
+        del self.obj
+        shutil.rmtree(self.folder)
+        
+    def test_unpacked(self):
+        data = self.obj.get_all_data()
+        self.assertEqual(data.shape, (30, 18, 36))
+        self.assertAlmostEqual(data[0, 0, 1], 1.01, 5)
+        
+    def test_selection_shape(self):
+        coords = dict(top=40, bottom=-40, left=100, right=200)
+        time_range = dict(start=[1880, 3], end=[1881, 2])
+        shape = self.obj.selection_shape(coords=coords, 
+                                         time_range=time_range)
+        data = self.obj.get_all_data(coords=coords, time_range=time_range)
+        self.assertEqual(shape, data.shape)
     
+    def test_iter_chunks(self):
+        coords = dict(top=40, bottom=-40, left=100, right=200)
+        data = self.obj.get_all_data(coords=coords)
+        chunks = list(self.obj.iter_chunks(chunk_size=7, coords=coords))
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(chunks[-1][0], slice(28, 30))
+        joined = np.concatenate([chunk for tslice, chunk in chunks])
+        np.testing.assert_array_equal(joined, data)
+        
+    def test_iter_chunks_rows(self):
+        data = self.obj.get_all_data()
+        chunks = self.obj.iter_chunks(chunk_size=4, rows=slice(5, 15))
+        joined = np.concatenate([chunk for tslice, chunk in chunks])
+        np.testing.assert_array_equal(joined, data[5:15])
+        
+    def test_unpack_dtype(self):
+        data = self.obj.get_all_data()
+        single = self.obj.get_all_data(dtype='float32')
+        self.assertEqual(single.dtype, np.float32)
+        np.testing.assert_allclose(single, data, rtol=1e-6)
+        packed = self.obj.get_all_data(dtype='packed')
+        self.assertEqual(packed.dtype, np.int16)
+        # the formula is linear, so reduced results can be unpacked
+        self.assertAlmostEqual(self.obj.unpack(packed.mean()), 
+                               data.mean(), 5)
+        
+    def test_missing(self):
+        import scipy.io.netcdf
+        from ccplib.algorithms import statistics
+        nc = scipy.io.netcdf.netcdf_file(self.file_path, 'a')
+        temp = nc.variables['temp']
+        temp.missing_value = -32767
+        packed = temp[:].copy()
+        packed[:10, 0, :] = -32767
+        temp[:] = packed
+        nc.close()
+        obj = unpack.fromNetCDF(self.file_path, scrnlog=False, 
+                                txtlog=False, create_folder=False)
+        expected = np.ma.masked_equal(packed, -32767) * 0.01 + 1.0
+        for dtype in [None, 'float32', 'float64']:
+            data = obj.get_all_data(dtype=dtype)
+            self.assertEqual(data[0, 0, 0], -32767)
+            mean = statistics.mean(obj, data)
+            self.assertFalse(mean.mask[10:, 0].any())
+            np.testing.assert_allclose(mean, expected.mean(axis=0), 
+                                       rtol=1e-5)
+        chunks = [chunk for tslice, chunk in obj.iter_chunks(chunk_size=4)]
+        np.testing.assert_array_equal(np.concatenate(chunks), 
+                                      obj.get_all_data())
+        
+    def test_slice_cache(self):
+        from ccplib.datahandlers import slicecache
+        time_range = dict(start=[1880, 5], end=[1880, 5])
+        first = self.obj.get_all_data(time_range=time_range)
+        inds = self.obj.get_inds(time_range, dict())
+        cached = slicecache.SLICES.get(slicecache.slice_key(self.obj, inds))
+        self.assertFalse(cached.flags.writeable)
+        np.testing.assert_array_equal(self.obj.get_all_data(
+                                            time_range=time_range), first)
+        
+    def test_prefetch(self):
+        from ccplib.datahandlers import slicecache
+        self.obj.prefetch = 2
+        coords = dict(top=40, bottom=-40, left=100, right=200)
+        # steps through time 3 and 4, then 5 and 6 should be read ahead
+        for step in [3, 4]:
+            time_range = dict(start=self.obj.time[step], 
+                              end=self.obj.time[step])
+            self.obj.get_all_data(time_range=time_range, coords=coords)
+        slicecache.PREFETCH.wait()
+        region = self.obj.get_inds(dict(), coords)[1:]
+        for step in [5, 6]:
+            inds = (slice(step, step + 1),) + region
+            key = slicecache.slice_key(self.obj, inds)
+            self.assertTrue(key in slicecache.SLICES)
+            np.testing.assert_array_equal(slicecache.SLICES.get(key), 
+                                          self.obj.read_slice(inds))
+    
+    def test_slice_cache_budget(self):
+        from ccplib.datahandlers import slicecache
+        cache = slicecache.SliceCache(max_bytes=200)
+        for i in range(3):
+            cache.put(i, np.zeros(10))
+        self.assertFalse(0 in cache)
+        self.assertEqual(cache.stats()['nbytes'], 160)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_shared_cache(self):
+        import gc
+        from ccplib.datahandlers import shmcache
+        shared = shmcache.SharedCache(os.path.join(self.folder, 'shm'),
+                                      max_bytes=2000)
+        held = shared.put('a', np.arange(100.))
+        self.assertIsInstance(held, np.memmap)
+        self.assertFalse(held.flags.writeable)
+        released = shared.put('b', np.arange(100.))
+        del released
+        gc.collect()
+        self.assertEqual(shared.stats()['held'], 1)
+        # b isn't held any more, so it's the one dropped
+        shared.put('c', np.arange(100.))
+        self.assertTrue('a' in shared)
+        self.assertFalse('b' in shared)
+        # another process reads what this one wrote
+        pid = os.fork()
+        if pid == 0:
+            data = shared.get('c')
+            os._exit(0 if np.all(data == np.arange(100.)) else 1)
+        (pid, status) = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
+
+    def test_slice_cache_shared(self):
+        from ccplib.datahandlers import slicecache, shmcache
+        shared = shmcache.SharedCache(os.path.join(self.folder, 'shm'))
+        cache = slicecache.SliceCache(shared=shared)
+        cache.put('a', np.arange(10.))
+        other = slicecache.SliceCache(shared=shared)
+        np.testing.assert_array_equal(other.get('a'), np.arange(10.))
+        self.assertEqual(other.stats()['shared']['hits'], 1)
+        
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+#
+# test_imports.py
+#
+# Hannah Aizenman, 2012-03
+#
+# http://www.opensource.org/licenses/bsd-license.php
+
+"""Guards the import time of ccplib and ccpweb: the datahandlers, the
+algorithms and the ccpweb tasks and views shouldn't load matplotlib,
+Basemap or coards. Each import runs in a fresh interpreter. How long they take is timed (against a budget) by
+benchmarks/bench.py, not here, where it depends on the machine.
+"""
+
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/2.7/library/os.html
+import os
+# http://docs.python.org/2.7/library/sys.html
+import sys
+# http://docs.python.org/2.7/library/json.html
+import json
+# http://docs.python.org/2.7/library/subprocess.html
+import subprocess
+# http://docs.python.org/2.7/library/unittest.html
+import unittest
+
+# ccpweb isn't installed as a package, it runs from its folder
+CCPWEB_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                           os.path.pardir, 'ccpweb'))
+# loaded when a graph is drawn or a time converted
+HEAVY = ['matplotlib', 'mpl_toolkits.basemap', 'mpl_toolkits.axes_grid',
+         'coards']
+
+SCRIPT = """
+import sys, json
+import {module}
+print(json.dumps([m for m in {heavy!r} if m in sys.modules]))
+"""
+
+def heavy_modules(module, path=None):
+    """Imports module in a new interpreter
+    :Return:
+        the heavy modules that were loaded
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(path or sys.path)
+    out = subprocess.check_output([sys.executable, '-W', 'ignore', '-c',
+                                   SCRIPT.format(module=module, heavy=HEAVY)],
+                                  env=env)
+    return json.loads(out.strip().splitlines()[-1])
+
+class ImportWeight(unittest.TestCase):
+    def assertLight(self, module, path=None):
+        heavy = heavy_modules(module, path)
+        self.assertEqual(heavy, [], "{} loads {}".format(module, heavy))
+
+    def test_datahandlers(self):
+        self.assertLight('ccplib.datahandlers.unpack')
+
+    def test_algorithms(self):
+        self.assertLight('ccplib.algorithms.algutils')
+
+    def test_ccpgraph(self):
+        # helpers like timestr_ind are used without drawing anything
+        self.assertLight('ccplib.visualization.ccpgraph')
+
+    def test_ccpweb(self):
+        # the workers import these before they draw anything
+        path = sys.path + [os.path.dirname(CCPWEB_PATH), CCPWEB_PATH]
+        self.assertLight('ccpweb.tasks', path)
+        self.assertLight('ccpweb.views', path)
+
+    def test_spatial(self):
+        heavy = heavy_modules('ccplib.visualization.spatial')
+        self.assertFalse('mpl_toolkits.basemap' in heavy)
+
+if __name__ == '__main__':
+    unittest.main()
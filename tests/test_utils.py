@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+#
+# test_utils.py
+#
+# Hannah Aizenman, 2012-03
+#
+# http://www.opensource.org/licenses/bsd-license.php
+
+"""Tests the logging setup in misc.utils
+"""
+
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/2.7/library/os.html
+import os
+# http://docs.python.org/2.7/library/shutil.html
+import shutil
+# http://docs.python.org/2.7/library/tempfile.html
+import tempfile
+# http://docs.python.org/2.7/library/logging.html
+import logging
+# http://docs.python.org/2.7/library/threading.html
+import threading
+# http://docs.python.org/2.7/library/unittest.html
+import unittest
+
+from ccplib.misc import utils
+
+class ListHandler(logging.Handler):
+    """Keeps the messages, optionally waiting on gate first"""
+    def __init__(self, gate=None):
+        logging.Handler.__init__(self)
+        self.messages = []
+        self.gate = gate
+        
+    def emit(self, record):
+        if self.gate is not None:
+            self.gate.wait()
+        self.messages.append(self.format(record))
+
+class Logging(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.log = logging.getLogger(utils.LOGNAME)
+        self.handlers = list(self.log.handlers)
+        self.level = self.log.level
+        self.propagate = self.log.propagate
+        
+    def tearDown(self):
+        for handler in list(self.log.handlers):
+            if handler not in self.handlers:
+                self.log.removeHandler(handler)
+                handler.close()
+        self.log.setLevel(self.level)
+        self.log.propagate = self.propagate
+        utils._HANDLERS.clear()
+        utils._QUEUED.clear()
+        shutil.rmtree(self.folder)
+        
+    def test_setup_once(self):
+        for i in range(3):
+            utils.setup_logging(self.folder, scrnlog=False, txtlog=True)
+        added = [h for h in self.log.handlers if h not in self.handlers]
+        self.assertEqual(len(added), 1)
+        # rolled over once, not on every call
+        self.assertEqual(sorted(os.listdir(os.path.join(self.folder, 'logs'))),
+                         ['ccplog.log', 'ccplog.log.1'])
+        
+    def test_level(self):
+        self.log.setLevel(logging.NOTSET)
+        utils.setup_logging(self.folder, scrnlog=True, txtlog=True)
+        # the lowest level of the handlers, not debug
+        self.assertEqual(self.log.level, logging.INFO)
+        self.assertFalse(self.log.isEnabledFor(logging.DEBUG))
+        self.assertFalse(self.log.propagate)
+        
+    def test_queue_before_setup(self):
+        # as the web app does, before the datasets are opened
+        utils.queue_logging([utils.LOGNAME])
+        utils.setup_logging(self.folder, scrnlog=False, txtlog=True)
+        added = [h for h in self.log.handlers if h not in self.handlers]
+        self.assertEqual(len(added), 1)
+        self.assertTrue(isinstance(added[0], utils.QueueHandler))
+        self.log.info("queued")
+        added[0].flush()
+        added[0].handlers[0].close()
+        with open(os.path.join(self.folder, 'logs', 'ccplog.log')) as f:
+            self.assertTrue('queued' in f.read())
+        
+    def test_no_handlers(self):
+        self.log.setLevel(logging.NOTSET)
+        utils.setup_logging(self.folder, scrnlog=False, txtlog=False)
+        self.assertEqual(self.log.level, logging.NOTSET)
+        
+    def test_queue_handler(self):
+        target = ListHandler()
+        queue_handler = utils.QueueHandler([target])
+        record = logging.LogRecord('test', logging.INFO, __file__, 1, 
+                                   "%s %s", ('a', 'b'), None)
+        queue_handler.handle(record)
+        queue_handler.flush()
+        self.assertEqual(target.messages, ['a b'])
+        
+    def test_queue_fork(self):
+        target = ListHandler()
+        queue_handler = utils.QueueHandler([target])
+        queue_handler.handle(logging.LogRecord('test', logging.INFO, 
+                                               __file__, 1, 'parent', 
+                                               None, None))
+        queue_handler.flush()
+        # as if the parent's thread were emitting when it forked
+        target.acquire()
+        try:
+            pid = os.fork()
+            if pid == 0:
+                status = 1
+                try:
+                    queue_handler.handle(logging.LogRecord(
+                        'test', logging.INFO, __file__, 1, 'child', 
+                        None, None))
+                    queue_handler.flush(timeout=2)
+                    if target.messages[-1:] == ['child']:
+                        status = 0
+                finally:
+                    os._exit(status)
+        finally:
+            target.release()
+        (pid, status) = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
+        
+    def test_queue_full(self):
+        release = threading.Event()
+        target = ListHandler(release)
+        queue_handler = utils.QueueHandler([target], maxsize=1)
+        for i in range(5):
+            record = logging.LogRecord('test', logging.INFO, __file__, 1, 
+                                       str(i), None, None)
+            queue_handler.handle(record)
+        release.set()
+        queue_handler.flush()
+        # the thread holds at most one and the queue one
+        self.assertTrue(queue_handler.dropped >= 3)
+        self.assertEqual(len(target.messages) + queue_handler.dropped, 5)
+
+if __name__ == '__main__':
+    unittest.main()